@@ -0,0 +1,261 @@
+"""
+Admission Control - Giới hạn lời gọi Gemini theo quota và số lời gọi đồng thời
+
+Trước đây mọi request đều gọi Gemini ngay; khi vượt quota Gemini trả 429 và service chỉ báo 503 sau khi
+lời gọi đã thất bại (vẫn tốn 1 lượt quota + thời gian chờ). Giờ mỗi lời gọi phải qua:
+- Token bucket theo quota (LLM_RATE_LIMIT_RPM, chia đều cho số worker prefork), cho phép burst nhỏ
+- Semaphore LLM_MAX_CONCURRENCY lời gọi đồng thời, tối đa LLM_MAX_QUEUE request chờ, mỗi request chờ
+  không quá LLM_QUEUE_TIMEOUT giây
+- Gemini trả 429 → cooldown theo retry delay của Gemini: trong lúc đó mọi lời gọi bị từ chối ngay
+
+Quá tải thì raise Overloaded (kèm retry_after) → endpoint trả 503 + header Retry-After.
+check() là kiểm tra nhanh "ở cửa" (không chờ, không lấy token): request chắc chắn bị từ chối thì
+bị loại trước khi tốn công retrieval.
+"""
+
+import asyncio
+import os
+import re
+import threading
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Callable, Deque, Dict, Optional, TypeVar
+
+from app_logging import get_logger
+from metrics import record_admission
+from prefork import get_worker_count
+
+logger = get_logger(__name__)
+
+LLM_RATE_LIMIT_RPM = float(os.getenv("LLM_RATE_LIMIT_RPM", "0"))  # quota request/phút của API key, 0 = không giới hạn
+LLM_RATE_BURST = int(os.getenv("LLM_RATE_BURST", "3"))
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "8"))
+LLM_MAX_QUEUE = int(os.getenv("LLM_MAX_QUEUE", "16"))
+LLM_QUEUE_TIMEOUT = float(os.getenv("LLM_QUEUE_TIMEOUT", "2"))  # giây
+LLM_RATE_LIMIT_COOLDOWN = float(os.getenv("LLM_RATE_LIMIT_COOLDOWN", "30"))  # giây, khi 429 không kèm retry delay
+
+T = TypeVar("T")
+
+# "Please retry in 23.5s" / "retry_delay { seconds: 23 }" trong lỗi 429 của Gemini
+_RETRY_DELAY_RE = re.compile(r"retry (?:in|after) ([\d.]+)\s*s|retry_delay\s*\{\s*seconds:\s*(\d+)", re.IGNORECASE)
+
+
+class Overloaded(Exception):
+    """Lời gọi LLM bị từ chối để bảo vệ quota / giới hạn tải"""
+
+    def __init__(self, reason: str, retry_after: float):
+        super().__init__(f"LLM overloaded ({reason}), retry after {retry_after:.1f}s")
+        self.reason = reason
+        self.retry_after = max(1.0, retry_after)
+
+
+def rate_limit_retry_after(error: BaseException) -> Optional[float]:
+    """
+    Số giây nên chờ nếu error là lỗi 429 / hết quota của Gemini, None nếu là lỗi khác.
+    Chỉ nhận theo loại lỗi / status code của SDK (ResourceExhausted, code/status_code = 429): nội dung lỗi
+    khác có thể chứa "429" hay "quota" (giá, mã sản phẩm, thông báo safety) mà không phải hết quota.
+    Nội dung lỗi chỉ dùng để đọc retry delay.
+    """
+    if not (type(error).__name__ == "ResourceExhausted" or getattr(error, "code", None) == 429
+            or getattr(error, "status_code", None) == 429):
+        return None
+    match = _RETRY_DELAY_RE.search(str(error))
+    return float(match.group(1) or match.group(2)) if match else LLM_RATE_LIMIT_COOLDOWN
+
+
+class TokenBucket:
+    """rate token/giây, tối đa burst token; rate <= 0 = không giới hạn"""
+
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.burst = max(1, burst)
+        self._tokens = float(self.burst)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now: float):
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def wait_time(self) -> float:
+        """Số giây tới khi có 1 token (0 = có ngay)"""
+        if self.rate <= 0:
+            return 0.0
+        with self._lock:
+            self._refill(time.monotonic())
+            return 0.0 if self._tokens >= 1 else (1 - self._tokens) / self.rate
+
+    def take(self) -> bool:
+        if self.rate <= 0:
+            return True
+        with self._lock:
+            self._refill(time.monotonic())
+            if self._tokens < 1:
+                return False
+            self._tokens -= 1
+            return True
+
+    def drain(self):
+        """Bỏ hết token đang có (Gemini vừa báo 429: burst còn lại chắc chắn cũng bị từ chối)"""
+        with self._lock:
+            self._tokens = 0.0
+            self._updated = time.monotonic()
+
+    def tokens(self) -> Optional[float]:
+        if self.rate <= 0:
+            return None
+        with self._lock:
+            self._refill(time.monotonic())
+            return round(self._tokens, 2)
+
+
+class AdmissionController:
+    def __init__(self, name: str, max_concurrency: int, max_queue: int, queue_timeout: float, bucket: TokenBucket):
+        self.name = name
+        self.max_concurrency = max(1, max_concurrency)
+        self.max_queue = max(0, max_queue)
+        self.queue_timeout = queue_timeout
+        self.bucket = bucket
+        self.in_flight = 0
+        self._waiters: Deque[asyncio.Future] = deque()
+        self._cooldown_until = 0.0
+        self.admitted = 0
+        self.rejected: Dict[str, int] = {}
+        self.rate_limited = 0  # số lần Gemini trả 429
+
+    def _reject(self, reason: str, retry_after: float) -> Overloaded:
+        self.rejected[reason] = self.rejected.get(reason, 0) + 1
+        record_admission(f"rejected_{reason}")
+        logger.info("[ADMISSION] %s rejected (%s), retry after %.1fs", self.name, reason, retry_after)
+        return Overloaded(reason, retry_after)
+
+    def _cooldown_remaining(self) -> float:
+        return max(0.0, self._cooldown_until - time.monotonic())
+
+    def check(self):
+        """Kiểm tra nhanh trước khi xử lý request (không chờ, không lấy slot/token): raise Overloaded nếu chắc chắn bị từ chối"""
+        cooldown = self._cooldown_remaining()
+        if cooldown > 0:
+            raise self._reject("cooldown", cooldown)
+        if self.in_flight >= self.max_concurrency and len(self._waiters) >= self.max_queue:
+            raise self._reject("queue_full", self.queue_timeout)
+        wait = self.bucket.wait_time()
+        if wait > self.queue_timeout:
+            raise self._reject("rate", wait)
+
+    async def acquire(self):
+        """Lấy 1 slot + 1 token, chờ tối đa queue_timeout giây; raise Overloaded nếu không được"""
+        started = time.monotonic()
+        cooldown = self._cooldown_remaining()
+        if cooldown > 0:
+            raise self._reject("cooldown", cooldown)
+
+        if self.in_flight < self.max_concurrency and not self._waiters:
+            self.in_flight += 1
+        else:
+            if len(self._waiters) >= self.max_queue:
+                raise self._reject("queue_full", self.queue_timeout)
+            waiter = asyncio.get_running_loop().create_future()
+            self._waiters.append(waiter)
+            try:
+                await asyncio.wait({waiter}, timeout=self.queue_timeout)
+            except asyncio.CancelledError:
+                # Client ngắt kết nối khi đang chờ: trả lại slot nếu vừa được chuyển cho request này
+                if waiter.done():
+                    self.release()
+                else:
+                    waiter.cancel()
+                    self._waiters.remove(waiter)
+                raise
+            if not waiter.done():
+                waiter.cancel()
+                self._waiters.remove(waiter)
+                raise self._reject("timeout", self.queue_timeout)
+            # release() đã chuyển slot của nó cho request này (in_flight giữ nguyên)
+
+        # Có slot → chờ token trong phần thời gian còn lại
+        try:
+            while not self.bucket.take():
+                wait = self.bucket.wait_time()
+                if time.monotonic() - started + wait > self.queue_timeout:
+                    raise self._reject("rate", wait)
+                await asyncio.sleep(wait)
+        except BaseException:
+            self.release()
+            raise
+        self.admitted += 1
+        record_admission("admitted")
+
+    def release(self):
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)  # chuyển slot cho request chờ lâu nhất
+                return
+        self.in_flight -= 1
+
+    @asynccontextmanager
+    async def slot(self) -> AsyncIterator[None]:
+        await self.acquire()
+        try:
+            yield
+        finally:
+            self.release()
+
+    def observe_error(self, error: BaseException):
+        """Gemini trả 429 → cooldown theo retry delay, các lời gọi sau bị từ chối ngay thay vì đốt thêm quota"""
+        retry_after = rate_limit_retry_after(error)
+        if retry_after is None:
+            return
+        self.rate_limited += 1
+        record_admission("rate_limited")
+        self._cooldown_until = max(self._cooldown_until, time.monotonic() + retry_after)
+        self.bucket.drain()
+        logger.warning("[ADMISSION] %s rate limited by Gemini, cooling down for %.1fs", self.name, retry_after)
+
+    async def run(self, fn: Callable[[], T]) -> T:
+        """Gọi fn (blocking, chạy trong thread) khi được nhận; lỗi 429 của fn bật cooldown"""
+        async with self.slot():
+            try:
+                return await asyncio.to_thread(fn)
+            except Exception as e:
+                self.observe_error(e)
+                raise
+
+    def stats(self) -> Dict:
+        return {
+            "in_flight": self.in_flight,
+            "queued": len(self._waiters),
+            "max_concurrency": self.max_concurrency,
+            "max_queue": self.max_queue,
+            "rate_per_min": round(self.bucket.rate * 60, 2) if self.bucket.rate > 0 else None,
+            "tokens": self.bucket.tokens(),
+            "cooldown_s": round(self._cooldown_remaining(), 1),
+            "admitted": self.admitted,
+            "rejected": dict(self.rejected),
+            "rate_limited": self.rate_limited,
+        }
+
+
+_llm_admission: Optional[AdmissionController] = None
+
+
+def get_llm_admission() -> AdmissionController:
+    """
+    Tạo lúc dùng lần đầu (trong worker, sau fork): quota tính theo API key → mỗi worker dùng
+    1 phần quota theo số worker serve() thực sự chạy
+    """
+    global _llm_admission
+    if _llm_admission is None:
+        workers = get_worker_count()
+        _llm_admission = AdmissionController(
+            "llm",
+            LLM_MAX_CONCURRENCY,
+            LLM_MAX_QUEUE,
+            LLM_QUEUE_TIMEOUT,
+            TokenBucket(LLM_RATE_LIMIT_RPM / 60 / workers, LLM_RATE_BURST),
+        )
+        logger.info("[ADMISSION] llm: concurrency=%s queue=%s rate=%s/min per worker (%s workers)",
+                    LLM_MAX_CONCURRENCY, LLM_MAX_QUEUE, round(LLM_RATE_LIMIT_RPM / workers, 2) or "unlimited", workers)
+    return _llm_admission
@@ -0,0 +1,116 @@
+"""
+Logging - Log có cấu trúc, theo level, ghi ở background thread
+
+- Mọi logger của service nằm dưới namespace "phonify" (không đụng tới logger của uvicorn)
+- LOG_LEVEL mặc định WARNING: production gần như không tốn chi phí log; DEBUG hiện đầy đủ trace retrieval
+- LOG_FORMAT=json → mỗi dòng là 1 JSON object (ts, level, logger, request_id, msg)
+- Mỗi request có request id (header X-Request-ID hoặc tự sinh) gắn vào mọi dòng log của request đó
+- Handler đẩy record vào queue, 1 thread riêng mới ghi ra stdout → không ghi I/O đồng bộ trên event loop
+"""
+
+import atexit
+import json
+import logging
+import os
+import queue
+import sys
+import time
+from contextvars import ContextVar, Token
+from logging.handlers import QueueHandler, QueueListener
+from typing import Dict, Optional
+
+ROOT_LOGGER = "phonify"
+
+_request_id: ContextVar[str] = ContextVar("request_id", default="-")
+_listener: Optional[QueueListener] = None
+_queue: Optional["queue.SimpleQueue[logging.LogRecord]"] = None
+_format = "text"
+
+
+class RequestIdFilter(logging.Filter):
+    """Gắn request id của context hiện tại vào record (chạy ở thread gọi log, trước khi vào queue)"""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.request_id = _request_id.get()
+        return True
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        payload = {
+            "ts": time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(record.created)) + f".{int(record.msecs):03d}Z",
+            "level": record.levelname,
+            "logger": record.name,
+            "request_id": getattr(record, "request_id", "-"),
+            "msg": record.getMessage(),
+        }
+        if record.exc_info:
+            payload["exc"] = self.formatException(record.exc_info)
+        return json.dumps(payload, ensure_ascii=False)
+
+
+def setup_logging(level: Optional[str] = None, fmt: Optional[str] = None):
+    """Cấu hình logger "phonify" (gọi 1 lần lúc khởi động, gọi lại không có tác dụng)"""
+    global _listener, _queue, _format
+    if _listener is not None:
+        return
+    level = (level or os.getenv("LOG_LEVEL", "WARNING")).upper()
+    fmt = (fmt or os.getenv("LOG_FORMAT", "text")).lower()
+
+    stream = sys.stdout
+    if hasattr(stream, "reconfigure"):
+        try:
+            stream.reconfigure(encoding="utf-8", errors="replace")  # tiếng Việt trên Windows console
+        except Exception:
+            pass
+    stream_handler = logging.StreamHandler(stream)
+    if fmt == "json":
+        stream_handler.setFormatter(JsonFormatter())
+    else:
+        stream_handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)-7s [%(request_id)s] %(name)s: %(message)s"))
+
+    _queue = queue.SimpleQueue()
+    _format = fmt
+    queue_handler = QueueHandler(_queue)
+    queue_handler.addFilter(RequestIdFilter())
+
+    root = logging.getLogger(ROOT_LOGGER)
+    root.setLevel(level)
+    root.handlers = [queue_handler]
+    root.propagate = False
+
+    _listener = QueueListener(_queue, stream_handler)
+    _listener.start()
+    atexit.register(stop_logging)
+
+
+def stop_logging():
+    """Ghi nốt các record còn trong queue rồi dừng thread ghi log"""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+def get_logger(name: str) -> logging.Logger:
+    return logging.getLogger(f"{ROOT_LOGGER}.{name}")
+
+
+def set_request_id(request_id: str) -> Token:
+    return _request_id.set(request_id)
+
+
+def reset_request_id(token: Token):
+    _request_id.reset(token)
+
+
+def get_request_id() -> str:
+    return _request_id.get()
+
+
+def get_logging_status() -> Dict:
+    return {
+        "level": logging.getLevelName(logging.getLogger(ROOT_LOGGER).getEffectiveLevel()),
+        "format": _format,
+        "queued": _queue.qsize() if _queue is not None else 0,
+    }
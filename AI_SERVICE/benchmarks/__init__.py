@@ -0,0 +1,10 @@
+"""
+Benchmarks - Đo hiệu năng AI service không cần Node backend và Gemini thật
+
+- fixtures.py: catalog/review tổng hợp (tất định theo seed) với kích thước tùy chọn
+- stub_backend.py: backend giả lập các endpoint /api/v1/internal/*/search
+- fake_llm.py: LLM giả lập tất định, độ trễ cấu hình được
+- chat_load.py: chạy tải /api/v1/chat theo từng kịch bản, báo cáo p50/p95/p99 và req/s
+
+Chạy trong thư mục AI_SERVICE: python -m benchmarks.chat_load --help
+"""
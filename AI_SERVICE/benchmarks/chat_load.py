@@ -0,0 +1,245 @@
+"""
+Chat Load - Benchmark thông lượng /api/v1/chat với backend và LLM giả lập
+
+Khởi động trong cùng process: stub backend (catalog tổng hợp) + AI service thật (uvicorn, có startup hook),
+Gemini được thay bằng FakeGenerativeModel qua llm_client.set_model_factory. Mỗi kịch bản gửi --requests
+request với --concurrency request song song, báo cáo req/s (chỉ request thành công), p50/p95/p99
+và số lỗi theo status code (503 = admission control từ chối...).
+
+Kịch bản:
+- product_search: câu hỏi sản phẩm đa dạng (brand, model, khoảng giá, tính năng), tắt semantic cache
+- policy: câu hỏi chính sách (dùng data/policies), tắt semantic cache
+- image: gửi ảnh, LLM giả lập nhận diện ra tên sản phẩm trong catalog
+- cache_hit: cùng 1 câu hỏi lặp lại, semantic cache bật và đã được làm nóng
+
+Chạy trong thư mục AI_SERVICE:
+    python -m benchmarks.chat_load --catalog-size 500 --llm-latency-ms 300 --concurrency 16 --requests 200
+    python -m benchmarks.chat_load --scenarios product_search,cache_hit --json results.json
+"""
+
+import argparse
+import asyncio
+import base64
+import io
+import json
+import math
+import os
+import socket
+import threading
+import time
+from typing import Callable, Dict, List, NamedTuple, Optional
+
+import httpx
+import uvicorn
+
+from benchmarks.fake_llm import fake_model_factory
+from benchmarks.fixtures import BASE_MODELS, make_catalog, make_reviews
+from benchmarks.stub_backend import create_app
+
+SCENARIOS = ("product_search", "policy", "image", "cache_hit")
+
+POLICY_QUESTIONS = (
+    "Chính sách bảo hành như thế nào?",
+    "Đổi trả trong bao nhiêu ngày?",
+    "Shop có giao hàng COD không?",
+    "Bảo hành màn hình có mất phí không?",
+    "What is the return policy?",
+    "Thời gian giao hàng bao lâu?",
+)
+CACHE_HIT_QUESTION = "điện thoại samsung dưới 10 triệu"
+
+
+class ScenarioResult(NamedTuple):
+    name: str
+    requests: int
+    errors: Dict[str, int]  # {status code hoặc tên exception: số request lỗi}
+    elapsed: float
+    latencies: List[float]  # giây, chỉ request thành công
+
+    def percentile(self, pct: float) -> float:
+        if not self.latencies:
+            return 0.0
+        ordered = sorted(self.latencies)
+        return ordered[max(0, math.ceil(pct / 100 * len(ordered)) - 1)]  # nearest-rank
+
+    def to_dict(self) -> Dict:
+        return {
+            "scenario": self.name,
+            "requests": self.requests,
+            "errors": sum(self.errors.values()),
+            "errors_by_status": dict(sorted(self.errors.items())),
+            "rps": round(len(self.latencies) / self.elapsed, 2) if self.elapsed else 0.0,
+            "p50_ms": round(self.percentile(50) * 1000, 1),
+            "p95_ms": round(self.percentile(95) * 1000, 1),
+            "p99_ms": round(self.percentile(99) * 1000, 1),
+            "mean_ms": round(sum(self.latencies) / len(self.latencies) * 1000, 1) if self.latencies else 0.0,
+        }
+
+
+def product_questions() -> List[str]:
+    questions = []
+    for brand, _, models in BASE_MODELS:
+        for model, _ in models:
+            questions.append(f"{brand} {model} giá bao nhiêu")
+        for budget in (5, 10, 20):
+            questions.append(f"điện thoại {brand.lower()} dưới {budget} triệu")
+        questions.append(f"{brand} phone under 15 million")
+    questions += ["điện thoại chụp hình xuyên màn đêm", "điện thoại pin trâu chơi game", "máy gập nhỏ gọn"]
+    return questions
+
+
+def _sample_image() -> str:
+    import PIL.Image
+    buffer = io.BytesIO()
+    PIL.Image.new("RGB", (64, 64), (40, 40, 40)).save(buffer, format="PNG")
+    return "data:image/png;base64," + base64.b64encode(buffer.getvalue()).decode("ascii")
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_server(app, port: int) -> uvicorn.Server:
+    """Chạy app bằng uvicorn ở thread riêng (có event loop riêng), chờ tới khi nhận request"""
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning"))
+    threading.Thread(target=server.run, daemon=True).start()
+    deadline = time.time() + 30
+    while not server.started:
+        if time.time() > deadline:
+            raise RuntimeError(f"Server on port {port} did not start")
+        time.sleep(0.05)
+    return server
+
+
+async def wait_until_ready(client: httpx.AsyncClient, url: str, timeout: float):
+    """Chờ worker warm-up xong (/ready trả 200) như load balancer"""
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        response = await client.get(f"{url}/ready")
+        if response.status_code == 200:
+            return response.json()
+        await asyncio.sleep(0.5)
+    raise RuntimeError(f"AI service not ready: {response.json()}")
+
+
+async def run_scenario(client: httpx.AsyncClient, url: str, name: str, payload_fn: Callable[[int], Dict],
+                       total: int, concurrency: int) -> ScenarioResult:
+    latencies: List[float] = []
+    errors: Dict[str, int] = {}
+    next_index = 0
+
+    async def worker():
+        nonlocal next_index
+        while next_index < total:
+            i = next_index
+            next_index += 1
+            started = time.perf_counter()
+            try:
+                response = await client.post(f"{url}/api/v1/chat", json=payload_fn(i))
+                status = str(response.status_code)
+            except httpx.HTTPError as e:
+                status = type(e).__name__
+            if status == "200":
+                latencies.append(time.perf_counter() - started)
+            else:
+                errors[status] = errors.get(status, 0) + 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return ScenarioResult(name, total, errors, time.perf_counter() - started, latencies)
+
+
+async def run(args) -> List[ScenarioResult]:
+    products = make_catalog(args.catalog_size, seed=args.seed)
+    backend_port, service_port = _free_port(), _free_port()
+    # Warm-up của service đồng bộ catalog từ BACKEND_URL → trỏ vào stub trước khi import main,
+    # CATALOG_SYNC_LIMIT đủ lớn để service dùng toàn bộ catalog tổng hợp
+    os.environ["BACKEND_URL"] = f"http://127.0.0.1:{backend_port}"
+    os.environ["CATALOG_SYNC_LIMIT"] = str(args.catalog_size)
+    import catalog
+    import main
+    from llm_client import set_model_factory
+
+    start_server(create_app(products, make_reviews(products, seed=args.seed), args.backend_latency_ms), backend_port)
+    set_model_factory(fake_model_factory(args.llm_latency_ms, args.llm_jitter_ms, products[0]["name"]))
+    start_server(main.app, service_port)
+
+    backend_url = f"http://127.0.0.1:{backend_port}"
+    url = f"http://127.0.0.1:{service_port}"
+    questions = product_questions()
+    image = _sample_image()
+    scenarios: Dict[str, Callable[[int], Dict]] = {
+        "product_search": lambda i: {"message": questions[i % len(questions)], "backendUrl": backend_url},
+        "policy": lambda i: {"message": POLICY_QUESTIONS[i % len(POLICY_QUESTIONS)], "backendUrl": backend_url},
+        "image": lambda i: {"message": "Máy này là máy gì?", "image": image, "backendUrl": backend_url},
+        "cache_hit": lambda i: {"message": CACHE_HIT_QUESTION, "backendUrl": backend_url},
+    }
+
+    results = []
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    async with httpx.AsyncClient(timeout=args.timeout, limits=limits) as client:
+        await wait_until_ready(client, url, args.ready_timeout)
+        synced = catalog.get_catalog(backend_url)
+        if synced is None or len(synced.products) != args.catalog_size:
+            raise RuntimeError(f"Service synced {len(synced.products) if synced else 0} products, "
+                               f"expected --catalog-size {args.catalog_size}")
+        for name in args.scenarios:
+            # Chỉ kịch bản cache_hit dùng semantic cache, các kịch bản khác đo đường xử lý đầy đủ
+            main.SEMANTIC_CACHE_ENABLED = name == "cache_hit"
+            await run_scenario(client, url, name, scenarios[name], args.warmup, 1)
+            result = await run_scenario(client, url, name, scenarios[name], args.requests, args.concurrency)
+            results.append(result)
+            print(_format_row(result.to_dict()), flush=True)
+    return results
+
+
+def _format_row(row: Dict) -> str:
+    line = (f"{row['scenario']:<16}{row['requests']:>8}{row['errors']:>8}{row['rps']:>10.1f}"
+            f"{row['p50_ms']:>10.1f}{row['p95_ms']:>10.1f}{row['p99_ms']:>10.1f}")
+    if row["errors_by_status"]:
+        line += "  errors: " + ", ".join(f"{status}={n}" for status, n in row["errors_by_status"].items())
+    return line
+
+
+def parse_args(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Benchmark /api/v1/chat với backend và LLM giả lập")
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS),
+                        type=lambda s: [x for x in s.split(",") if x], help=f"Trong {', '.join(SCENARIOS)}")
+    parser.add_argument("--catalog-size", type=int, default=500)
+    parser.add_argument("--requests", type=int, default=200, help="Số request mỗi kịch bản")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--warmup", type=int, default=5, help="Số request làm nóng (không tính) mỗi kịch bản")
+    parser.add_argument("--llm-latency-ms", type=float, default=300.0)
+    parser.add_argument("--llm-jitter-ms", type=float, default=0.0)
+    parser.add_argument("--backend-latency-ms", type=float, default=20.0)
+    parser.add_argument("--timeout", type=float, default=60.0)
+    parser.add_argument("--ready-timeout", type=float, default=300.0)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--json", dest="json_path", help="Ghi kết quả ra file JSON")
+    args = parser.parse_args(argv)
+    unknown = set(args.scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"Unknown scenarios: {', '.join(sorted(unknown))}")
+    return args
+
+
+def main(argv: Optional[List[str]] = None):
+    args = parse_args(argv)
+    # Service đọc cấu hình lúc import: đặt trước khi import main
+    os.environ.setdefault("GEMINI_API_KEY", "benchmark")
+    os.environ.setdefault("LOG_LEVEL", "WARNING")
+
+    print(f"catalog={args.catalog_size} llm={args.llm_latency_ms:.0f}ms backend={args.backend_latency_ms:.0f}ms "
+          f"concurrency={args.concurrency} requests={args.requests}")
+    print(f"{'scenario':<16}{'requests':>8}{'errors':>8}{'req/s':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    results = asyncio.run(run(args))
+    if args.json_path:
+        with open(args.json_path, "w", encoding="utf-8") as f:
+            json.dump({"config": {k: v for k, v in vars(args).items() if k != "json_path"},
+                       "results": [r.to_dict() for r in results]}, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
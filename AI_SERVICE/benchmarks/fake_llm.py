@@ -0,0 +1,69 @@
+"""
+Fake LLM - Thay Gemini trong benchmark (đăng ký qua llm_client.set_model_factory)
+
+Cùng interface với GenerativeModel ở những chỗ service dùng: generate_content() và
+start_chat(history).send_message(). Câu trả lời và độ trễ chỉ phụ thuộc nội dung prompt
+→ chạy lại cho cùng kết quả. Lời gọi là blocking (time.sleep) giống SDK thật.
+"""
+
+import re
+import time
+import zlib
+from typing import List, Optional
+
+_QUESTION_RE = re.compile(r'Câu hỏi: "([^"]*)"')
+
+
+class FakeResponse:
+    def __init__(self, text: str):
+        self.text = text
+        self.usage_metadata = None  # service tự ước lượng token khi không có usage
+
+
+class FakeChat:
+    def __init__(self, model: "FakeGenerativeModel", history: Optional[List[dict]]):
+        self.model = model
+        self.history = list(history or [])
+
+    def send_message(self, message: str) -> FakeResponse:
+        self.model.sleep_for(message)
+        return FakeResponse("Dạ, dựa trên thông tin cửa hàng, đây là các sản phẩm phù hợp với nhu cầu của anh/chị.")
+
+
+class FakeGenerativeModel:
+    def __init__(self, model_name: str, system_instruction: Optional[str] = None, latency_ms: float = 300.0,
+                 jitter_ms: float = 0.0, vision_answer: str = "Samsung Galaxy S24 Ultra"):
+        self.model_name = model_name
+        self.system_instruction = system_instruction
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.vision_answer = vision_answer
+        self.calls = 0
+
+    def sleep_for(self, prompt: str):
+        self.calls += 1
+        jitter = zlib.crc32(prompt.encode("utf-8")) % (int(self.jitter_ms) + 1) if self.jitter_ms else 0
+        time.sleep((self.latency_ms + jitter) / 1000)
+
+    def generate_content(self, contents) -> FakeResponse:
+        if isinstance(contents, (list, tuple)):
+            # [prompt, ảnh] → nhận diện ảnh
+            self.sleep_for(str(contents[0]))
+            return FakeResponse(self.vision_answer)
+        prompt = str(contents)
+        self.sleep_for(prompt)
+        question = _QUESTION_RE.search(prompt)
+        if question:
+            # Trích xuất từ khóa tìm kiếm
+            return FakeResponse(" ".join(w for w in question.group(1).lower().split() if len(w) > 1)[:50])
+        return FakeResponse("Khách đang tìm hiểu điện thoại và hỏi về giá, cấu hình.")
+
+    def start_chat(self, history: Optional[List[dict]] = None) -> FakeChat:
+        return FakeChat(self, history)
+
+
+def fake_model_factory(latency_ms: float = 300.0, jitter_ms: float = 0.0, vision_answer: str = "Samsung Galaxy S24 Ultra"):
+    """Factory cho llm_client.set_model_factory"""
+    def factory(model_name: str, system_instruction: Optional[str]) -> FakeGenerativeModel:
+        return FakeGenerativeModel(model_name, system_instruction, latency_ms, jitter_ms, vision_answer)
+    return factory
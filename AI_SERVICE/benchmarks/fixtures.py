@@ -0,0 +1,88 @@
+"""
+Fixtures - Catalog sản phẩm và review tổng hợp cho benchmark
+
+Cùng seed → cùng dữ liệu, kết quả giữa các lần chạy so sánh được với nhau.
+"""
+
+import random
+from typing import Dict, List
+
+# (brand, category, [(model, giá gốc VNĐ)])
+BASE_MODELS = (
+    ("Samsung", "Samsung", [("Galaxy S24 Ultra", 29990000), ("Galaxy S24", 19990000), ("Galaxy A55", 9490000),
+                            ("Galaxy A15", 4490000), ("Galaxy Z Flip5", 21990000), ("Galaxy Z Fold5", 36990000)]),
+    ("iPhone", "Apple", [("15 Pro Max", 32990000), ("15 Pro", 27990000), ("15", 21990000),
+                         ("14", 17990000), ("13", 13990000), ("SE 2022", 9990000)]),
+    ("Xiaomi", "Xiaomi", [("14 Ultra", 29990000), ("Redmi Note 13 Pro", 7290000), ("Redmi Note 13", 4890000),
+                          ("Redmi 13C", 2990000), ("Poco X6 Pro", 8990000)]),
+    ("OPPO", "OPPO", [("Find N3 Flip", 22990000), ("Reno11 F", 8990000), ("A58", 4690000), ("A18", 3290000)]),
+    ("vivo", "vivo", [("V30e", 9490000), ("Y36", 5290000), ("Y17s", 3490000)]),
+    ("realme", "realme", [("12 Pro+", 11990000), ("C67", 4990000), ("Note 50", 2690000)]),
+)
+
+STORAGES = ("128GB", "256GB", "512GB")
+STORAGE_PRICE_STEP = 0.12  # mỗi bậc bộ nhớ đắt hơn ~12%
+
+FEATURES = (
+    "camera chụp đêm xuất sắc, chụp hình xuyên màn đêm rõ nét",
+    "pin 5000mAh dùng cả ngày, sạc nhanh 67W",
+    "màn hình AMOLED 120Hz sắc nét, hiển thị ngoài trời tốt",
+    "chip hiệu năng cao, chơi game mượt không nóng máy",
+    "thiết kế mỏng nhẹ, cầm nắm thoải mái",
+    "zoom quang học 5x, quay video 4K chống rung",
+    "màn hình gập độc đáo, nhỏ gọn khi gập lại",
+    "giá rẻ, phù hợp học sinh sinh viên",
+)
+
+REVIEW_COMMENTS = (
+    "Máy dùng rất mượt, pin trâu",
+    "Camera chụp đẹp, nhất là ban đêm",
+    "Giao hàng nhanh, đóng gói cẩn thận",
+    "Máy hơi nóng khi chơi game lâu",
+    "Màn hình đẹp, loa to rõ",
+    "Giá hợp lý so với cấu hình",
+)
+
+
+def make_catalog(size: int, seed: int = 42) -> List[Dict]:
+    """size sản phẩm với tên không trùng (model × bộ nhớ, hết tổ hợp thì thêm số đời "Gen N")"""
+    rng = random.Random(seed)
+    combos = [(brand, category, model, price, storage_idx)
+              for brand, category, models in BASE_MODELS
+              for model, price in models
+              for storage_idx in range(len(STORAGES))]
+    products = []
+    for i in range(size):
+        brand, category, model, base_price, storage_idx = combos[i % len(combos)]
+        generation = i // len(combos)
+        name = f"{brand} {model} {STORAGES[storage_idx]}"
+        if generation:
+            name += f" Gen {generation + 1}"
+        price = int(base_price * (1 + STORAGE_PRICE_STEP * storage_idx) * (1 + 0.05 * generation)) // 10000 * 10000
+        sale_price = price - rng.choice((0, 0, 500000, 1000000))
+        features = rng.sample(FEATURES, 2)
+        products.append({
+            "productId": f"p{i:05d}",
+            "name": name,
+            "category": category,
+            "description": f"{name}: {features[0]}; {features[1]}.",
+            "price": price,
+            "salePrice": sale_price,
+            "stockQuantity": rng.randint(0, 50),
+            "options": [{"_id": f"o{i:05d}-{s}", "storage": s} for s in STORAGES[:storage_idx + 1]],
+            "thumbnail": f"https://img.example.com/{i:05d}.jpg",
+        })
+    return products
+
+
+def make_reviews(products: List[Dict], per_product: int = 2, seed: int = 42) -> List[Dict]:
+    rng = random.Random(seed)
+    reviews = []
+    for p in products:
+        for _ in range(per_product):
+            reviews.append({
+                "product": {"name": p["name"]},
+                "rating": rng.randint(3, 5),
+                "comment": rng.choice(REVIEW_COMMENTS),
+            })
+    return reviews
@@ -0,0 +1,103 @@
+"""
+Import Time - Đo thời gian import main (cold start của worker) theo từng package
+
+Chạy `python -X importtime -c "import main"` trong process con (module cache sạch), cộng thời gian
+"self" của mọi module theo package top-level và in ra các package tốn thời gian nhất.
+Các thư viện nặng (torch, sentence_transformers, PyPDF2, PIL, SDK Gemini...) phải được import
+lười lúc dùng lần đầu / trong warm-up → exit code 1 nếu chúng bị import ngay khi import main:
+    python -m benchmarks.import_time
+    python -m benchmarks.import_time --module rag_service --top 20 --json import_time.json
+"""
+
+import argparse
+import json
+import os
+import re
+import subprocess
+import sys
+from typing import Dict, List, NamedTuple, Optional
+
+HEAVY_MODULES = ("torch", "sentence_transformers", "transformers", "google.generativeai", "PyPDF2", "PIL")
+
+_LINE_RE = re.compile(r"^import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)$")
+SERVICE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class ImportRecord(NamedTuple):
+    module: str
+    self_us: int
+    cumulative_us: int
+    depth: int
+
+
+def parse_importtime(stderr: str) -> List[ImportRecord]:
+    records = []
+    for line in stderr.splitlines():
+        match = _LINE_RE.match(line)
+        if match:
+            self_us, cumulative_us, indent, module = match.groups()
+            records.append(ImportRecord(module, int(self_us), int(cumulative_us), len(indent) // 2))
+    return records
+
+
+def measure(module: str) -> List[ImportRecord]:
+    env = dict(os.environ, HF_HUB_OFFLINE=os.environ.get("HF_HUB_OFFLINE", "1"))
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=SERVICE_DIR, env=env, capture_output=True, text=True,
+    )
+    if proc.returncode != 0:
+        raise RuntimeError(f"import {module} failed:\n{proc.stderr[-2000:]}")
+    return parse_importtime(proc.stderr)
+
+
+def by_package(records: List[ImportRecord]) -> Dict[str, int]:
+    """Tổng thời gian self (µs) theo package top-level, giảm dần"""
+    totals: Dict[str, int] = {}
+    for r in records:
+        package = r.module.split(".")[0]
+        totals[package] = totals.get(package, 0) + r.self_us
+    return dict(sorted(totals.items(), key=lambda item: item[1], reverse=True))
+
+
+def heavy_imported(records: List[ImportRecord]) -> List[str]:
+    loaded = {r.module for r in records}
+    return [name for name in HEAVY_MODULES if name in loaded]
+
+
+def parse_args(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Thời gian import của service theo package (-X importtime)")
+    parser.add_argument("--module", default="main", help="Module cần đo (import từ thư mục AI_SERVICE)")
+    parser.add_argument("--top", type=int, default=15, help="Số package hiển thị")
+    parser.add_argument("--json", dest="json_path", help="Ghi kết quả ra file JSON")
+    return parser.parse_args(argv)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args = parse_args(argv)
+    records = measure(args.module)
+    total_us = next((r.cumulative_us for r in reversed(records) if r.module == args.module and r.depth == 0), 0)
+    packages = by_package(records)
+    heavy = heavy_imported(records)
+
+    print(f"import {args.module}: {total_us / 1000:.1f} ms, {len(records)} modules")
+    print(f"{'package':<32}{'self ms':>10}{'share':>8}")
+    for package, self_us in list(packages.items())[:args.top]:
+        share = self_us / total_us * 100 if total_us else 0.0
+        print(f"{package:<32}{self_us / 1000:>10.1f}{share:>7.1f}%")
+
+    if args.json_path:
+        with open(args.json_path, "w", encoding="utf-8") as f:
+            json.dump({"module": args.module, "total_ms": round(total_us / 1000, 1), "modules": len(records),
+                       "packages_ms": {k: round(v / 1000, 2) for k, v in packages.items()}, "heavy": heavy},
+                      f, ensure_ascii=False, indent=2)
+
+    if heavy:
+        print(f"HEAVY IMPORT at import time: {', '.join(heavy)}")
+        return 1
+    print("No heavy dependencies imported at import time")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
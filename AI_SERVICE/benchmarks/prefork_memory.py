@@ -0,0 +1,155 @@
+"""
+Prefork Memory - Đo RAM mỗi worker khi chạy nhiều worker (AI_SERVICE_WORKERS > 1)
+
+Khởi động service thật (`python main.py`, process con) với backend giả lập chạy trong process này,
+chờ mọi worker warm-up xong rồi đọc /proc/<pid>/smaps_rollup của master và từng worker:
+- rss: tính cả trang dùng chung → không cộng được giữa các worker
+- pss: trang dùng chung chia đều cho các process → tổng pss ≈ RAM thực sự của cả nhóm
+- private: phần riêng của worker = RAM tốn thêm khi thêm 1 worker
+
+So sánh 2 chế độ: preload (master nạp model/embedding rồi fork, worker dùng chung copy-on-write)
+và no_preload (PREFORK_PRELOAD=0: mỗi worker tự nạp như uvicorn --workers).
+Exit code 1 nếu private trung bình mỗi worker ở chế độ preload vượt --max-worker-private-mb.
+Cần embedding model + cross-encoder đã có trong cache local (giống retrieval_eval). Chỉ chạy trên Linux:
+    python -m benchmarks.prefork_memory --workers 4
+    python -m benchmarks.prefork_memory --workers 4 --modes preload --max-worker-private-mb 250
+"""
+
+import argparse
+import json
+import os
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Dict, List, Optional
+
+import httpx
+
+from benchmarks.chat_load import _free_port, start_server
+from benchmarks.fixtures import make_catalog, make_reviews
+from benchmarks.stub_backend import create_app
+
+SERVICE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MODES = ("preload", "no_preload")
+
+
+def wait_for_workers(url: str, workers: int, timeout: float) -> Dict[int, Dict]:
+    """
+    Gọi /health bằng kết nối mới mỗi lần (kernel chia cho worker bất kỳ) tới khi thấy đủ worker đã ready.
+    Trả về {pid: /health của worker đó}
+    """
+    ready: Dict[int, Dict] = {}
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            health = httpx.get(f"{url}/health", headers={"Connection": "close"}, timeout=5).json()
+            if health.get("ready"):
+                ready[health["process"]["pid"]] = health
+        except httpx.HTTPError:
+            pass
+        if len(ready) >= workers:
+            return ready
+        time.sleep(0.1)
+    raise RuntimeError(f"Only {len(ready)}/{workers} workers ready after {timeout:.0f}s")
+
+
+def run_mode(mode: str, args, backend_url: str) -> Dict:
+    from prefork import list_worker_pids, process_memory
+
+    port = _free_port()
+    env = dict(os.environ, AI_SERVICE_WORKERS=str(args.workers), AI_SERVICE_PORT=str(port), BACKEND_URL=backend_url,
+               PREFORK_PRELOAD="1" if mode == "preload" else "0", CATALOG_SYNC_LIMIT=str(args.catalog_size))
+    env.setdefault("HF_HUB_OFFLINE", "1")
+    env.setdefault("LOG_LEVEL", "WARNING")
+    started = time.perf_counter()
+    # Log của service ghi ra file tạm, chỉ in ra khi lỗi
+    with tempfile.TemporaryFile("w+", encoding="utf-8", errors="replace") as log:
+        proc = subprocess.Popen([sys.executable, "main.py"], cwd=SERVICE_DIR, env=env, stdout=log, stderr=subprocess.STDOUT)
+        try:
+            ready = wait_for_workers(f"http://127.0.0.1:{port}", args.workers, args.ready_timeout)
+            for pid, health in ready.items():
+                synced = health["catalog"]["catalogs"].get(backend_url, {}).get("products", 0)
+                if synced != args.catalog_size:
+                    raise RuntimeError(f"Worker {pid} synced {synced} products, expected --catalog-size {args.catalog_size}")
+            startup_s = time.perf_counter() - started
+            time.sleep(args.settle)
+            master = process_memory(str(proc.pid))
+            workers = [process_memory(str(pid)) for pid in list_worker_pids(proc.pid)]
+        except Exception:
+            log.seek(0)
+            print(log.read()[-4000:])
+            raise
+        finally:
+            proc.send_signal(signal.SIGTERM)
+            try:
+                proc.wait(timeout=30)
+            except subprocess.TimeoutExpired:
+                proc.kill()
+
+    def avg(key: str) -> float:
+        return round(sum(w[key] for w in workers) / len(workers), 1) if workers else 0.0
+
+    return {
+        "mode": mode,
+        "workers": len(workers),
+        "startup_s": round(startup_s, 1),
+        "master": master,
+        "worker_rss_mb": avg("rss_mb"),
+        "worker_pss_mb": avg("pss_mb"),
+        "worker_private_mb": avg("private_mb"),
+        "total_pss_mb": round(master.get("pss_mb", 0) + sum(w["pss_mb"] for w in workers), 1),
+    }
+
+
+def parse_args(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="RAM mỗi worker ở chế độ prefork (có/không preload)")
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--modes", default=",".join(MODES), type=lambda s: [x for x in s.split(",") if x],
+                        help=f"Trong {', '.join(MODES)}")
+    parser.add_argument("--catalog-size", type=int, default=500)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--ready-timeout", type=float, default=600.0)
+    parser.add_argument("--settle", type=float, default=2.0, help="Giây chờ sau khi ready trước khi đo")
+    parser.add_argument("--max-worker-private-mb", type=float, default=300.0,
+                        help="Mục tiêu RAM riêng trung bình mỗi worker ở chế độ preload")
+    parser.add_argument("--json", dest="json_path", help="Ghi kết quả ra file JSON")
+    args = parser.parse_args(argv)
+    unknown = set(args.modes) - set(MODES)
+    if unknown:
+        parser.error(f"Unknown modes: {', '.join(sorted(unknown))}")
+    return args
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args = parse_args(argv)
+    products = make_catalog(args.catalog_size, seed=args.seed)
+    backend_port = _free_port()
+    start_server(create_app(products, make_reviews(products, seed=args.seed), 0.0), backend_port)
+    backend_url = f"http://127.0.0.1:{backend_port}"
+
+    print(f"workers={args.workers} catalog={args.catalog_size}")
+    print(f"{'mode':<12}{'startup s':>10}{'master rss':>12}{'worker rss':>12}{'worker pss':>12}"
+          f"{'worker priv':>13}{'total pss':>11}")
+    results = []
+    for mode in args.modes:
+        row = run_mode(mode, args, backend_url)
+        results.append(row)
+        print(f"{mode:<12}{row['startup_s']:>10.1f}{row['master'].get('rss_mb', 0):>12.1f}{row['worker_rss_mb']:>12.1f}"
+              f"{row['worker_pss_mb']:>12.1f}{row['worker_private_mb']:>13.1f}{row['total_pss_mb']:>11.1f}", flush=True)
+
+    if args.json_path:
+        with open(args.json_path, "w", encoding="utf-8") as f:
+            json.dump({"config": {k: v for k, v in vars(args).items() if k != "json_path"}, "results": results},
+                      f, ensure_ascii=False, indent=2)
+
+    over = [r for r in results if r["mode"] == "preload" and r["worker_private_mb"] > args.max_worker_private_mb]
+    if over:
+        print(f"OVER TARGET: worker private {over[0]['worker_private_mb']:.1f} MB > {args.max_worker_private_mb:.0f} MB")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,272 @@
+"""
+Retrieval Eval - Micro-benchmark tốc độ + chất lượng các hàm retrieval, chạy offline
+
+Đo trên catalog tổng hợp (benchmarks/fixtures.py) và data/policies/policies.pdf với bộ câu hỏi có nhãn
+(benchmarks/retrieval_queries.py), không cần Node backend hay Gemini (embedding model lấy từ cache local):
+- vector_search_products (sau prefilter giá như retrieve_context): latency, recall@k, MRR
+- keyword_fallback (extract_search_term + lọc theo từ khóa như backend): latency, recall@k, MRR
+- prefilter_products_by_price (kèm extract_price_intent): latency, precision (tỉ lệ sản phẩm giữ lại đúng tầm giá)
+- search_policies_vector / policy_keyword_search: latency, recall@k, MRR
+
+So với baseline để chặn regression trước khi deploy (exit code 1 nếu recall/MRR/precision giảm
+hoặc p95 tăng quá ngưỡng). Exit code 2 nếu embedding model không load được (kết quả sẽ chỉ là keyword
+fallback, không so được) hoặc baseline được đo bằng embedding model khác:
+    python -m benchmarks.retrieval_eval --save-baseline benchmarks/retrieval_baseline.json
+    python -m benchmarks.retrieval_eval --baseline benchmarks/retrieval_baseline.json
+"""
+
+import argparse
+import asyncio
+import json
+import math
+import os
+import sys
+import tempfile
+import time
+from typing import Callable, Dict, List, Optional, Sequence
+
+from benchmarks.fixtures import make_catalog
+from benchmarks.retrieval_queries import POLICY_QUERIES, PRICE_QUERIES, PRODUCT_QUERIES, PolicyQuery, PriceQuery, ProductQuery
+
+QUALITY_KEYS = ("recall@k", "mrr", "precision")
+
+
+def _percentile(values: Sequence[float], pct: float) -> float:
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(pct / 100 * len(ordered)) - 1)] if ordered else 0.0
+
+
+def _folded(text: str) -> str:
+    from text_utils import fold_text
+    return fold_text(text or "")
+
+
+def is_relevant_product(product: Dict, q: ProductQuery) -> bool:
+    from catalog import parse_price
+    name, desc = _folded(product.get("name")), _folded(product.get("description"))
+    if not (any(s in name for s in q.name_contains) or any(s in desc for s in q.desc_contains)):
+        return False
+    price = parse_price(product)
+    return (q.max_price is None or price <= q.max_price) and (q.min_price is None or price >= q.min_price)
+
+
+def is_relevant_chunk(chunk: Dict, q: PolicyQuery) -> bool:
+    section = _folded(chunk.get("section")).replace(" ", "")
+    return any(s in section for s in q.sections)
+
+
+def rank_metrics(ranked: List, relevant: Callable[[object], bool], total_relevant: int, k: int) -> Dict[str, float]:
+    """recall@k (chia cho min(số liên quan, k)) và reciprocal rank của kết quả liên quan đầu tiên"""
+    hits = [relevant(item) for item in ranked[:k]]
+    first = next((i for i, hit in enumerate(hits) if hit), None)
+    return {
+        "recall@k": sum(hits) / min(total_relevant, k) if total_relevant else 0.0,
+        "mrr": 1.0 / (first + 1) if first is not None else 0.0,
+    }
+
+
+class FunctionReport:
+    """Latency + các chỉ số chất lượng (trung bình theo câu hỏi) của 1 hàm"""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.latencies: List[float] = []
+        self.quality: Dict[str, List[float]] = {}
+        self.skipped = 0
+
+    def add_quality(self, metrics: Dict[str, float]):
+        for key, value in metrics.items():
+            self.quality.setdefault(key, []).append(value)
+
+    def to_dict(self) -> Dict:
+        row = {
+            "queries": len(next(iter(self.quality.values()), [])),
+            "skipped": self.skipped,
+            "p50_ms": round(_percentile(self.latencies, 50) * 1000, 3),
+            "p95_ms": round(_percentile(self.latencies, 95) * 1000, 3),
+        }
+        for key, values in self.quality.items():
+            row[key] = round(sum(values) / len(values), 4) if values else 0.0
+        return row
+
+
+async def _timed(report: FunctionReport, repeat: int, fn: Callable):
+    """Gọi fn repeat lần (sync hoặc async), ghi latency từng lần, trả kết quả lần cuối"""
+    result = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = fn()
+        if asyncio.iscoroutine(result):
+            result = await result
+        report.latencies.append(time.perf_counter() - started)
+    return result
+
+
+async def evaluate(args) -> Dict[str, Dict]:
+    import catalog
+    import policy_store
+    import rag_service
+
+    products = make_catalog(args.catalog_size, seed=args.seed)
+    price_index = catalog.PriceIndex(products)
+    k, repeat = args.k, args.repeat
+
+    # Làm nóng: load embedding model + embedding toàn catalog (không tính vào latency)
+    started = time.perf_counter()
+    await rag_service.vector_search_products("warmup", products, top_k=k)
+    warmup_s = time.perf_counter() - started
+    if rag_service.get_embedding_model() is None:
+        raise RuntimeError(f"Embedding model {rag_service.EMBEDDING_MODEL_NAME} not loaded "
+                           f"({rag_service.get_embedding_model_status().get('error')})")
+
+    # Index chính sách build vào thư mục tạm để không đụng tới cache của service
+    with tempfile.TemporaryDirectory() as index_dir:
+        policy_index = policy_store.ingest_policies(
+            rag_service.generate_embeddings, rag_service.EMBEDDING_MODEL_NAME, args.policy_folder, index_dir
+        )
+    if policy_index.embeddings is None:
+        raise RuntimeError(f"Policy index from {args.policy_folder} has no embeddings")
+
+    reports = {name: FunctionReport(name) for name in (
+        "vector_search_products", "keyword_fallback", "prefilter_products_by_price",
+        "search_policies_vector", "policy_keyword_search",
+    )}
+
+    for q in PRODUCT_QUERIES:
+        relevant = lambda item, q=q: is_relevant_product(item, q)
+        total_relevant = sum(1 for p in products if relevant(p))
+        if not total_relevant:
+            reports["vector_search_products"].skipped += 1
+            reports["keyword_fallback"].skipped += 1
+            continue
+
+        condition, value = rag_service.extract_price_intent(q.query)
+        candidates = rag_service.prefilter_products_by_price(products, condition, value, price_index)
+        results = await _timed(reports["vector_search_products"], repeat,
+                               lambda: rag_service.vector_search_products(q.query, candidates, top_k=k))
+        reports["vector_search_products"].add_quality(rank_metrics([p for p, _ in results], relevant, total_relevant, k))
+
+        def keyword_fallback():
+            term = rag_service.extract_search_term(q.query)
+            found = rag_service._filter_products_by_term(products, term) if term else products
+            return rag_service.prefilter_products_by_price(found, condition, value)
+        results = await _timed(reports["keyword_fallback"], repeat, keyword_fallback)
+        reports["keyword_fallback"].add_quality(rank_metrics(results, relevant, total_relevant, k))
+
+    for q in PRICE_QUERIES:
+        in_range = lambda p, q=q: _price_ok(catalog.parse_price(p), q)
+        kept = await _timed(reports["prefilter_products_by_price"], repeat, lambda: rag_service.prefilter_products_by_price(
+            products, *rag_service.extract_price_intent(q.query), price_index))
+        reports["prefilter_products_by_price"].add_quality({
+            "precision": sum(1 for p in kept if in_range(p)) / len(kept) if kept else 0.0,
+        })
+
+    for q in POLICY_QUERIES:
+        relevant = lambda chunk, q=q: is_relevant_chunk(chunk, q)
+        total_relevant = sum(1 for c in policy_index.chunks if relevant(c))
+        if not total_relevant:
+            reports["search_policies_vector"].skipped += 1
+            reports["policy_keyword_search"].skipped += 1
+            continue
+        results = await _timed(reports["search_policies_vector"], repeat,
+                               lambda: rag_service.search_policies_vector(q.query, top_k=k))
+        reports["search_policies_vector"].add_quality(rank_metrics(results, relevant, total_relevant, k))
+        ids = await _timed(reports["policy_keyword_search"], repeat,
+                           lambda: policy_store.keyword_search(policy_index, q.query, k))
+        reports["policy_keyword_search"].add_quality(
+            rank_metrics([policy_index.chunks[i] for i in ids], relevant, total_relevant, k))
+
+    print(f"warmup (model + {len(products)} product embeddings): {warmup_s:.1f}s, policy chunks: {len(policy_index.chunks)}")
+    return {name: report.to_dict() for name, report in reports.items()}
+
+
+def _price_ok(price: int, q: PriceQuery) -> bool:
+    return (q.max_price is None or price <= q.max_price) and (q.min_price is None or price >= q.min_price)
+
+
+def compare(results: Dict[str, Dict], baseline: Dict[str, Dict], max_quality_drop: float,
+            max_latency_ratio: float, min_latency_delta_ms: float) -> List[str]:
+    """Danh sách regression so với baseline (rỗng = đạt)"""
+    regressions = []
+    for name, row in results.items():
+        base = baseline.get(name)
+        if not base:
+            continue
+        for key in QUALITY_KEYS:
+            if key in row and key in base and row[key] < base[key] - max_quality_drop:
+                regressions.append(f"{name}: {key} {base[key]:.3f} → {row[key]:.3f}")
+        # Hàm dưới 1ms dao động tương đối lớn → chỉ tính regression khi tăng cả theo tỉ lệ lẫn tuyệt đối
+        if (base.get("p95_ms") and row["p95_ms"] > base["p95_ms"] * max_latency_ratio
+                and row["p95_ms"] - base["p95_ms"] > min_latency_delta_ms):
+            regressions.append(f"{name}: p95 {base['p95_ms']:.2f}ms → {row['p95_ms']:.2f}ms")
+    return regressions
+
+
+def print_table(results: Dict[str, Dict], k: int):
+    print(f"{'function':<30}{'queries':>8}{'p50 ms':>10}{'p95 ms':>10}{f'recall@{k}':>11}{'MRR':>8}{'precision':>11}")
+    for name, row in results.items():
+        cells = "".join(f"{row[key]:>{w}.3f}" if key in row else f"{'-':>{w}}"
+                        for key, w in (("recall@k", 11), ("mrr", 8), ("precision", 11)))
+        print(f"{name:<30}{row['queries']:>8}{row['p50_ms']:>10.3f}{row['p95_ms']:>10.3f}{cells}")
+
+
+def parse_args(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Micro-benchmark + recall cho các hàm retrieval (offline)")
+    parser.add_argument("--catalog-size", type=int, default=200)
+    parser.add_argument("--k", type=int, default=5, help="Số kết quả tính recall@k / MRR")
+    parser.add_argument("--repeat", type=int, default=5, help="Số lần gọi mỗi hàm cho mỗi câu hỏi (đo latency)")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--policy-folder", default=os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data", "policies"))
+    parser.add_argument("--json", dest="json_path", help="Ghi kết quả ra file JSON")
+    parser.add_argument("--save-baseline", help="Ghi kết quả làm baseline")
+    parser.add_argument("--baseline", help="So với baseline, exit 1 nếu có regression")
+    parser.add_argument("--max-quality-drop", type=float, default=0.02, help="Mức giảm recall/MRR/precision tối đa")
+    parser.add_argument("--max-latency-ratio", type=float, default=1.5, help="p95 tối đa so với baseline (lần)")
+    parser.add_argument("--min-latency-delta-ms", type=float, default=1.0, help="Mức tăng p95 tối thiểu mới tính regression")
+    return parser.parse_args(argv)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args = parse_args(argv)
+    from app_logging import setup_logging
+    setup_logging()
+    from rag_service import EMBEDDING_MODEL_NAME
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+        baseline_model = baseline.get("config", {}).get("embedding_model")
+        if baseline_model != EMBEDDING_MODEL_NAME:
+            print(f"ERROR: baseline was measured with embedding model {baseline_model}, not {EMBEDDING_MODEL_NAME}")
+            return 2
+    try:
+        results = asyncio.run(evaluate(args))
+    except RuntimeError as e:
+        print(f"ERROR: {e}")
+        return 2
+    print_table(results, args.k)
+
+    payload = {"config": {"catalog_size": args.catalog_size, "k": args.k, "repeat": args.repeat, "seed": args.seed,
+                          "embedding_model": EMBEDDING_MODEL_NAME},
+               "results": results}
+    for path in (args.json_path, args.save_baseline):
+        if path:
+            with open(path, "w", encoding="utf-8") as f:
+                json.dump(payload, f, ensure_ascii=False, indent=2)
+
+    if baseline is not None:
+        if baseline.get("config", {}).get("k") != args.k:
+            print(f"Warning: baseline k={baseline.get('config', {}).get('k')} differs from k={args.k}")
+        regressions = compare(results, baseline.get("results", {}), args.max_quality_drop, args.max_latency_ratio,
+                              args.min_latency_delta_ms)
+        for line in regressions:
+            print(f"REGRESSION {line}")
+        if regressions:
+            return 1
+        print("No regressions against baseline")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
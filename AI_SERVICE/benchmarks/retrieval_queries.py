@@ -0,0 +1,81 @@
+"""
+Retrieval Queries - Bộ câu hỏi có nhãn (Việt/Anh) để đo chất lượng retrieval
+
+Nhãn được viết dưới dạng điều kiện trên dữ liệu (chuỗi con của tên/mô tả đã bỏ dấu, khoảng giá,
+section của chính sách) thay vì id cố định → vẫn đúng với catalog tổng hợp ở mọi kích thước
+và khi policies.pdf được cập nhật (câu hỏi không khớp chunk nào sẽ bị bỏ qua khi chấm).
+"""
+
+from typing import NamedTuple, Optional, Tuple
+
+
+class ProductQuery(NamedTuple):
+    query: str
+    lang: str
+    name_contains: Tuple[str, ...] = ()   # liên quan nếu tên chứa 1 trong các chuỗi (đã bỏ dấu, lowercase)
+    desc_contains: Tuple[str, ...] = ()   # hoặc mô tả chứa 1 trong các chuỗi
+    max_price: Optional[int] = None
+    min_price: Optional[int] = None
+
+
+class PriceQuery(NamedTuple):
+    query: str
+    max_price: Optional[int] = None  # điều kiện giá khách thực sự yêu cầu
+    min_price: Optional[int] = None
+
+
+class PolicyQuery(NamedTuple):
+    query: str
+    lang: str
+    sections: Tuple[str, ...]  # liên quan nếu section của chunk (bỏ dấu, bỏ khoảng trắng) chứa 1 chuỗi
+
+
+PRODUCT_QUERIES = (
+    ProductQuery("Samsung Galaxy S24 Ultra", "vi", name_contains=("galaxy s24 ultra",)),
+    ProductQuery("iPhone 15 Pro Max giá bao nhiêu", "vi", name_contains=("iphone 15 pro max",)),
+    ProductQuery("xiaomi redmi note 13 pro còn hàng không", "vi", name_contains=("redmi note 13 pro",)),
+    ProductQuery("oppo reno11 f", "vi", name_contains=("reno11 f",)),
+    ProductQuery("vivo v30e có tốt không", "vi", name_contains=("vivo v30e",)),
+    ProductQuery("realme 12 pro+", "vi", name_contains=("realme 12 pro",)),
+    ProductQuery("galaxy z fold5 256gb", "vi", name_contains=("z fold5 256gb",)),
+    ProductQuery("iPhone 13 128GB", "vi", name_contains=("iphone 13 128gb",)),
+    ProductQuery("điện thoại chụp hình xuyên màn đêm", "vi", desc_contains=("chup hinh xuyen man dem",)),
+    ProductQuery("máy pin trâu sạc nhanh", "vi", desc_contains=("pin 5000mah",)),
+    ProductQuery("điện thoại gập nhỏ gọn", "vi", name_contains=("flip", "fold"), desc_contains=("man hinh gap",)),
+    ProductQuery("máy chơi game mượt không nóng", "vi", desc_contains=("choi game muot",)),
+    ProductQuery("điện thoại samsung dưới 10 triệu", "vi", name_contains=("samsung",), max_price=10_000_000),
+    ProductQuery("iphone trên 25 triệu", "vi", name_contains=("iphone",), min_price=25_000_000),
+    ProductQuery("phone with the best night camera", "en", desc_contains=("chup dem",)),
+    ProductQuery("foldable samsung phone", "en", name_contains=("z flip", "z fold")),
+    ProductQuery("long battery life with fast charging", "en", desc_contains=("pin 5000mah",)),
+    ProductQuery("Xiaomi 14 Ultra price", "en", name_contains=("xiaomi 14 ultra",)),
+    ProductQuery("cheap phone for students", "en", desc_contains=("hoc sinh sinh vien",)),
+)
+
+PRICE_QUERIES = (
+    PriceQuery("điện thoại dưới 10 triệu", max_price=10_000_000),
+    PriceQuery("máy dưới 5 triệu", max_price=5_000_000),
+    PriceQuery("điện thoại trên 20 triệu", min_price=20_000_000),
+    PriceQuery("từ 15 triệu", min_price=15_000_000),
+    PriceQuery("khoảng 8 triệu", min_price=5_600_000, max_price=10_400_000),
+    PriceQuery("tầm 12tr", min_price=8_400_000, max_price=15_600_000),
+    PriceQuery("duoi 3 trieu", max_price=3_000_000),
+)
+
+POLICY_QUERIES = (
+    PolicyQuery("Bảo hành bao lâu?", "vi", ("chedobaohanhtieuchuan",)),
+    PolicyQuery("How long is the warranty?", "en", ("chedobaohanhtieuchuan",)),
+    PolicyQuery("Gói bảo hành mở rộng Phonify Care+ có gì?", "vi", ("phonifycare",)),
+    PolicyQuery("Khi nào được thay pin miễn phí?", "vi", ("thaythepin",)),
+    PolicyQuery("Trường hợp nào bị từ chối bảo hành?", "vi", ("tuchoibaohanh",)),
+    PolicyQuery("Máy lỗi trong 7 ngày đầu có được đổi không?", "vi", ("doitratrong07ngay",)),
+    PolicyQuery("Trả máy lấy lại tiền mất phí bao nhiêu?", "vi", ("hoantien",)),
+    PolicyQuery("Thu cũ đổi mới như thế nào?", "vi", ("trade-in", "tradein")),
+    PolicyQuery("Do you have a trade-in program?", "en", ("trade-in", "tradein")),
+    PolicyQuery("Phí giao hàng bao nhiêu, có miễn phí vận chuyển không?", "vi", ("chiphivathoigianvanchuyen",)),
+    PolicyQuery("What are the shipping costs?", "en", ("chiphivathoigianvanchuyen",)),
+    PolicyQuery("Có được mở hộp kiểm tra trước khi nhận hàng không?", "vi", ("dongkiem",)),
+    PolicyQuery("Trả góp 0% qua thẻ tín dụng", "vi", ("thetindung",)),
+    PolicyQuery("Trả góp chỉ cần CCCD được không?", "vi", ("congtytaichinh",)),
+    PolicyQuery("Shop có bảo mật thông tin cá nhân không?", "vi", ("baomatdulieu",)),
+)
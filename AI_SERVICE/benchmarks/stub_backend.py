@@ -0,0 +1,43 @@
+"""
+Stub Backend - Giả lập các endpoint nội bộ của Node backend mà AI service gọi
+
+- GET /api/v1/internal/products/search?search=&limit=  → {"data": {"products": [...]}}
+- GET /api/v1/internal/reviews/search?search=          → {"data": {"reviews": [...]}}
+Lọc theo từ khóa giống backend (chứa chuỗi trong tên/category), độ trễ mỗi request cấu hình được.
+"""
+
+import asyncio
+from typing import Dict, List, Optional
+
+from fastapi import FastAPI
+
+
+def create_app(products: List[Dict], reviews: List[Dict], latency_ms: float = 0.0) -> FastAPI:
+    app = FastAPI(title="Phonify backend stub")
+    app.state.calls = {"products": 0, "reviews": 0}
+
+    async def delay():
+        if latency_ms > 0:
+            await asyncio.sleep(latency_ms / 1000)
+
+    @app.get("/api/v1/internal/products/search")
+    async def search_products(search: Optional[str] = None, limit: Optional[int] = None):
+        app.state.calls["products"] += 1
+        await delay()
+        result = products
+        if search:
+            term = search.lower()
+            result = [p for p in products if term in p["name"].lower() or term in p["category"].lower()]
+        if limit:
+            result = result[:limit]
+        return {"success": True, "data": {"products": result}}
+
+    @app.get("/api/v1/internal/reviews/search")
+    async def search_reviews(search: Optional[str] = None):
+        app.state.calls["reviews"] += 1
+        await delay()
+        words = [w for w in (search or "").lower().split() if len(w) > 1]
+        result = [r for r in reviews if any(w in r["product"]["name"].lower() for w in words)]
+        return {"success": True, "data": {"reviews": result[:20]}}
+
+    return app
@@ -0,0 +1,289 @@
+"""
+Catalog - Cache catalog sản phẩm + dữ liệu dẫn xuất tính sẵn lúc đồng bộ
+
+Khi sản phẩm từ backend đi vào catalog, mỗi sản phẩm được chuẩn hóa 1 lần thành ProductCard
+(bất biến): product id, option id đầu tiên, giá đã parse, thumbnail fallback...
+Lúc trả response chỉ cần tra card theo id, không parse lại dict thô của backend ở mỗi request.
+
+Catalog toàn bộ (dùng cho vector search) được cache theo backend URL và đồng bộ lại sau CATALOG_TTL giây,
+kèm PriceIndex (giá sắp xếp tăng dần) để lọc theo khoảng giá / tìm giá gần nhất bằng bisect,
+ProductTrie để tra tên model ra sản phẩm, danh sách brand lấy từ tên/category thực tế của catalog
+và FuzzyIndex trên từ vựng brand/model để sửa lỗi gõ.
+"""
+
+import os
+import time
+import threading
+from bisect import bisect_left, bisect_right
+from typing import Dict, FrozenSet, List, NamedTuple, Optional, Tuple
+
+from fuzzy_index import FuzzyIndex
+from product_trie import ProductTrie, TrieMatch
+from text_utils import folded_tokens
+from app_logging import get_logger
+
+logger = get_logger(__name__)
+
+CATALOG_TTL = float(os.getenv("CATALOG_TTL", "60"))  # giây
+CATALOG_SYNC_LIMIT = int(os.getenv("CATALOG_SYNC_LIMIT", "50"))  # số sản phẩm tối đa lấy từ backend mỗi lần đồng bộ
+PLACEHOLDER_THUMBNAIL = "https://via.placeholder.com/150"
+
+# Brand cố định (kể cả brand chưa kinh doanh, để trả lời "chưa có trong hệ thống"),
+# brand lấy từ catalog được bổ sung vào sau khi đồng bộ
+BASE_BRANDS = (
+    "iphone", "samsung", "oppo", "xiaomi", "vivo", "realme",
+    "huawei", "honor", "nokia", "sony", "google", "pixel",
+    "oneplus", "asus", "lg", "motorola", "galaxy"
+)
+_base_fuzzy = FuzzyIndex(BASE_BRANDS, BASE_BRANDS)
+_NOT_BRANDS = {"dien", "thoai", "may", "phone", "smartphone", "dt", "new", "hang", "combo", "phu", "kien"}
+
+
+class ProductCard(NamedTuple):
+    """Dữ liệu thẻ sản phẩm trả về frontend (tuple bất biến, không có __dict__)"""
+    product_id: str
+    option_id: Optional[str]
+    name: Optional[str]
+    price: int
+    thumbnail: str
+    stock_quantity: int
+
+    def to_dict(self) -> Dict:
+        return {
+            "productId": self.product_id,
+            "optionId": self.option_id,
+            "name": self.name,
+            "price": self.price,
+            "thumbnail": self.thumbnail,
+            "stockQuantity": self.stock_quantity,
+        }
+
+
+class PriceIndex:
+    """
+    Sản phẩm sắp xếp theo giá (giá lấy từ card, không parse lại).
+    Lọc theo khoảng giá O(log n + kết quả), k sản phẩm gần giá nhất O(log n + k).
+    """
+    __slots__ = ("prices", "order", "products")
+
+    def __init__(self, products: List[Dict]):
+        pairs = sorted(((get_card(p).price, i, p) for i, p in enumerate(products) if p), key=lambda x: (x[0], x[1]))
+        self.prices = [price for price, _, _ in pairs]
+        self.order = [i for _, i, _ in pairs]  # vị trí trong danh sách gốc, để giữ thứ tự gốc khi bằng nhau
+        self.products = [p for _, _, p in pairs]
+
+    def __len__(self) -> int:
+        return len(self.products)
+
+    def between(self, min_price: float, max_price: float) -> List[Dict]:
+        return self.products[bisect_left(self.prices, min_price):bisect_right(self.prices, max_price)]
+
+    def under(self, price: float) -> List[Dict]:
+        return self.products[:bisect_right(self.prices, price)]
+
+    def at_least(self, price: float) -> List[Dict]:
+        return self.products[bisect_left(self.prices, price):]
+
+    def within(self, price: float, pct: float) -> List[Dict]:
+        """Sản phẩm trong khoảng ±pct quanh price (pct=0.2 → ±20%)"""
+        return self.between(price * (1 - pct), price * (1 + pct))
+
+    def nearest(self, price: float, k: int, min_price: Optional[float] = None,
+                max_price: Optional[float] = None) -> List[Dict]:
+        """
+        k sản phẩm có giá gần price nhất (trong [min_price, max_price] nếu có), gần nhất đứng trước.
+        Cách giá bằng nhau thì giữ thứ tự trong danh sách gốc (như sorted(key=abs(giá - price))).
+        """
+        lo = 0 if min_price is None else bisect_left(self.prices, min_price)
+        hi = len(self.prices) if max_price is None else bisect_right(self.prices, max_price)
+        # 2 con trỏ đi ra 2 phía từ vị trí của price. Bên trái đi theo từng nhóm cùng giá
+        # [group_start, group_end), trong nhóm đi từ trái sang để thứ tự gốc tăng dần
+        right = min(max(bisect_left(self.prices, price), lo), hi)
+        group_start = group_pos = group_end = right
+        result = []
+        while len(result) < k:
+            if group_pos == group_end and group_start > lo:
+                group_end = group_start
+                group_start = group_pos = bisect_left(self.prices, self.prices[group_end - 1], lo, group_end)
+            has_left, has_right = group_pos < group_end, right < hi
+            if not (has_left or has_right):
+                break
+            if not has_right or (has_left and (price - self.prices[group_pos], self.order[group_pos])
+                                 < (self.prices[right] - price, self.order[right])):
+                result.append(self.products[group_pos])
+                group_pos += 1
+            else:
+                result.append(self.products[right])
+                right += 1
+        return result
+
+
+class Catalog(NamedTuple):
+    """Snapshot catalog của 1 backend, thay thế nguyên khối khi đồng bộ lại"""
+    products: Tuple[Dict, ...]
+    by_id: Dict[str, Dict]
+    price_index: PriceIndex
+    trie: ProductTrie
+    brands: FrozenSet[str]
+    fuzzy: FuzzyIndex
+    synced_at: float
+
+    def match_model(self, text: str) -> Tuple[Optional[TrieMatch], List[Dict]]:
+        """Sản phẩm có tên model được nhắc trong text (rỗng nếu không khớp)"""
+        match = self.trie.match(text)
+        if match is None:
+            return None, []
+        return match, [self.by_id[pid] for pid in match.product_ids if pid in self.by_id]
+
+
+def _raw_product_id(product: Dict):
+    return product.get("productId") or product.get("_id") or product.get("id")
+
+
+def product_id(product: Dict) -> str:
+    return str(_raw_product_id(product))
+
+
+def _first_option_id(product: Dict) -> Optional[str]:
+    opts = product.get("options") or product.get("variants") or []
+    if isinstance(opts, list) and len(opts) > 0 and isinstance(opts[0], dict):
+        option_id = opts[0].get("_id") or opts[0].get("id") or opts[0].get("optionId")
+        return str(option_id) if option_id else None
+    return None
+
+
+def parse_price(product: Dict) -> int:
+    """Giá VNĐ dạng int: ưu tiên salePrice → price → minPrice; chuỗi "15.990.000" / "15,990,000" được hỗ trợ"""
+    try:
+        raw_price = product.get("salePrice") or product.get("price") or product.get("minPrice") or 0
+        if isinstance(raw_price, str):
+            return int(float(raw_price.replace(",", "").replace(".", "")))
+        return int(raw_price)
+    except Exception:
+        return 0
+
+
+def build_card(product: Dict) -> ProductCard:
+    return ProductCard(
+        product_id=product_id(product),
+        option_id=_first_option_id(product),
+        name=product.get("name"),
+        price=parse_price(product),
+        thumbnail=product.get("cheapestOptionImage") or product.get("thumbnail") or product.get("image") or PLACEHOLDER_THUMBNAIL,
+        stock_quantity=product.get("stockQuantity", 0),
+    )
+
+
+# {product_id: (dict backend gốc, card)} - dict gốc giữ lại để biết sản phẩm có thay đổi không
+_cards: Dict[str, Tuple[Dict, ProductCard]] = {}
+_catalogs: Dict[str, Catalog] = {}
+_lock = threading.Lock()
+
+
+def sync_products(products: List[Dict]) -> int:
+    """Tính card cho sản phẩm mới/đã thay đổi. Trả về số card được tạo lại."""
+    rebuilt = 0
+    with _lock:
+        for product in products:
+            if not product or _raw_product_id(product) is None:
+                continue
+            pid = product_id(product)
+            cached = _cards.get(pid)
+            if cached is not None and (cached[0] is product or cached[0] == product):
+                continue
+            _cards[pid] = (product, build_card(product))
+            rebuilt += 1
+    return rebuilt
+
+
+def get_card(product: Dict) -> ProductCard:
+    """Card của sản phẩm theo id; sản phẩm chưa từng đồng bộ thì tạo card và lưu lại"""
+    if _raw_product_id(product) is None:
+        return build_card(product)  # Không có id → không cache được
+    cached = _cards.get(product_id(product))
+    if cached is not None:
+        return cached[1]
+    sync_products([product])
+    return _cards[product_id(product)][1]
+
+
+def get_catalog(backend_url: str) -> Optional[Catalog]:
+    """Catalog đã đồng bộ của backend nếu còn mới (trong CATALOG_TTL), ngược lại None"""
+    catalog = _catalogs.get(backend_url)
+    if catalog is None or time.time() - catalog.synced_at > CATALOG_TTL:
+        return None
+    return catalog
+
+
+def _catalog_brands(products: List[Dict]) -> FrozenSet[str]:
+    """Token đầu của tên sản phẩm + category ngắn (vd "Samsung", "Apple") → brand"""
+    brands = set()
+    for p in products:
+        name_tokens = folded_tokens(p.get("name") or "", min_len=3)
+        if name_tokens and not any(ch.isdigit() for ch in name_tokens[0]):
+            brands.add(name_tokens[0])
+        category = p.get("category")
+        if isinstance(category, str):
+            category_tokens = folded_tokens(category, min_len=3)
+            if len(category_tokens) == 1 and not category_tokens[0].isdigit():
+                brands.add(category_tokens[0])
+    return frozenset(brands - _NOT_BRANDS)
+
+
+def _build_trie(products: List[Dict]) -> ProductTrie:
+    trie = ProductTrie()
+    for p in products:
+        if p.get("name") and _raw_product_id(p) is not None:
+            trie.add(p["name"], product_id(p))
+    return trie
+
+
+def _build_fuzzy(products: List[Dict], brands: FrozenSet[str]) -> FuzzyIndex:
+    vocabulary = set(BASE_BRANDS) | brands
+    for p in products:
+        vocabulary.update(tok for tok in folded_tokens(p.get("name") or "") if tok.isalpha())
+    return FuzzyIndex(vocabulary - _NOT_BRANDS, set(BASE_BRANDS) | brands)
+
+
+def set_catalog(backend_url: str, products: List[Dict]) -> Catalog:
+    """Đồng bộ catalog: tính sẵn card/index giá/trie tên model cho snapshot mới rồi swap"""
+    rebuilt = sync_products(products)
+    products = [p for p in products if p]
+    brands = _catalog_brands(products)
+    catalog = Catalog(
+        products=tuple(products),
+        by_id={product_id(p): p for p in products if _raw_product_id(p) is not None},
+        price_index=PriceIndex(products),
+        trie=_build_trie(products),
+        brands=brands,
+        fuzzy=_build_fuzzy(products, brands),
+        synced_at=time.time(),
+    )
+    _catalogs[backend_url] = catalog
+    logger.info("[CATALOG] Synced %s products from %s (%s cards rebuilt)", len(catalog.products), backend_url, rebuilt)
+    return catalog
+
+
+def get_fuzzy_index(backend_url: str) -> FuzzyIndex:
+    """Fuzzy index của catalog gần nhất (kể cả đã quá TTL), chưa có catalog thì chỉ gồm BASE_BRANDS"""
+    catalog = _catalogs.get(backend_url)
+    return catalog.fuzzy if catalog is not None else _base_fuzzy
+
+
+def known_brands() -> Tuple[str, ...]:
+    """BASE_BRANDS + brand lấy từ các catalog đã đồng bộ (giữ thứ tự BASE_BRANDS trước)"""
+    extra = set()
+    for c in _catalogs.values():
+        extra |= c.brands
+    return BASE_BRANDS + tuple(sorted(extra.difference(BASE_BRANDS)))
+
+
+def get_catalog_status() -> Dict:
+    return {
+        "cards": len(_cards),
+        "catalogs": {
+            url: {"products": len(c.products), "models": c.trie.size, "brands": len(c.brands), "vocabulary": len(c.fuzzy),
+                  "age": round(time.time() - c.synced_at, 1)}
+            for url, c in _catalogs.items()
+        },
+    }
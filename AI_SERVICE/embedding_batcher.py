@@ -0,0 +1,85 @@
+"""
+Embedding Batcher - Gom các yêu cầu embedding câu hỏi đến gần nhau thành 1 lần encode
+
+Khi nhiều request chạy đồng thời, mỗi request tự encode câu hỏi của mình → transformer chạy N lần
+forward với batch 1. Batcher gom các yêu cầu đến trong EMBED_BATCH_WAIT_MS (hoặc đủ EMBED_BATCH_MAX)
+rồi encode 1 lần, trả kết quả cho từng request qua future:
+- Lúc tải thấp: yêu cầu đến 1 mình thì encode ngay, không chờ cửa sổ gom
+- Lúc tải cao: batch lớn dần trong khi batch trước đang encode → throughput tăng theo tải
+- Text trùng nhau trong cùng batch chỉ encode 1 lần
+Queue và worker thuộc event loop đang chạy: batcher dùng chung cho cả module nhưng có thể được gọi
+từ nhiều event loop lần lượt (asyncio.run trong benchmark, preload ở master trước khi fork...).
+"""
+
+import asyncio
+import os
+from typing import Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+
+EMBED_BATCH_MAX = int(os.getenv("EMBED_BATCH_MAX", "32"))
+EMBED_BATCH_WAIT_MS = float(os.getenv("EMBED_BATCH_WAIT_MS", "5"))
+
+
+class EmbeddingBatcher:
+    def __init__(self, encode_fn: Callable[[List[str]], np.ndarray], max_batch: int = EMBED_BATCH_MAX,
+                 max_wait_ms: float = EMBED_BATCH_WAIT_MS):
+        self.encode_fn = encode_fn
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1000
+        self._pending: List[Tuple[str, asyncio.Future]] = []
+        self._worker: Optional[asyncio.Task] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self.batches = 0
+        self.items = 0
+
+    async def embed(self, text: str) -> np.ndarray:
+        """Embedding của 1 text, được encode chung batch với các yêu cầu đồng thời khác"""
+        loop = asyncio.get_running_loop()
+        if loop is not self._loop:
+            # Event loop mới: queue/worker của loop cũ không dùng được nữa (future và task gắn với loop cũ)
+            self._loop = loop
+            self._pending = []
+            self._worker = None
+        future = loop.create_future()
+        self._pending.append((text or "", future))
+        if self._worker is None or self._worker.done():
+            self._worker = asyncio.ensure_future(self._run())
+        return await future
+
+    async def _run(self):
+        while self._pending:
+            # Nhường event loop 1 lượt để các request đang chạy đồng thời kịp xếp hàng
+            await asyncio.sleep(0)
+            if 1 < len(self._pending) < self.max_batch:
+                # Đang có tải: chờ thêm yêu cầu đến trong cửa sổ gom. Chỉ có 1 yêu cầu → encode ngay
+                await asyncio.sleep(self.max_wait)
+            batch = self._pending[:self.max_batch]
+            del self._pending[:self.max_batch]
+            await self._encode_batch(batch)
+
+    async def _encode_batch(self, batch: List[Tuple[str, asyncio.Future]]):
+        unique_texts = list(dict.fromkeys(text for text, _ in batch))
+        try:
+            # encode là lời gọi CPU blocking → chạy trong thread, event loop tiếp tục gom batch sau
+            vectors = await asyncio.to_thread(self.encode_fn, unique_texts)
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        by_text = dict(zip(unique_texts, vectors))
+        for text, future in batch:
+            if not future.done():
+                future.set_result(by_text[text])
+        self.batches += 1
+        self.items += len(batch)
+
+    def stats(self) -> Dict:
+        return {
+            "pending": len(self._pending),
+            "batches": self.batches,
+            "items": self.items,
+            "avg_batch_size": round(self.items / self.batches, 2) if self.batches else 0.0,
+        }
@@ -0,0 +1,113 @@
+"""
+Fuzzy Index - Sửa lỗi gõ cho tên brand/model ("iphon 15", "samsumg", "xiaomj")
+
+Từ vựng (brand + token trong tên sản phẩm của catalog, đã bỏ dấu) được đánh index theo trigram ký tự.
+Mỗi token lạ chỉ so khoảng cách Levenshtein với vài ứng viên có nhiều trigram chung nhất
+→ chi phí mỗi lần tra bị chặn, không phụ thuộc kích thước từ vựng.
+
+correct_query() chỉ thay các từ gõ sai thành tên brand/model, giữ nguyên mọi từ khác (kể cả hoa/thường).
+Câu gõ không dấu có thể là tiếng Anh ("I like the iPhone") → chỉ sửa về tên brand, không sửa về
+token model chung chung ("like" → "lite").
+"""
+
+import re
+from typing import Dict, Iterable, List, Optional, Set
+
+from text_utils import fold_text
+
+MIN_TOKEN_LEN = 4       # token ngắn hơn không sửa (dễ sửa nhầm từ thường)
+MAX_CANDIDATES = 8      # số ứng viên tối đa được tính Levenshtein cho mỗi token
+
+_WORD_RE = re.compile(r"\w+", re.UNICODE)
+
+# Từ tiếng Việt thông dụng (không dấu) gần giống tên model ("minh" ~ "mini") → không bao giờ sửa
+_COMMON_WORDS = {
+    "minh", "muon", "khong", "nhieu", "dien", "thoai", "hang", "nhat", "chinh", "sach", "hanh",
+    "tien", "trieu", "duoi", "tren", "khoang", "nhung", "cung", "duoc", "nhanh", "manh", "chup",
+    "hinh", "canh", "thich", "xanh", "trang", "vang", "hong", "dung", "lung", "nguoi",
+    "giup", "shop", "show", "phone", "mang", "nhin", "thay", "nhan", "hoac", "hien",
+}
+
+
+def _trigrams(word: str) -> Set[str]:
+    padded = f"^{word}$"
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def _max_distance(word: str) -> int:
+    return 1 if len(word) <= 5 else 2
+
+
+def bounded_levenshtein(a: str, b: str, max_dist: int) -> int:
+    """Khoảng cách Levenshtein, dừng sớm (trả max_dist + 1) khi chắc chắn vượt max_dist"""
+    if abs(len(a) - len(b)) > max_dist:
+        return max_dist + 1
+    previous = list(range(len(b) + 1))
+    for i, ca in enumerate(a, 1):
+        current = [i] + [0] * len(b)
+        for j, cb in enumerate(b, 1):
+            current[j] = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (ca != cb))
+        if min(current) > max_dist:
+            return max_dist + 1
+        previous = current
+    return previous[-1]
+
+
+class FuzzyIndex:
+    def __init__(self, vocabulary: Iterable[str], brands: Iterable[str] = ()):
+        self.brands: Set[str] = {fold_text(b) for b in brands}
+        self.vocabulary: Set[str] = set()
+        self._postings: Dict[str, List[str]] = {}
+        for word in vocabulary:
+            word = fold_text(word)
+            if len(word) < MIN_TOKEN_LEN or word in self.vocabulary or not word.isalpha():
+                continue
+            self.vocabulary.add(word)
+            for gram in _trigrams(word):
+                self._postings.setdefault(gram, []).append(word)
+
+    def __len__(self) -> int:
+        return len(self.vocabulary)
+
+    def correct(self, token: str, brands_only: bool = False) -> Optional[str]:
+        """
+        Từ trong vocabulary gần token nhất (trong ngưỡng), None nếu token đúng hoặc không sửa được.
+        brands_only=True → chỉ sửa về tên brand.
+        """
+        folded = fold_text(token)
+        if folded != token.lower():
+            return None  # Từ có dấu là tiếng Việt, không phải tên brand/model
+        token = folded
+        if len(token) < MIN_TOKEN_LEN or token in self.vocabulary or token in _COMMON_WORDS or not token.isalpha():
+            return None
+
+        counts: Dict[str, int] = {}
+        for gram in _trigrams(token):
+            for word in self._postings.get(gram, ()):
+                counts[word] = counts.get(word, 0) + 1
+        if brands_only:
+            counts = {word: n for word, n in counts.items() if word in self.brands}
+        candidates = sorted(counts, key=lambda w: (-counts[w], abs(len(w) - len(token))))[:MAX_CANDIDATES]
+
+        max_dist = _max_distance(token)
+        best, best_dist = None, max_dist + 1
+        for word in candidates:
+            dist = bounded_levenshtein(token, word, max_dist)
+            if dist < best_dist:
+                best, best_dist = word, dist
+        return best
+
+
+def correct_query(text: str, index: FuzzyIndex) -> str:
+    """Sửa các từ gõ sai tên brand/model trong câu, giữ nguyên các từ khác"""
+    if not text:
+        return text
+    # Câu có dấu chắc chắn là tiếng Việt; câu không dấu có thể là tiếng Anh → chỉ sửa về brand
+    brands_only = fold_text(text) == text.lower()
+
+    def replace(match: "re.Match") -> str:
+        word = match.group(0)
+        corrected = index.correct(word, brands_only)
+        return corrected if corrected else word
+
+    return _WORD_RE.sub(replace, text)
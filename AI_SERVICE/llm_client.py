@@ -0,0 +1,124 @@
+"""
+LLM Client - Registry dùng chung các GenerativeModel của Gemini
+
+- Mỗi cặp (model, system prompt) chỉ khởi tạo GenerativeModel một lần, các request sau dùng lại
+  (trước đây chat/semantic_search/extract_search_term_with_llm tạo mới ở mỗi request)
+- Tùy chọn GEMINI_PROMPT_CACHE=1: đưa system prompt vào Gemini context cache để không phải gửi lại
+  ở mỗi request. Gemini chỉ nhận cache khi prompt đủ dài (vài nghìn token tùy model); nếu API từ chối,
+  registry ghi nhớ và dùng model thường cho key đó, không thử lại ở mỗi request.
+- set_model_factory(): thay Gemini bằng model khác cùng interface (vd: LLM giả lập của benchmarks/)
+- SDK google.generativeai chỉ được import + configure ở lần tạo model đầu tiên (hoặc trong warm-up),
+  import main không phải trả chi phí import SDK
+"""
+
+import os
+import time
+import datetime
+import threading
+from typing import TYPE_CHECKING, Callable, Dict, Optional, Set, Tuple
+
+if TYPE_CHECKING:
+    import google.generativeai as genai
+
+from app_logging import get_logger
+
+logger = get_logger(__name__)
+
+GEMINI_MODEL = os.getenv("GEMINI_MODEL", "gemini-flash-latest")
+GEMINI_PROMPT_CACHE = os.getenv("GEMINI_PROMPT_CACHE", "0") == "1"
+GEMINI_PROMPT_CACHE_TTL = int(os.getenv("GEMINI_PROMPT_CACHE_TTL", "3600"))  # giây
+
+_RegistryKey = Tuple[str, Optional[str]]
+_models: Dict[_RegistryKey, Tuple["genai.GenerativeModel", Optional[float]]] = {}  # {key: (model, hết hạn)}
+_cache_unsupported: Set[_RegistryKey] = set()
+_lock = threading.Lock()
+_model_factory: Optional[Callable[[str, Optional[str]], object]] = None
+_genai_module = None
+
+
+def _genai():
+    """Import + configure SDK Gemini ở lần dùng đầu tiên"""
+    global _genai_module
+    if _genai_module is None:
+        import google.generativeai as genai
+        api_key = os.getenv("GEMINI_API_KEY")
+        if api_key:
+            genai.configure(api_key=api_key)
+        _genai_module = genai
+    return _genai_module
+
+
+def _full_model_name(model_name: str) -> str:
+    return model_name if model_name.startswith("models/") else f"models/{model_name}"
+
+
+def _build_model(model_name: str, system_instruction: Optional[str]):
+    """Trả về (model, expires_at) - expires_at khác None nếu model dùng cached content"""
+    if _model_factory is not None:
+        return _model_factory(model_name, system_instruction), None
+
+    genai = _genai()
+    key = (model_name, system_instruction)
+    full_name = _full_model_name(model_name)
+
+    if GEMINI_PROMPT_CACHE and system_instruction and key not in _cache_unsupported:
+        try:
+            cached = genai.caching.CachedContent.create(
+                model=full_name,
+                system_instruction=system_instruction,
+                ttl=datetime.timedelta(seconds=GEMINI_PROMPT_CACHE_TTL),
+            )
+            logger.info("[LLM] Cached system prompt for %s", model_name)
+            return genai.GenerativeModel.from_cached_content(cached), time.time() + GEMINI_PROMPT_CACHE_TTL
+        except Exception as e:
+            logger.info("[LLM] Prompt cache not available for %s (%s), using regular model", model_name, e)
+            _cache_unsupported.add(key)
+
+    kwargs = {"system_instruction": system_instruction} if system_instruction else {}
+    try:
+        return genai.GenerativeModel(model_name=full_name, **kwargs), None
+    except TypeError:
+        return genai.GenerativeModel(model_name, **kwargs), None
+
+
+def get_generative_model(model_name: str = GEMINI_MODEL, system_instruction: Optional[str] = None) -> "genai.GenerativeModel":
+    """
+    Lấy GenerativeModel cho (model_name, system_instruction) từ registry, tạo mới nếu chưa có.
+    Model dùng cached content được tạo lại trước khi cache hết hạn 60 giây.
+    """
+    key = (model_name, system_instruction)
+    entry = _models.get(key)
+    if entry is not None and (entry[1] is None or time.time() < entry[1] - 60):
+        return entry[0]
+
+    with _lock:
+        entry = _models.get(key)
+        if entry is None or (entry[1] is not None and time.time() >= entry[1] - 60):
+            entry = _build_model(model_name, system_instruction)
+            _models[key] = entry
+    return entry[0]
+
+
+def set_model_factory(factory: Optional[Callable[[str, Optional[str]], object]]):
+    """
+    factory(model_name, system_instruction) → object có generate_content()/start_chat() như GenerativeModel.
+    None → quay lại Gemini. Registry được xóa để các request sau lấy model từ factory mới.
+    """
+    global _model_factory
+    with _lock:
+        _model_factory = factory
+        _models.clear()
+
+
+def warm_up():
+    """Import sẵn SDK Gemini (bỏ qua nếu đang dùng model factory) để request đầu không phải chờ"""
+    if _model_factory is None:
+        _genai()
+
+
+def get_registry_status() -> Dict:
+    return {
+        "models": len(_models),
+        "prompt_cache": GEMINI_PROMPT_CACHE,
+        "cached_prompts": sum(1 for _, expires_at in _models.values() if expires_at is not None),
+    }
@@ -1,7 +1,8 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import JSONResponse, PlainTextResponse
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
-from typing import List, Optional, Tuple
+from typing import Dict, List, Optional, Tuple
 
 # Fix encoding for Vietnamese characters on Windows
 import sys
@@ -15,24 +16,113 @@ if sys.platform == 'win32':
 import os
 import re
 import base64 # [THÊM] Import thư viện base64 để xử lý ảnh
+import hashlib
+import time
+import json
+import logging
+import asyncio
+import math
+import uuid
+from collections import OrderedDict
+from contextlib import asynccontextmanager
 from dotenv import load_dotenv
-import google.generativeai as genai
 
+# Nạp .env trước mọi import module của service: các module đọc cấu hình (os.getenv) ngay lúc import
+load_dotenv()
 
 from rag_service import (
     retrieve_context,
     format_rag_context,
     get_products_from_backend,
-    identify_phone_from_image
+    identify_phone_from_image,
+    start_policy_ingestion,
+    stop_policy_ingestion,
+    warm_up_embedding_model,
+    warm_up_policies,
+    warm_up_catalog,
+    load_policies_from_pdfs,
+    resolve_followup_products,
+    extract_query_intent,
+    generate_query_embedding_if_ready,
+    correct_query_typos
 )
-
-load_dotenv()
+import llm_client
+from llm_client import get_generative_model, get_registry_status
+from text_utils import estimate_tokens, fold_text
+from session_store import get_session_store, new_session
+from singleflight import SingleFlight
+from semantic_cache import SEMANTIC_CACHE_ENABLED, get_semantic_cache
+import reranker
+from reranker import get_reranker, get_reranker_status
+from catalog import PriceIndex, get_card, get_catalog_status, known_brands
+import metrics
+from metrics import record_cache, record_llm_tokens, span
+from app_logging import get_logger, get_logging_status, reset_request_id, set_request_id, setup_logging, stop_logging
+from admission import Overloaded, get_llm_admission, rate_limit_retry_after
+import prefork
+from prefork import AI_SERVICE_WORKERS, get_prefork_status
+from warmup import WARMUP_ENABLED, Warmup, WarmupStep, get_warmup, set_warmup
+
+setup_logging()
+logger = get_logger("main")
+
+WARMUP_CATALOG = os.getenv("WARMUP_CATALOG", "1") == "1"
+
+def build_warmup() -> Warmup:
+    """
+    Embedding model → catalog chạy nối tiếp (cùng dùng model); index chính sách chờ model load xong hoặc lỗi rồi
+    mới nạp (model lỗi vẫn nạp bản chỉ keyword, watcher tự build lại kèm vector khi model load được);
+    cross-encoder và SDK Gemini song song
+    """
+    async def policies_after_model():
+        await warmup.wait_settled("embedding_model")
+        await warm_up_policies()
+
+    chain = [WarmupStep("embedding_model", lambda: asyncio.to_thread(warm_up_embedding_model))]
+    if WARMUP_CATALOG:
+        chain.append(WarmupStep("catalog", lambda: warm_up_catalog(BACKEND_URL), required=False))
+    warmup = Warmup([
+        chain,
+        [WarmupStep("policies", policies_after_model, required=False)],
+        [WarmupStep("reranker", lambda: asyncio.to_thread(reranker.warm_up), required=False)],
+        [WarmupStep("llm_sdk", lambda: asyncio.to_thread(llm_client.warm_up), required=False)],
+    ])
+    return warmup
+
+def build_preload_steps() -> List[prefork.PreloadStep]:
+    """Các bước master nạp trước khi fork worker (chế độ nhiều worker, xem prefork.py)"""
+    steps = [
+        ("embedding_model", warm_up_embedding_model),
+        ("policies", load_policies_from_pdfs),
+        ("reranker", reranker.warm_up),
+    ]
+    if WARMUP_CATALOG:
+        steps.append(("catalog", lambda: asyncio.run(warm_up_catalog(BACKEND_URL))))
+    return steps
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    if WARMUP_ENABLED:
+        # Làm nóng ở background: app nhận /health, /ready ngay, /ready chỉ 200 khi đã warm
+        warmup = build_warmup()
+        set_warmup(warmup)
+        warmup_task = asyncio.create_task(warmup.run())
+    else:
+        # Không warm-up: nạp PDF chính sách + cross-encoder ở background, model embedding load khi cần
+        warmup_task = None
+        start_policy_ingestion()
+        get_reranker()
+    yield
+    if warmup_task is not None:
+        warmup_task.cancel()
+    stop_policy_ingestion()
+    stop_logging()
 
 app = FastAPI(
     title="Phonify AI Chat Service",
     description="AI Chatbox service với RAG (Retrieval-Augmented Generation)",
-    version="2.0.0"
-
+    version="2.0.0",
+    lifespan=lifespan
 )
 
 app.add_middleware(
@@ -109,10 +199,6 @@ GEMINI_MODEL = os.getenv("GEMINI_MODEL", "gemini-flash-latest")
 BACKEND_URL = os.getenv("BACKEND_URL", "http://localhost:8000")
 AI_SERVICE_PORT = int(os.getenv("AI_SERVICE_PORT", "8001"))
 
-if GEMINI_API_KEY:
-    genai.configure(api_key=GEMINI_API_KEY)
-
-
 # ================== PROMPTS ==================
 SYSTEM_PROMPT = """Bạn là trợ lý AI mua sắm chuyên nghiệp của cửa hàng Phonify.
 - Chỉ sử dụng dữ liệu có trong CONTEXT (database) để trả lời.
@@ -168,6 +254,8 @@ class ChatRequest(BaseModel):
 
     language: Optional[str] = None  # "vi" | "en"
     image: Optional[str] = None
+    sessionId: Optional[str] = None  # có sessionId → dùng history/sản phẩm lưu phía server
+    newSession: Optional[bool] = False  # True (không có sessionId) → server tạo session mới, trả sessionId trong response
 
 class ChatResponse(BaseModel):
     success: bool
@@ -175,6 +263,44 @@ class ChatResponse(BaseModel):
     data: dict
 
 # ================== HELPERS ==================
+# --- Gộp request trùng đang chạy đồng thời ---
+# Retrieval theo query đã chuẩn hóa, lời gọi Gemini theo toàn bộ prompt (system + history + message)
+_retrieval_flight = SingleFlight("retrieval")
+_llm_flight = SingleFlight("llm")
+
+def _retrieval_key(query: str, backend_url: str) -> Tuple[str, str]:
+    return (" ".join(query.lower().split()), backend_url or "")
+
+def _prompt_key(system_prompt: str, history: List[dict], message: str) -> str:
+    payload = json.dumps([GEMINI_MODEL, system_prompt, history, message], ensure_ascii=False, sort_keys=True)
+    return hashlib.sha1(payload.encode("utf-8")).hexdigest()
+
+def _llm_token_counts(response, history: List[dict], message: str) -> Tuple[int, int]:
+    """(prompt, response) token: lấy từ usage_metadata của Gemini, không có thì ước lượng"""
+    usage = getattr(response, "usage_metadata", None)
+    prompt_tokens = getattr(usage, "prompt_token_count", None)
+    response_tokens = getattr(usage, "candidates_token_count", None)
+    if isinstance(prompt_tokens, int) and isinstance(response_tokens, int):
+        return prompt_tokens, response_tokens
+    history_tokens = sum(estimate_tokens(_history_text(m)) for m in history)
+    return history_tokens + estimate_tokens(message), estimate_tokens(getattr(response, "text", "") or "")
+
+async def coalesced_retrieve_context(query: str, backend_url: str) -> dict:
+    with span("retrieval"):
+        context = await _retrieval_flight.do(
+            _retrieval_key(query, backend_url), lambda: retrieve_context(query, backend_url)
+        )
+    # Mỗi request nhận bản copy nông (format_rag_context ghi thêm key vào context)
+    return dict(context)
+
+async def coalesced_send_message(model, system_prompt: str, history: List[dict], message: str):
+    """Gửi message lên Gemini; các request có cùng prompt đang chờ dùng chung 1 response"""
+    def send():
+        return model.start_chat(history=history).send_message(message)
+    # send_message là lời gọi blocking → chạy trong thread để event loop vẫn phục vụ request khác.
+    # Admission nằm trong single-flight: các request trùng prompt chỉ tốn 1 slot + 1 token quota
+    return await _llm_flight.do(_prompt_key(system_prompt, history, message), lambda: get_llm_admission().run(send))
+
 def build_history(conversation_history: List[Message]) -> List[dict]:
     if not conversation_history:
         return []
@@ -193,6 +319,123 @@ def build_history(conversation_history: List[Message]) -> List[dict]:
     
     return filtered
 
+# --- Nén lịch sử hội thoại ---
+# Giữ nguyên văn N tin nhắn gần nhất (trong ngân sách token), các tin cũ hơn được thay bằng
+# 1 bản tóm tắt cuốn chiếu. Tóm tắt được cache theo hash của đoạn hội thoại đã tóm tắt,
+# chỉ gọi LLM tóm tắt lại khi có >= HISTORY_SUMMARY_REFRESH tin nhắn mới bị đẩy ra khỏi cửa sổ.
+HISTORY_MAX_MESSAGES = int(os.getenv("HISTORY_MAX_MESSAGES", "8"))
+HISTORY_MAX_TOKENS = int(os.getenv("HISTORY_MAX_TOKENS", "1200"))
+HISTORY_SUMMARY_REFRESH = int(os.getenv("HISTORY_SUMMARY_REFRESH", "4"))
+HISTORY_SUMMARY_CACHE_SIZE = 512
+_history_summary_cache: "OrderedDict[str, str]" = OrderedDict()  # {hash prefix hội thoại: tóm tắt}
+
+HISTORY_SUMMARY_PROMPT = """Tóm tắt ngắn gọn (tối đa 5 câu) cuộc trò chuyện giữa khách hàng và trợ lý bán điện thoại dưới đây.
+Giữ lại: sản phẩm/thương hiệu khách quan tâm, ngân sách, nhu cầu, các sản phẩm đã được gợi ý và câu hỏi còn dang dở.
+
+Tóm tắt trước đó (nếu có):
+{summary}
+
+Đoạn hội thoại mới:
+{messages}
+
+Tóm tắt:"""
+
+def _history_text(msg: dict) -> str:
+    return msg["parts"][0]["text"]
+
+def _history_prefix_hashes(messages: List[dict]) -> List[str]:
+    """hash[i] đại diện cho messages[:i+1] → tìm được tóm tắt của prefix dài nhất đã cache"""
+    h = hashlib.sha1()
+    hashes = []
+    for msg in messages:
+        h.update(f"{msg['role']}\x00{_history_text(msg)}\x01".encode("utf-8"))
+        hashes.append(h.hexdigest())
+    return hashes
+
+def _fallback_summary(summary: str, messages: List[dict]) -> str:
+    """Tóm tắt trích xuất (không cần LLM): giữ câu hỏi của khách, rút gọn"""
+    lines = [summary] if summary else []
+    for msg in messages:
+        if msg["role"] == "user":
+            lines.append(f"- Khách hỏi: {_history_text(msg)[:120]}")
+    return "\n".join(lines[-8:])
+
+async def summarize_history(summary: str, messages: List[dict]) -> str:
+    """Cập nhật tóm tắt cuốn chiếu với các tin nhắn vừa bị đẩy khỏi cửa sổ"""
+    transcript = "\n".join(
+        f"{'Khách' if m['role'] == 'user' else 'Trợ lý'}: {_history_text(m)}" for m in messages
+    )
+    prompt = HISTORY_SUMMARY_PROMPT.format(summary=summary or "(chưa có)", messages=transcript)
+
+    def generate() -> str:
+        return (get_generative_model(GEMINI_MODEL).generate_content(prompt).text or "").strip()
+
+    # generate_content là lời gọi blocking → chạy trong thread, qua admission như mọi lời gọi Gemini khác
+    try:
+        text = await get_llm_admission().run(generate)
+        if text:
+            return text
+    except Overloaded as e:
+        # Tóm tắt bằng LLM là tùy chọn: đang quá tải / hết quota thì dùng tóm tắt trích xuất
+        logger.info("[HISTORY] LLM busy (%s), using extractive summary", e.reason)
+    except Exception as e:
+        logger.warning("[HISTORY] Summarization failed: %s, using extractive summary", e)
+    return _fallback_summary(summary, messages)
+
+async def compact_history(history: List[dict]) -> List[dict]:
+    """
+    Giới hạn history gửi lên Gemini: tóm tắt (nếu có) + các tin nhắn gần nhất nguyên văn.
+    Kích thước prompt không tăng theo độ dài cuộc trò chuyện.
+    """
+    total_tokens = sum(estimate_tokens(_history_text(m)) for m in history)
+    if len(history) <= HISTORY_MAX_MESSAGES and total_tokens <= HISTORY_MAX_TOKENS:
+        return history
+
+    # 1. Cửa sổ nguyên văn: đi ngược từ cuối tới khi đủ số tin hoặc hết ngân sách token
+    tail_start, used = len(history), 0
+    while tail_start > 0 and len(history) - tail_start < HISTORY_MAX_MESSAGES:
+        cost = estimate_tokens(_history_text(history[tail_start - 1]))
+        if used + cost > HISTORY_MAX_TOKENS and tail_start < len(history):
+            break
+        used += cost
+        tail_start -= 1
+    # Gemini yêu cầu lượt đầu là "user"
+    while tail_start < len(history) - 1 and history[tail_start]["role"] != "user":
+        tail_start += 1
+
+    older, tail = history[:tail_start], history[tail_start:]
+    if not older:
+        return tail
+
+    # 2. Tìm tóm tắt của prefix dài nhất đã cache
+    hashes = _history_prefix_hashes(older)
+    covered, summary = 0, ""
+    for i in range(len(hashes) - 1, -1, -1):
+        if hashes[i] in _history_summary_cache:
+            covered, summary = i + 1, _history_summary_cache[hashes[i]]
+            _history_summary_cache.move_to_end(hashes[i])
+            break
+
+    uncovered = older[covered:]
+    if len(uncovered) >= HISTORY_SUMMARY_REFRESH:
+        logger.debug("[HISTORY] Summarizing %s older messages (cached prefix=%s)", len(uncovered), covered)
+        with span("history_summary"):
+            summary = await summarize_history(summary, uncovered)
+        _history_summary_cache[hashes[-1]] = summary
+        while len(_history_summary_cache) > HISTORY_SUMMARY_CACHE_SIZE:
+            _history_summary_cache.popitem(last=False)
+    elif uncovered:
+        # Tóm tắt còn đủ mới: giữ nguyên văn vài tin chưa được tóm tắt thay vì gọi LLM
+        tail = uncovered + tail
+
+    if not summary:
+        return tail
+    logger.debug("[HISTORY] Compacted %s messages → summary + %s recent", len(history), len(tail))
+    return [
+        {"role": "user", "parts": [{"text": f"[TÓM TẮT CUỘC TRÒ CHUYỆN TRƯỚC ĐÓ]\n{summary}"}]},
+        {"role": "model", "parts": [{"text": "Đã ghi nhận ngữ cảnh cuộc trò chuyện."}]},
+    ] + tail
+
 def analyze_purchase_intent(message: str) -> Tuple[bool, str, str, str]:
     """
     Phân tích câu hỏi để xác định ý định mua điện thoại và trích xuất thông tin
@@ -212,12 +455,8 @@ def analyze_purchase_intent(message: str) -> Tuple[bool, str, str, str]:
         "điện thoại", "phone", "smartphone", "đt", "sdt"
     ]
 
-    # Từ khóa cho dòng điện thoại phổ biến
-    phone_brands = [
-        "iphone", "samsung", "oppo", "xiaomi", "vivo", "realme",
-        "huawei", "honor", "nokia", "sony", "google", "pixel",
-        "oneplus", "asus", "lg", "motorola"
-    ]
+    # Từ khóa cho dòng điện thoại: brand cố định + brand lấy từ catalog
+    phone_brands = known_brands()
 
     # Pattern cho khoảng giá (VNĐ)
     price_patterns = [
@@ -227,8 +466,9 @@ def analyze_purchase_intent(message: str) -> Tuple[bool, str, str, str]:
         r'(\d+(?:\.\d+)?)\s*-\s*(\d+(?:\.\d+)?)\s*(triệu|tr|k|nghìn|ngàn)',
     ]
 
-    # Check xem có phải ý định mua điện thoại không
-    is_purchase = any(keyword in message for keyword in purchase_keywords)
+    # Check xem có phải ý định mua điện thoại không (bỏ dấu cả 2 phía để nhận cả câu gõ không dấu)
+    folded = fold_text(message)
+    is_purchase = any(fold_text(keyword) in folded for keyword in purchase_keywords)
 
     # Nếu không phải mua điện thoại, return sớm
     if not is_purchase:
@@ -424,21 +664,108 @@ async def root():
         "features": ["RAG", "Semantic Search", "Multi-source Retrieval"]
     }
 
+@app.middleware("http")
+async def record_request_metrics(request: Request, call_next):
+    # Request id: lấy từ header (gateway/backend đã gán) hoặc tự sinh, gắn vào mọi dòng log của request
+    request_id = request.headers.get("x-request-id") or uuid.uuid4().hex[:16]
+    token = set_request_id(request_id)
+    spans = metrics.begin_request()
+    started = time.perf_counter()
+    status = "500"
+    try:
+        response = await call_next(request)
+        status = str(response.status_code)
+        response.headers["X-Request-ID"] = request_id
+        return response
+    finally:
+        elapsed = time.perf_counter() - started
+        route = request.scope.get("route")
+        endpoint = getattr(route, "path", "unmatched")
+        metrics.REQUESTS.inc(endpoint=endpoint, status=status)
+        metrics.REQUEST_DURATION.observe(elapsed, endpoint=endpoint)
+        if spans and logger.isEnabledFor(logging.INFO):
+            stages = " ".join(f"{k}={v * 1000:.0f}ms" for k, v in spans.items())
+            logger.info("[METRICS] %s %s %.0fms | %s", endpoint, status, elapsed * 1000, stages)
+        reset_request_id(token)
+
+metrics.register_gauge("phonify_sessions", "Số session đang lưu", lambda: get_session_store().stats().get("sessions", 0))
+metrics.register_gauge("phonify_ready", "1 khi worker đã warm-up xong", lambda: get_warmup().is_ready())
+metrics.register_gauge("phonify_llm_in_flight", "Số lời gọi Gemini đang chạy", lambda: get_llm_admission().in_flight)
+metrics.register_gauge("phonify_llm_queued", "Số request đang chờ slot gọi Gemini", lambda: get_llm_admission().stats()["queued"])
+metrics.register_gauge("phonify_semantic_cache_entries", "Số câu trả lời trong semantic cache", lambda: get_semantic_cache().stats()["entries"])
+
+@app.get("/metrics")
+async def prometheus_metrics():
+    return PlainTextResponse(metrics.render_metrics(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
 @app.get("/health")
 async def health_check():
-    from rag_service import get_embedding_model_status
+    from rag_service import (
+        get_embedding_model_status, get_backend_breaker_status, get_policy_status,
+        get_backend_flight_status, get_embedding_batcher_status
+    )
     model_status = get_embedding_model_status()
     
-    # Service vẫn healthy ngay cả khi model đang loading
-    # (model sẽ được load khi cần)
+    # /health là liveness: process còn sống là healthy, kể cả khi đang warm-up (xem /ready)
     return {
         "status": "healthy", 
         "service": "ai-chat-rag",
-        "embedding_model": model_status
+        "ready": get_warmup().is_ready(),
+        "embedding_model": model_status,
+        "embedding_batcher": get_embedding_batcher_status(),
+        "reranker": get_reranker_status(),
+        "catalog": get_catalog_status(),
+        "policies": get_policy_status(),
+        "llm": get_registry_status(),
+        "sessions": get_session_store().stats(),
+        "semantic_cache": get_semantic_cache().stats(),
+        "coalescing": {
+            "retrieval": _retrieval_flight.stats(),
+            "llm": _llm_flight.stats(),
+            "backend": get_backend_flight_status()
+        },
+        "backend_breakers": get_backend_breaker_status(),
+        "llm_admission": get_llm_admission().stats(),
+        "logging": get_logging_status(),
+        "process": get_prefork_status()
     }
 
+@app.get("/ready")
+async def readiness_check():
+    """Readiness cho load balancer: 200 khi worker đã warm-up xong các bước bắt buộc, 503 khi chưa"""
+    warmup = get_warmup()
+    return JSONResponse(warmup.status(), status_code=200 if warmup.is_ready() else 503)
+
 @app.post("/api/v1/chat", response_model=ChatResponse)
 async def chat(request: ChatRequest):
+    """
+    Endpoint chat. Client gửi sessionId (hoặc newSession=true để nhận sessionId mới trong response) để
+    server giữ history và sản phẩm vừa hiển thị → không cần gửi lại conversationHistory ở mỗi lượt.
+    Không có cả hai: request không lưu gì phía server (client tự gửi conversationHistory như trước).
+    """
+    store = get_session_store()
+    session_id = request.sessionId or (uuid.uuid4().hex if request.newSession else None)
+    session = store.get(session_id) if request.sessionId else None
+    if session is None:
+        session = new_session()
+        # Session mới: khởi tạo từ history client gửi lên (client cũ chưa dùng sessionId)
+        session["history"] = build_history(request.conversationHistory)
+
+    result = await handle_chat(request, session)
+    if session_id is None:
+        return result
+
+    reply = (result.data or {}).get("response")
+    if request.message and request.message.strip() and reply:
+        session["history"] = await compact_history(session["history"] + [
+            {"role": "user", "parts": [{"text": request.message.strip()}]},
+            {"role": "model", "parts": [{"text": str(reply).strip()}]},
+        ])
+    store.save(session_id, session)
+    result.data["sessionId"] = session_id
+    return result
+
+async def handle_chat(request: ChatRequest, session: Dict) -> ChatResponse:
     try:
         # LOGIC XỬ LÝ ẢNH MỚI
         image_search_term = ""
@@ -459,7 +786,7 @@ async def chat(request: ChatRequest):
                 
                 if detected_phone_name and "không" not in detected_phone_name.lower():
                     # === [THAY ĐỔI QUAN TRỌNG: TRẢ VỀ NGAY LẬP TỨC] ===
-                    print(f"[CHAT] Image detected as: {detected_phone_name}. Returning immediately.")
+                    logger.debug("[CHAT] Image detected as: %s. Returning immediately.", detected_phone_name)
                     return ChatResponse(
                         success=True,
                         message="Nhận diện ảnh thành công",
@@ -471,9 +798,11 @@ async def chat(request: ChatRequest):
                     )
                     # ==================================================
                 else:
-                     print("[CHAT] Image uploaded but could not identify phone.")
+                     logger.debug("[CHAT] Image uploaded but could not identify phone.")
+            except Overloaded:
+                raise
             except Exception as img_e:
-                print(f"[CHAT] Error processing image: {img_e}")
+                logger.warning("[CHAT] Error processing image: %s", img_e)
                 
         # [SỬA]: Sử dụng user_intent_message thay vì request.message để dùng thông tin từ ảnh
         if not user_intent_message or not user_intent_message.strip():
@@ -487,13 +816,15 @@ async def chat(request: ChatRequest):
             raise HTTPException(status_code=500, detail="GEMINI_API_KEY chưa được cấu hình")
         
         backend_url = request.backendUrl or BACKEND_URL
-        
         lang = (request.language or "").strip().lower()
         if lang not in ("vi", "en"):
             lang = detect_lang(user_intent_message) # [SỬA]: detect từ message đã gộp ảnh
+        # Sửa lỗi gõ brand/model ("iphon 15", "samsumg") cho các bước tìm kiếm/so khớp;
+        # tin nhắn gửi Gemini vẫn là lời khách gốc (user_intent_message)
+        search_message = correct_query_typos(user_intent_message, backend_url, lang)
 
-        print(f"[CHAT] Using model: {GEMINI_MODEL}")
-        print(f"[RAG] Starting RAG pipeline for: \"{user_intent_message}\"") # [SỬA] Log đúng query
+        logger.debug("[CHAT] Using model: %s", GEMINI_MODEL)
+        logger.debug('[RAG] Starting RAG pipeline for: "%s"', search_message) # [SỬA] Log đúng query
 
         # =========================================================
         # [MỚI 1] CHÈN LOGIC XEM GIỎ HÀNG VÀO ĐẦU HÀM
@@ -511,28 +842,64 @@ async def chat(request: ChatRequest):
             )
         # =========================================================
 
+        # Câu hỏi nối tiếp ("cái thứ hai giá bao nhiêu") → trả lời từ sản phẩm đã hiển thị trong session,
+        # bỏ qua retrieval (không gọi backend, không tạo embedding)
+        followup_products = resolve_followup_products(search_message, session.get("products", []))
+
+        # Semantic cache cho câu hỏi đầu tiên: câu hỏi gần giống + cùng intent → dùng lại câu trả lời
+        cache_embedding, cache_intent = None, None
+        if SEMANTIC_CACHE_ENABLED and not followup_products and not request.image and not session.get("history"):
+            cache_embedding = await generate_query_embedding_if_ready(search_message)
+            if cache_embedding is not None:
+                cache_intent = (lang, extract_query_intent(search_message))
+                cached = get_semantic_cache().lookup(cache_embedding, cache_intent)
+                record_cache("semantic_answer", cached is not None)
+                if cached:
+                    session["products"] = list(cached["products"])
+                    return ChatResponse(success=True, message="Gửi tin nhắn thành công", data=dict(cached["data"]))
+
+        # Quá tải / đang bị Gemini giới hạn quota → từ chối ngay, trước khi tốn công retrieval
+        get_llm_admission().check()
+
         # 1. Lấy context từ RAG sớm để kiểm tra xem có thông tin chính sách (PDF) không
         # [SỬA QUAN TRỌNG]: Dùng user_intent_message để RAG tìm đúng sản phẩm trong ảnh
-        rag_context = await retrieve_context(user_intent_message, backend_url)
+        if followup_products:
+            logger.debug("[SESSION] Follow-up on '%s', skipping retrieval", followup_products[0].get('name'))
+            rag_context = {
+                "products": followup_products,
+                "reviews": [],
+                "faqs": [],
+                "policies": [],
+                "query": search_message,
+                "search_term": ""
+            }
+        else:
+            rag_context = await coalesced_retrieve_context(search_message, backend_url)
         formatted_context = format_rag_context(rag_context)
         # Kiểm tra nhanh xem trong context có dữ liệu chính sách từ PDF không
         has_policies = rag_context.get("policies") and len(rag_context["policies"]) > 0
 
         # 2. Phân tích ý định mua điện thoại
         # [SỬA QUAN TRỌNG]: Dùng user_intent_message
-        is_purchase_intent, phone_model, price_condition, price_value = analyze_purchase_intent(user_intent_message)
-        print(f"[CHAT] Analysis result: phone_model='{phone_model}', price_condition='{price_condition}', price_value='{price_value}'")
+        is_purchase_intent, phone_model, price_condition, price_value = analyze_purchase_intent(search_message)
+        logger.debug("[CHAT] Analysis result: phone_model='%s', price_condition='%s', price_value='%s'", phone_model, price_condition, price_value)
+        if followup_products:
+            # Đã biết sản phẩm → không hỏi lại brand/ngân sách
+            is_purchase_intent, phone_model, price_condition, price_value = False, "", "", ""
+        elif rag_context.get("model_match"):
+            # Câu hỏi nêu đúng tên model → đã có sản phẩm, không hỏi lại brand/ngân sách (vẫn lọc theo giá nếu có)
+            is_purchase_intent, phone_model = False, ""
 
         # Kiểm tra nếu user hỏi brand cụ thể mà KHÔNG có trong hệ thống
         brands_not_in_system = ["oneplus", "nokia", "huawei", "motorola", "lg", "asus", "honor", "sony", "google", "pixel"]
         # [SỬA]: Dùng user_intent_message
-        has_unavailable_brand_request = any(brand in user_intent_message.lower() for brand in brands_not_in_system)
+        has_unavailable_brand_request = any(brand in search_message.lower() for brand in brands_not_in_system)
 
         # 3. Logic xử lý: Chỉ hỏi lại thông tin mua sắm NẾU không tìm thấy chính sách liên quan trong PDF
         # [MỚI 3] Thêm điều kiện `and not has_policies` và `and "chính sách" not in msg_lower` 
         # để tránh việc hỏi "chính sách bảo hành" bị bắt vào đây.
         if is_purchase_intent and phone_model and not price_condition and not price_value and not has_policies:
-            print(f"[PURCHASE] Brand '{phone_model}' detected, no price info, and NO policies found - asking for price")
+            logger.debug("[PURCHASE] Brand '%s' detected, no price info, and NO policies found - asking for price", phone_model)
 
             brand_responses_vi = {
                 "iphone": "Dạ, iPhone hiện có nhiều mẫu từ phổ thông đến cao cấp. Bạn cho mình biết ngân sách dự kiến để mình tư vấn model phù hợp nhất nhé?",
@@ -566,7 +933,7 @@ async def chat(request: ChatRequest):
         # Mua chung chung nhưng KHÔNG có chính sách nào khớp: Hỏi lại brand/giá
         # [MỚI] Thêm check `and "chính sách" not in msg_lower` để sửa lỗi.
         elif is_purchase_intent and not phone_model and not price_value and not has_policies and "chính sách" not in msg_lower and "bảo hành" not in msg_lower:
-            print("[PURCHASE] Generic purchase intent but NO policies found")
+            logger.debug("[PURCHASE] Generic purchase intent but NO policies found")
             response_text = t(
                 lang,
                 'Để tôi tư vấn chính xác hơn, bạn quan tâm đến dòng điện thoại nào và có khoảng giá bao nhiêu không?',
@@ -579,39 +946,29 @@ async def chat(request: ChatRequest):
                 data={"response": response_text, "products": [], "type": "text"}
             )
         
-        model_name = GEMINI_MODEL
-        if not model_name.startswith("models/"):
-            model_name = f"models/{model_name}"
         system_prompt = SYSTEM_PROMPT if lang == "vi" else SYSTEM_PROMPT_EN
+        # Model + system prompt được tạo 1 lần và dùng lại giữa các request
+        model = get_generative_model(GEMINI_MODEL, system_prompt)
         
-        try:
-            model = genai.GenerativeModel(
-                model_name=model_name,
-                system_instruction=system_prompt
-            )
-        except TypeError:
-            model = genai.GenerativeModel(
-                GEMINI_MODEL,
-                system_instruction=system_prompt
-            )
-        
-        history = build_history(request.conversationHistory)
+        # Session đã có history phía server thì dùng, không thì lấy từ client (tương thích ngược)
+        history = list(session.get("history") or []) or build_history(request.conversationHistory)
         
         if history and history[0]["role"] != "user":
-            print("[CHAT] History không hợp lệ, bỏ qua history")
+            logger.debug("[CHAT] History không hợp lệ, bỏ qua history")
             history = []
-        
-        chat_session = model.start_chat(history=history)
+        history = await compact_history(history)
         
         # [SỬA]: Dùng user_intent_message
         enhanced_message = user_intent_message.strip()
         if formatted_context:
             enhanced_message = f"{enhanced_message}{formatted_context}"
-            print(f"[RAG] Context added ({len(formatted_context)} chars)")
+            logger.debug("[RAG] Context added (%s chars)", len(formatted_context))
         else:
-            print("[RAG] No relevant context found")
+            logger.debug("[RAG] No relevant context found")
         
-        response = chat_session.send_message(enhanced_message)
+        with span("llm"):
+            response = await coalesced_send_message(model, system_prompt, history, enhanced_message)
+        record_llm_tokens(*_llm_token_counts(response, history, enhanced_message))
         
         if not response or not response.text:
             raise HTTPException(status_code=500, detail="Không nhận được phản hồi từ Gemini API")
@@ -629,7 +986,7 @@ async def chat(request: ChatRequest):
                 search_term = ""
 
             # Kiểm tra xem search_term có phải brand cụ thể không
-            brand_keywords = ["iphone", "samsung", "xiaomi", "oppo", "vivo", "realme", "oneplus", "nokia", "huawei", "galaxy", "pixel", "google", "motorola", "lg", "asus", "honor", "sony"]
+            brand_keywords = known_brands()
             is_specific_brand_search = search_term and any(brand.lower() in search_term.lower() for brand in brand_keywords)
 
             # 1) Ưu tiên sản phẩm từ RAG context
@@ -638,44 +995,44 @@ async def chat(request: ChatRequest):
             # KHÔNG cắt xuống 3 quá sớm (sẽ làm lệch giá). Chỉ giới hạn nhẹ để xử lý nhanh.
             if raw_products:
                 raw_products = raw_products[:50]
-                print(f"[CHAT] Using {len(raw_products)} products from RAG context (pre-filter)")
+                logger.debug("[CHAT] Using %s products from RAG context (pre-filter)", len(raw_products))
                 # Debug: show first product name
                 if raw_products:
                     first_product = raw_products[0].get('name', 'Unknown')
-                    print(f"[CHAT] First product: {first_product}")
+                    logger.debug("[CHAT] First product: %s", first_product)
             else:
-                print("[CHAT] No products from RAG context")
+                logger.debug("[CHAT] No products from RAG context")
 
             # 2) Nếu RAG không có, fallback gọi internal search với backend_url nhận từ BE
             # Nhưng chỉ fallback nếu KHÔNG phải tìm brand cụ thể, hoặc nếu tìm brand cụ thể mà vẫn có sản phẩm
             if (not raw_products) and backend_url and search_term:
                 if not is_specific_brand_search:
                     # Không phải brand cụ thể -> có thể fallback
-                    print(f"[RAG] No products from RAG, fallback to internal products search via backendUrl={backend_url}, search='{search_term}'")
+                    logger.info("[RAG] No products from RAG, fallback to internal products search via backendUrl=%s, search='%s'", backend_url, search_term)
                     fallback_products = await get_products_from_backend(backend_url, search_term)
                     raw_products = fallback_products[:50]
                 else:
                     # Là brand cụ thể -> thử tìm chính xác brand đó trước
-                    print(f"[RAG] Specific brand search '{search_term}', trying exact match first")
+                    logger.debug("[RAG] Specific brand search '%s', trying exact match first", search_term)
                     fallback_products = await get_products_from_backend(backend_url, search_term)
                     if fallback_products:
                         raw_products = fallback_products[:50]
-                        print(f"[RAG] Found {len(raw_products)} products for brand '{search_term}'")
+                        logger.debug("[RAG] Found %s products for brand '%s'", len(raw_products), search_term)
                     else:
-                        print(f"[RAG] No products found for brand '{search_term}', not falling back to other brands")
+                        logger.debug("[RAG] No products found for brand '%s', not falling back to other brands", search_term)
 
             # 3) Nếu vẫn rỗng và BACKEND_URL khác backend_url, thử thêm 1 lần với BACKEND_URL từ .env
             # Chỉ fallback nếu không phải brand cụ thể
             if (not raw_products) and BACKEND_URL and BACKEND_URL != backend_url and search_term and not is_specific_brand_search:
-                print(f"[RAG] Second fallback using BACKEND_URL={BACKEND_URL}, search='{search_term}'")
+                logger.info("[RAG] Second fallback using BACKEND_URL=%s, search='%s'", BACKEND_URL, search_term)
                 fallback_products_env = await get_products_from_backend(BACKEND_URL, search_term)
                 raw_products = fallback_products_env[:50]
 
             # 4) Nếu vẫn rỗng: KHÔNG trả sản phẩm mặc định khi tìm brand cụ thể
             if not raw_products and not is_specific_brand_search:
-                print("[RAG] Still no products after fallbacks, returning empty list (no generic suggestions)")
+                logger.info("[RAG] Still no products after fallbacks, returning empty list (no generic suggestions)")
             elif not raw_products and is_specific_brand_search:
-                print(f"[RAG] No products found for specific brand '{search_term}', returning empty (no fallback to other brands)")
+                logger.info("[RAG] No products found for specific brand '%s', returning empty (no fallback to other brands)", search_term)
                 # Đảm bảo raw_products vẫn rỗng để không có products trong response
 
             # Nếu người dùng nêu brand cụ thể, lọc products theo brand để tránh trả sai thương hiệu
@@ -689,133 +1046,81 @@ async def chat(request: ChatRequest):
                         filtered_products.append(p)
                 if filtered_products:
                     raw_products = filtered_products
-                    print(f"[CHAT] Brand filter applied for '{brand_key}', kept {len(raw_products)} products")
+                    logger.debug("[CHAT] Brand filter applied for '%s', kept %s products", brand_key, len(raw_products))
                 else:
-                    print(f"[CHAT] Brand filter removed all products for brand '{brand_key}'")
+                    logger.debug("[CHAT] Brand filter removed all products for brand '%s'", brand_key)
                     raw_products = []
 
             # Nếu sau khi lọc brand bị trống, thử fallback keyword search theo brand
             if phone_model and backend_url and not raw_products:
                 brand_search = phone_model.split()[0]
-                print(f"[CHAT] Brand-filter empty, fallback search for brand '{brand_search}' via backend")
+                logger.info("[CHAT] Brand-filter empty, fallback search for brand '%s' via backend", brand_search)
                 brand_fallback = await get_products_from_backend(backend_url, brand_search)
                 raw_products = brand_fallback[:50]
                 if raw_products:
-                    print(f"[CHAT] Brand fallback found {len(raw_products)} products for '{brand_search}'")
+                    logger.info("[CHAT] Brand fallback found %s products for '%s'", len(raw_products), brand_search)
                 elif BACKEND_URL and BACKEND_URL != backend_url:
-                    print(f"[CHAT] Brand fallback retry with BACKEND_URL for '{brand_search}'")
+                    logger.info("[CHAT] Brand fallback retry with BACKEND_URL for '%s'", brand_search)
                     brand_fallback_env = await get_products_from_backend(BACKEND_URL, brand_search)
                     raw_products = brand_fallback_env[:50]
                     if raw_products:
-                        print(f"[CHAT] Brand fallback (env) found {len(raw_products)} products for '{brand_search}'")
+                        logger.info("[CHAT] Brand fallback (env) found %s products for '%s'", len(raw_products), brand_search)
 
-            # Filter sản phẩm theo điều kiện giá nếu có
-            if raw_products and price_condition and price_value:
+            # Filter sản phẩm theo điều kiện giá nếu có (index giá: bisect thay vì lọc + sort từng nhánh)
+            if raw_products and price_value:
                 try:
                     target_price = int(price_value)
-                    print(f"[PRICE] Filtering products by condition '{price_condition}' with value {target_price}")
-
-                    def get_price(p):
-                        return p.get("salePrice") or p.get("price") or p.get("minPrice") or 0
-
-                    original_products = raw_products[:]
+                    price_index = PriceIndex(raw_products)
 
                     if price_condition == "duoi":
-                        filtered = [p for p in raw_products if get_price(p) <= target_price]
-                        if filtered:
-                            # Ưu tiên gần giá mục tiêu nhất nhưng không vượt
-                            raw_products = sorted(filtered, key=lambda x: abs(get_price(x) - target_price))[:3]
-                            print(f"[PRICE] Found {len(raw_products)} products under {target_price}")
+                        # Ưu tiên gần giá mục tiêu nhất nhưng không vượt
+                        if price_index.under(target_price):
+                            raw_products = price_index.nearest(target_price, 3, max_price=target_price)
+                            logger.debug("[PRICE] Found %s products under %s", len(raw_products), target_price)
                         else:
                             # Không có sản phẩm dưới giá: lấy 3 sản phẩm gần nhất bất kể cao hơn
-                            raw_products = sorted(original_products, key=lambda x: abs(get_price(x) - target_price))[:3]
-                            print(f"[PRICE] No products under {target_price}, showing closest by price")
+                            raw_products = price_index.nearest(target_price, 3)
+                            logger.debug("[PRICE] No products under %s, showing closest by price", target_price)
 
                     elif price_condition in ["tu", "tren"]:
-                        filtered = [p for p in raw_products if get_price(p) >= target_price]
-                        if filtered:
-                            # Ưu tiên gần giá mục tiêu nhất nhưng không thấp hơn
-                            raw_products = sorted(filtered, key=lambda x: abs(get_price(x) - target_price))[:3]
-                            print(f"[PRICE] Found {len(raw_products)} products from/above {target_price}")
+                        # Ưu tiên gần giá mục tiêu nhất nhưng không thấp hơn
+                        if price_index.at_least(target_price):
+                            raw_products = price_index.nearest(target_price, 3, min_price=target_price)
+                            logger.debug("[PRICE] Found %s products from/above %s", len(raw_products), target_price)
                         else:
                             # Không có sản phẩm trên giá: lấy 3 sản phẩm gần nhất
-                            raw_products = sorted(original_products, key=lambda x: abs(get_price(x) - target_price))[:3]
-                            print(f"[PRICE] No products above {target_price}, showing closest by price")
+                            raw_products = price_index.nearest(target_price, 3)
+                            logger.debug("[PRICE] No products above %s, showing closest by price", target_price)
 
                     elif price_condition == "khoang":
                         # Khoảng/tầm giá: ưu tiên trong ±20%, sắp xếp theo độ gần; nếu trống, lấy gần nhất toàn bộ
-                        margin = target_price * 0.2
-                        min_price = target_price - margin
-                        max_price = target_price + margin
-                        filtered = [p for p in raw_products if min_price <= get_price(p) <= max_price]
-                        if filtered:
-                            raw_products = sorted(filtered, key=lambda x: abs(get_price(x) - target_price))[:3]
-                            print(f"[PRICE] Found {len(raw_products)} products around {target_price}")
+                        if price_index.within(target_price, 0.2):
+                            raw_products = price_index.nearest(
+                                target_price, 3, min_price=target_price * 0.8, max_price=target_price * 1.2
+                            )
+                            logger.debug("[PRICE] Found %s products around %s", len(raw_products), target_price)
                         else:
-                            raw_products = sorted(original_products, key=lambda x: abs(get_price(x) - target_price))[:3]
-                            print(f"[PRICE] No products in range, showing closest by price")
+                            raw_products = price_index.nearest(target_price, 3)
+                            logger.debug("[PRICE] No products in range, showing closest by price")
 
-                except Exception as e:
-                    print(f"[PRICE] Error filtering by price: {e}")
+                    else:
+                        # Có giá nhưng không nhận diện được điều kiện, vẫn ưu tiên sản phẩm gần giá nhất
+                        raw_products = price_index.nearest(target_price, 3)
+                        logger.debug("[PRICE] No condition, sorted by closeness to %s", target_price)
 
-            # Nếu có giá nhưng không nhận diện được điều kiện, vẫn ưu tiên sản phẩm gần giá nhất
-            elif raw_products and price_value and not price_condition:
-                try:
-                    target_price = int(price_value)
-                    def get_price(p):
-                        return p.get("salePrice") or p.get("price") or p.get("minPrice") or 0
-                    raw_products = sorted(raw_products, key=lambda x: abs(get_price(x) - target_price))[:3]
-                    print(f"[PRICE] No condition, sorted by closeness to {target_price}")
                 except Exception as e:
-                    print(f"[PRICE] Error in fallback price sort: {e}")
+                    logger.warning("[PRICE] Error filtering by price: %s", e)
 
-            def to_int_price(val):
-                try:
-                    if val is None:
-                        return None
-                    if isinstance(val, (int, float)):
-                        return int(val)
-                    # handle numeric strings
-                    s = str(val).strip().replace(",", "")
-                    return int(float(s))
-                except Exception:
-                    return None
-
-            # [MỚI 2] XỬ LÝ SẢN PHẨM: Lấy Option ID để sửa lỗi 0đ
-            for p in raw_products[:15]: 
+            # Card đã được chuẩn hóa sẵn khi sản phẩm vào catalog → chỉ tra theo id
+            for p in raw_products[:15]:
                 if not p: continue
-                
-                # 1. Lấy Product ID
-                p_id = p.get("productId") or p.get("_id") or p.get("id")
-                
-                # 2. Lấy Option ID (Code thêm vào)
-                option_id = None
-                opts = p.get("options") or p.get("variants") or []
-                if isinstance(opts, list) and len(opts) > 0:
-                    first_opt = opts[0]
-                    option_id = first_opt.get("_id") or first_opt.get("id") or first_opt.get("optionId")
-
-                # 3. Xử lý giá tiền
-                try:
-                    raw_price = p.get("salePrice") or p.get("price") or p.get("minPrice") or 0
-                    if isinstance(raw_price, str):
-                        normalized_price = int(float(raw_price.replace(",", "").replace(".", "")))
-                    else:
-                        normalized_price = int(raw_price)
-                except:
-                    normalized_price = 0
-
-                # 4. Thêm vào danh sách trả về
-                products.append({
-                    "productId": str(p_id), 
-                    "optionId": str(option_id) if option_id else None, # Gửi kèm optionId
-                    "name": p.get("name"),
-                    "price": normalized_price,
-                    "thumbnail": p.get("cheapestOptionImage") or p.get("thumbnail") or p.get("image") or "https://via.placeholder.com/150",
-                    "stockQuantity": p.get("stockQuantity", 0),
-                })
+                products.append(get_card(p).to_dict())
+
+            if products and not followup_products:
+                # Lưu sản phẩm vừa hiển thị để trả lời câu hỏi nối tiếp
+                session["products"] = raw_products[:len(products)]
         except Exception as e:
-            print(f"[CHAT] Error normalizing products for cards: {e}")
+            logger.warning("[CHAT] Error normalizing products for cards: %s", e)
             products = []
 
         # Nếu brand hợp lệ nhưng không lấy được sản phẩm -> hỏi lại ngân sách thay vì trả trống
@@ -878,7 +1183,7 @@ async def chat(request: ChatRequest):
                 f"At the moment, I don’t have accurate information in our system about {brand_display} phones {price_desc}. This brand may not be available in our current product list.\n\nIf you’re interested, please contact Phonify Customer Support to check the latest stock and product details."
             )
             response_type = "text"
-            print(f"[CHAT] Specific brand '{phone_model or 'unknown'}' requested but no products found, returning text only")
+            logger.debug("[CHAT] Specific brand '%s' requested but no products found, returning text only", phone_model or 'unknown')
         else:
             # Logic xử lý response đồng bộ với products
 
@@ -910,7 +1215,9 @@ async def chat(request: ChatRequest):
                 brand_text_display = format_brand_display(brand_text)
                 
                 # Nếu AI đã trả lời (từ Gemini) và có vẻ hợp lý thì dùng, nếu không thì dùng template
-                if "tìm thấy" not in cleaned_text.lower():
+                if followup_products:
+                      response_text = cleaned_text # Câu hỏi nối tiếp: Gemini trả lời về sản phẩm đã chọn
+                elif "tìm thấy" not in cleaned_text.lower():
                       lines = [t(lang,
                         "Chào bạn, tôi là trợ lý AI từ Phonify, rất vui được hỗ trợ bạn.\n",
                         "Hello! I'm Phonify's AI assistant. Happy to help you.\n"
@@ -930,11 +1237,11 @@ async def chat(request: ChatRequest):
                       response_text = cleaned_text # Dùng lời của Gemini nếu nó đã tìm thấy
 
                 response_type = "products"
-                print(f"[CHAT] Generated synchronized response with {len(products)} products")
+                logger.debug("[CHAT] Generated synchronized response with %s products", len(products))
             
             # [LOGIC QUAN TRỌNG ĐỂ TRẢ LỜI CHÍNH SÁCH]
             elif has_policies:
-                print(f"[CHAT] No products but found policies. Using Gemini's text response.")
+                logger.debug("[CHAT] No products but found policies. Using Gemini's text response.")
                 response_text = cleaned_text
                 response_type = "text"
             
@@ -956,42 +1263,50 @@ async def chat(request: ChatRequest):
                         "Bạn có thể cung cấp thêm ngân sách hoặc thử từ khóa khác, hoặc liên hệ CSKH để được hỗ trợ nhanh nhất."
                     )
                     response_type = "text"
-                    print("[CHAT] Using safe fallback response (no products found)")
+                    logger.info("[CHAT] Using safe fallback response (no products found)")
 
         if products:
             response_type = "products" # <-- Bắt buộc phải là "products"
             # Nếu AI chưa nói câu mời chào thì thêm vào
-            if "tìm thấy" not in response_text.lower() and "dưới đây" not in response_text.lower():
+            if not followup_products and "tìm thấy" not in response_text.lower() and "dưới đây" not in response_text.lower():
                 response_text = "Dưới đây là các sản phẩm mình tìm được:\n" + response_text
 
+        data = {
+            "response": response_text,
+            "products": products,
+            "type": response_type
+        }
+        if cache_embedding is not None:
+            get_semantic_cache().store(
+                cache_embedding, cache_intent, search_message,
+                [p["productId"] for p in products], dict(data),
+                session.get("products", []) if products else []
+            )
+
         return ChatResponse(
             success=True,
             message="Gửi tin nhắn thành công",
-            data={
-                "response": response_text,
-                "products": products,
-                "type": response_type
-            }
+            data=data
         )
         
     except HTTPException:
         raise
+    except Overloaded as e:
+        raise HTTPException(
+            status_code=503,
+            detail="Hệ thống đang quá tải, vui lòng thử lại sau ít phút.",
+            headers={"Retry-After": str(math.ceil(e.retry_after))}
+        )
     except Exception as e:
-        # Safe error logging with UTF-8 encoding
-        try:
-            error_msg = str(e)
-            print(f"Error in chat endpoint: {error_msg}")
-            error_str = error_msg
-        except UnicodeEncodeError:
-            # Fallback if encoding still fails
-            error_msg = repr(e)
-            print(f"Error in chat endpoint (encoded): {error_msg}")
-            error_str = error_msg
+        error_str = str(e)
+        logger.exception("[CHAT] Error in chat endpoint: %s", error_str)
         
-        if "quota" in error_str.lower() or "rate limit" in error_str.lower() or "exceeded" in error_str.lower() or "429" in error_str:
+        retry_after = rate_limit_retry_after(e)
+        if retry_after is not None:
             raise HTTPException(
                 status_code=503,
-                detail=f"Đã vượt quá giới hạn quota của Gemini API (Free Tier).\n\nGiải pháp:\n1. Đợi 1-2 giờ để quota reset\n2. Tạo API key mới tại: https://makersuite.google.com/app/apikey\n3. Cập nhật GEMINI_API_KEY trong file .env và restart server"
+                detail=f"Đã vượt quá giới hạn quota của Gemini API (Free Tier).\n\nGiải pháp:\n1. Đợi 1-2 giờ để quota reset\n2. Tạo API key mới tại: https://makersuite.google.com/app/apikey\n3. Cập nhật GEMINI_API_KEY trong file .env và restart server",
+                headers={"Retry-After": str(math.ceil(retry_after))}
             )
         
         raise HTTPException(
@@ -1000,5 +1315,8 @@ async def chat(request: ChatRequest):
         )
 
 if __name__ == "__main__":
-    import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=AI_SERVICE_PORT)
+    if AI_SERVICE_WORKERS > 1:
+        prefork.serve(app, "0.0.0.0", AI_SERVICE_PORT, AI_SERVICE_WORKERS, build_preload_steps())
+    else:
+        import uvicorn
+        uvicorn.run(app, host="0.0.0.0", port=AI_SERVICE_PORT)
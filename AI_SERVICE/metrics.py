@@ -0,0 +1,186 @@
+"""
+Metrics - Đo thời gian từng bước xử lý và xuất ra /metrics theo định dạng text của Prometheus
+
+- span("stage"): context manager đo thời gian 1 bước (backend, embedding, vector search, Gemini...)
+  → histogram phonify_stage_duration_seconds{stage=...}; đồng thời ghi vào bảng thời gian của request
+  hiện tại (contextvars) để log tổng kết cuối request
+- Counter cho cache hit/miss, fallback đã dùng, token LLM, admission control của lời gọi LLM
+- Không cần thư viện prometheus_client: định dạng text exposition đủ đơn giản để tự render
+"""
+
+import threading
+import time
+from abc import ABC, abstractmethod
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+_LabelValues = Tuple[str, ...]
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+class _Metric(ABC):
+    type_name = ""
+
+    def __init__(self, name: str, help_text: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, str]) -> _LabelValues:
+        return tuple(str(labels.get(n, "")) for n in self.labelnames)
+
+    def render(self) -> List[str]:
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.type_name}"] + self._samples()
+
+    @abstractmethod
+    def _samples(self) -> List[str]:
+        ...
+
+
+class Counter(_Metric):
+    type_name = "counter"
+
+    def __init__(self, name: str, help_text: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, help_text, labelnames)
+        self._values: Dict[_LabelValues, float] = {}
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def value(self, **labels) -> float:
+        return self._values.get(self._key(labels), 0.0)
+
+    def _samples(self) -> List[str]:
+        return [f"{self.name}{_format_labels(self.labelnames, k)} {v}" for k, v in sorted(self._values.items())]
+
+
+class Histogram(_Metric):
+    type_name = "histogram"
+
+    def __init__(self, name: str, help_text: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, help_text, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._series: Dict[_LabelValues, List[float]] = {}  # {labels: [count theo bucket..., +Inf, sum]}
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        idx = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [0.0] * (len(self.buckets) + 2)
+            series[idx] += 1  # chỉ tăng bucket nhỏ nhất chứa value, cộng dồn lúc render
+            series[-1] += value
+
+    def _samples(self) -> List[str]:
+        lines = []
+        for key, series in sorted(self._series.items()):
+            cumulative = 0.0
+            for bound, count in zip(self.buckets + (float("inf"),), series[:-1]):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                labels = _format_labels(self.labelnames, key, 'le="%s"' % le)
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, key)} {series[-1]}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, key)} {cumulative}")
+        return lines
+
+
+class Gauge(_Metric):
+    """Gauge lấy giá trị lúc render (callback), vd: số session, số entry trong cache"""
+    type_name = "gauge"
+
+    def __init__(self, name: str, help_text: str, callback: Callable[[], float]):
+        super().__init__(name, help_text)
+        self.callback = callback
+
+    def _samples(self) -> List[str]:
+        try:
+            return [f"{self.name} {float(self.callback())}"]
+        except Exception:
+            return []
+
+
+_registry: List[_Metric] = []
+
+
+def _register(metric):
+    _registry.append(metric)
+    return metric
+
+
+def register_gauge(name: str, help_text: str, callback: Callable[[], float]) -> Gauge:
+    return _register(Gauge(name, help_text, callback))
+
+
+REQUESTS = _register(Counter("phonify_requests_total", "Số request theo endpoint và kết quả", ("endpoint", "status")))
+REQUEST_DURATION = _register(Histogram("phonify_request_duration_seconds", "Thời gian xử lý request", ("endpoint",)))
+STAGE_DURATION = _register(Histogram("phonify_stage_duration_seconds", "Thời gian từng bước xử lý", ("stage",)))
+CACHE_EVENTS = _register(Counter("phonify_cache_events_total", "Cache hit/miss", ("cache", "result")))
+FALLBACKS = _register(Counter("phonify_fallbacks_total", "Số lần phải dùng đường dự phòng", ("kind",)))
+LLM_TOKENS = _register(Counter("phonify_llm_tokens_total", "Token gửi/nhận từ Gemini", ("kind",)))
+LLM_ADMISSION = _register(Counter("phonify_llm_admission_total", "Lời gọi Gemini được nhận / bị từ chối / bị 429", ("result",)))
+
+_request_spans: ContextVar[Optional[Dict[str, float]]] = ContextVar("request_spans", default=None)
+
+
+def render_metrics() -> str:
+    lines: List[str] = []
+    for metric in _registry:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+@contextmanager
+def span(stage: str) -> Iterator[None]:
+    """Đo thời gian 1 bước xử lý (dùng được trong cả code sync lẫn async)"""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - started
+        STAGE_DURATION.observe(elapsed, stage=stage)
+        spans = _request_spans.get()
+        if spans is not None:
+            spans[stage] = spans.get(stage, 0.0) + elapsed
+
+
+def begin_request() -> Dict[str, float]:
+    """Bắt đầu bảng thời gian cho request hiện tại (mỗi task asyncio có context riêng)"""
+    spans: Dict[str, float] = {}
+    _request_spans.set(spans)
+    return spans
+
+
+def record_cache(cache: str, hit: bool):
+    CACHE_EVENTS.inc(cache=cache, result="hit" if hit else "miss")
+
+
+def record_fallback(kind: str):
+    FALLBACKS.inc(kind=kind)
+
+
+def record_admission(result: str):
+    LLM_ADMISSION.inc(result=result)
+
+
+def record_llm_tokens(prompt_tokens: int, response_tokens: int):
+    LLM_TOKENS.inc(prompt_tokens, kind="prompt")
+    LLM_TOKENS.inc(response_tokens, kind="response")
@@ -0,0 +1,178 @@
+"""
+Policy Chunker - Chia văn bản chính sách theo cấu trúc thay vì cắt cứng theo ký tự
+
+- Nhận diện heading (dòng VIẾT HOA như "CHƯƠNG I: ...", dòng đánh số như "1. Chế độ ...")
+  để ghi lại tiêu đề mục cho từng chunk
+- Ghép các dòng bị ngắt của PDF thành đoạn, dòng bắt đầu bằng bullet (•, o, -, ...) mở đoạn mới
+- Gom đoạn vào chunk trong giới hạn token; đoạn quá dài thì tách theo câu
+- Loại chunk gần trùng lặp bằng MinHash trên shingle 3 từ (đã bỏ dấu)
+"""
+
+import os
+import re
+import zlib
+from typing import Dict, List
+
+import numpy as np
+
+from text_utils import estimate_tokens, folded_tokens
+
+POLICY_CHUNK_TOKENS = int(os.getenv("POLICY_CHUNK_TOKENS", "220"))
+POLICY_DEDUP_THRESHOLD = float(os.getenv("POLICY_DEDUP_THRESHOLD", "0.8"))
+
+_BULLET_RE = re.compile(r"^(?:[\uf0b7•\-\*\+]|o\s)\s*")
+_NUMBERED_HEADING_RE = re.compile(r"^\d{1,2}\.\s+\S")
+_CHAPTER_RE = re.compile(r"^(?:CHƯƠNG|PHẦN|ĐIỀU|MỤC)\b", re.IGNORECASE)
+_SENTENCE_SPLIT_RE = re.compile(r"(?<=[.!?;])\s+")
+
+MINHASH_PERMUTATIONS = 64
+MINHASH_BANDS = 16
+_MERSENNE_PRIME = (1 << 61) - 1
+_rng = np.random.default_rng(20260101)  # seed cố định → signature ổn định giữa các lần chạy
+# a, b < 2^31 và crc32 < 2^32 → a * x + b < 2^64, không tràn uint64
+_MINHASH_A = _rng.integers(1, 1 << 31, size=MINHASH_PERMUTATIONS, dtype=np.uint64)
+_MINHASH_B = _rng.integers(0, 1 << 31, size=MINHASH_PERMUTATIONS, dtype=np.uint64)
+
+
+def _is_upper_heading(line: str) -> bool:
+    letters = [ch for ch in line if ch.isalpha()]
+    return len(letters) >= 4 and sum(ch.isupper() for ch in letters) / len(letters) >= 0.85
+
+
+def _is_numbered_heading(line: str) -> bool:
+    return bool(_NUMBERED_HEADING_RE.match(line)) and len(line) <= 90 and not line.endswith((".", ":"))
+
+
+def split_paragraphs(text: str) -> List[Dict]:
+    """
+    Tách text PDF thành các khối {"kind": "h1" | "h2" | "p", "text": ...}.
+    Dòng bị ngắt giữa chừng được nối lại vào đoạn/heading trước đó.
+    """
+    blocks: List[Dict] = []
+    current = None
+    for raw_line in text.splitlines():
+        line = raw_line.strip()
+        if not line:
+            current = None
+            continue
+
+        if _CHAPTER_RE.match(line) or _is_upper_heading(line):
+            # Heading viết hoa bị ngắt dòng → nối tiếp vào heading trước
+            if current is not None and current["kind"] == "h1":
+                current["text"] += " " + line
+            else:
+                current = {"kind": "h1", "text": line}
+                blocks.append(current)
+            continue
+
+        if _is_numbered_heading(line):
+            current = {"kind": "h2", "text": line}
+            blocks.append(current)
+            current = None
+            continue
+
+        bullet = _BULLET_RE.match(line)
+        if bullet or current is None or current["kind"] != "p":
+            current = {"kind": "p", "text": line[bullet.end():] if bullet else line}
+            blocks.append(current)
+        else:
+            current["text"] += " " + line
+    return blocks
+
+
+def _split_long(text: str, max_tokens: int) -> List[str]:
+    """Tách đoạn quá dài theo câu, câu vẫn quá dài thì tách theo từ"""
+    pieces, buf = [], ""
+    for sentence in _SENTENCE_SPLIT_RE.split(text):
+        if estimate_tokens(sentence) > max_tokens:
+            words = sentence.split()
+            sentence_parts, part = [], []
+            for word in words:
+                part.append(word)
+                if estimate_tokens(" ".join(part)) >= max_tokens:
+                    sentence_parts.append(" ".join(part))
+                    part = []
+            if part:
+                sentence_parts.append(" ".join(part))
+        else:
+            sentence_parts = [sentence]
+        for sp in sentence_parts:
+            candidate = f"{buf} {sp}".strip()
+            if buf and estimate_tokens(candidate) > max_tokens:
+                pieces.append(buf)
+                buf = sp
+            else:
+                buf = candidate
+    if buf:
+        pieces.append(buf)
+    return pieces
+
+
+def chunk_policy_text(text: str, max_tokens: int = POLICY_CHUNK_TOKENS) -> List[Dict]:
+    """
+    Chia văn bản chính sách thành chunk {"section", "content"} không vượt max_tokens.
+    Chunk không bao giờ vắt qua 2 mục khác nhau.
+    """
+    chunks: List[Dict] = []
+    h1, h2 = "", ""
+    buf: List[str] = []
+
+    def section_title() -> str:
+        return " > ".join(t for t in (h1, h2) if t)
+
+    def flush():
+        if buf:
+            chunks.append({"section": section_title(), "content": "\n".join(buf)})
+            buf.clear()
+
+    for block in split_paragraphs(text):
+        if block["kind"] == "h1":
+            flush()
+            h1, h2 = block["text"], ""
+            continue
+        if block["kind"] == "h2":
+            flush()
+            h2 = block["text"]
+            continue
+
+        for piece in _split_long(block["text"], max_tokens):
+            if buf and estimate_tokens("\n".join(buf + [piece])) > max_tokens:
+                flush()
+            buf.append(piece)
+    flush()
+    return chunks
+
+
+def minhash_signature(text: str) -> np.ndarray:
+    """MinHash signature trên shingle 3 từ liên tiếp (token đã bỏ dấu)"""
+    tokens = folded_tokens(text)
+    if len(tokens) < 3:
+        shingles = {" ".join(tokens)}
+    else:
+        shingles = {" ".join(tokens[i:i + 3]) for i in range(len(tokens) - 2)}
+    hashes = np.array([zlib.crc32(s.encode("utf-8")) for s in shingles], dtype=np.uint64)
+    # (a * x + b) mod p cho từng permutation, lấy min theo shingle
+    permuted = (np.outer(_MINHASH_A, hashes) + _MINHASH_B[:, None]) % _MERSENNE_PRIME
+    return permuted.min(axis=1)
+
+
+def dedupe_near_duplicates(texts: List[str], threshold: float = POLICY_DEDUP_THRESHOLD) -> List[int]:
+    """
+    Trả về vị trí các text được giữ lại (giữ bản xuất hiện đầu tiên).
+    LSH banding chỉ so sánh các cặp có chung ít nhất 1 band → không phải O(n²).
+    """
+    rows = MINHASH_PERMUTATIONS // MINHASH_BANDS
+    buckets: Dict[tuple, List[int]] = {}
+    kept: List[int] = []
+    signatures: Dict[int, np.ndarray] = {}
+    for i, text in enumerate(texts):
+        sig = minhash_signature(text)
+        bands = [(b, sig[b * rows:(b + 1) * rows].tobytes()) for b in range(MINHASH_BANDS)]
+        candidates = {j for band in bands for j in buckets.get(band, ())}
+        if any(float(np.mean(signatures[j] == sig)) >= threshold for j in candidates):
+            continue
+        kept.append(i)
+        signatures[i] = sig
+        for band in bands:
+            buckets.setdefault(band, []).append(i)
+    return kept
@@ -0,0 +1,395 @@
+"""
+Policy Store - Nạp và index các file PDF chính sách cho RAG
+
+- Chạy nền khi service khởi động, không chặn import/startup của app
+- Manifest lưu {file: sha256 → chunk ids}: lần khởi động sau chỉ parse + embed
+  lại những file mới hoặc đã bị sửa, file không đổi dùng lại vector đã lưu
+- Trích xuất text từng file PDF chạy song song trong process pool
+- Chunk theo heading/đoạn/câu (policy_chunker), bỏ chunk gần trùng, lưu tiêu đề mục
+- Watcher (polling) tự rebuild index khi thư mục PDF thay đổi; index mới được build
+  xong rồi mới swap vào (1 phép gán), reader không bao giờ thấy index dở dang
+- Search: vector của mọi chunk nằm trong 1 ma trận đã normalize → chấm điểm bằng 1 phép
+  nhân ma trận + argpartition lấy top-k; keyword fallback dùng inverted index dựng sẵn
+  trên token đã bỏ dấu
+"""
+
+import os
+import json
+import hashlib
+import multiprocessing
+import time
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from typing import Callable, Dict, List, NamedTuple, Optional, Tuple
+
+import numpy as np
+
+from policy_chunker import chunk_policy_text, dedupe_near_duplicates
+from text_utils import folded_tokens
+from app_logging import get_logger
+
+logger = get_logger(__name__)
+
+POLICY_FOLDER = os.getenv("POLICY_FOLDER", "./data/policies")
+POLICY_INDEX_DIR = os.getenv("POLICY_INDEX_DIR", "./data/policy_index")
+POLICY_EXTRACT_WORKERS = int(os.getenv("POLICY_EXTRACT_WORKERS", str(min(4, os.cpu_count() or 1))))
+POLICY_WATCH_INTERVAL = float(os.getenv("POLICY_WATCH_INTERVAL", "10"))  # giây, 0 = tắt hot reload
+MANIFEST_VERSION = 2  # 2: chunk theo cấu trúc + section title
+
+
+class PolicyIndex(NamedTuple):
+    """Snapshot bất biến của index chính sách"""
+    chunks: Tuple[Dict, ...]            # ({id, source, content}, ...)
+    embeddings: Optional[np.ndarray]    # (n_chunks, dim), read-only; None = chỉ keyword
+    version: int
+    built_at: float
+    keyword_index: Dict[str, Tuple[int, ...]] = {}  # token bỏ dấu → vị trí các chunk chứa token
+
+
+# Reader chỉ đọc tham chiếu _policy_index một lần rồi dùng snapshot đó,
+# writer build snapshot mới rồi gán đè → không cần lock ở phía đọc
+_policy_index = PolicyIndex((), None, 0, 0.0)
+_rebuild_lock = threading.Lock()
+_status = {"status": "not_started", "files": 0, "chunks": 0, "version": 0, "error": None}
+_ingest_thread: Optional[threading.Thread] = None
+_indexed_source: Optional[Tuple] = None  # (thư mục PDF, thư mục index, folder_signature) của index hiện tại
+_stop_event = threading.Event()
+
+
+def file_sha256(path: str) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 16), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def extract_pdf_text(path: str) -> str:
+    """Đọc toàn bộ text của 1 file PDF (chạy trong process con)"""
+    import PyPDF2
+    with open(path, "rb") as f:
+        pdf = PyPDF2.PdfReader(f)
+        return "\n".join((page.extract_text() or "") for page in pdf.pages)
+
+
+def split_into_chunks(content: str) -> List[Dict]:
+    """Chia văn bản theo mục/đoạn/câu và bỏ các chunk gần trùng nhau trong cùng file"""
+    chunks = chunk_policy_text(content)
+    kept = dedupe_near_duplicates([c["content"] for c in chunks])
+    return [chunks[i] for i in kept]
+
+
+def _embedding_text(chunk: Dict) -> str:
+    # Tiêu đề mục giúp vector hiểu ngữ cảnh của đoạn (vd: "CHƯƠNG II: ĐỔI TRẢ > 1. ...")
+    return f"{chunk['section']}\n{chunk['content']}" if chunk.get("section") else chunk["content"]
+
+
+def _extract_many(paths: List[str]) -> Dict[str, Optional[str]]:
+    """Trích xuất text nhiều file, song song bằng process pool nếu có thể"""
+    results: Dict[str, Optional[str]] = {}
+    if POLICY_EXTRACT_WORKERS > 1 and len(paths) > 1:
+        try:
+            workers = min(POLICY_EXTRACT_WORKERS, len(paths))
+            # spawn thay vì fork: lúc này process thường đã có thread của torch / SentenceTransformer
+            # (warm-up, preload), fork 1 process nhiều thread có thể làm process con bị deadlock
+            with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn")) as pool:
+                for path, text in zip(paths, pool.map(extract_pdf_text, paths)):
+                    results[path] = text
+            return results
+        except Exception as e:
+            logger.warning("[PDF] Process pool lỗi (%s), chuyển sang đọc tuần tự", e)
+            results = {}
+
+    for path in paths:
+        try:
+            results[path] = extract_pdf_text(path)
+        except Exception as e:
+            logger.warning("[PDF] Lỗi đọc file %s: %s", os.path.basename(path), e)
+            results[path] = None
+    return results
+
+
+def _manifest_path(index_dir: str) -> str:
+    return os.path.join(index_dir, "manifest.json")
+
+
+def _embeddings_path(index_dir: str, file_hash: str) -> str:
+    return os.path.join(index_dir, f"{file_hash}.npy")
+
+
+def _load_manifest(index_dir: str, model_name: str) -> Dict:
+    try:
+        with open(_manifest_path(index_dir), "r", encoding="utf-8") as f:
+            manifest = json.load(f)
+        # Đổi embedding model / format → index cũ không dùng được nữa
+        if manifest.get("version") == MANIFEST_VERSION and manifest.get("model") == model_name:
+            return manifest
+    except FileNotFoundError:
+        pass
+    except Exception as e:
+        logger.warning("[PDF] Manifest lỗi, sẽ index lại từ đầu: %s", e)
+    return {"version": MANIFEST_VERSION, "model": model_name, "files": {}, "chunks": {}}
+
+
+def _save_manifest(index_dir: str, manifest: Dict):
+    tmp_path = _manifest_path(index_dir) + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False)
+    os.replace(tmp_path, _manifest_path(index_dir))
+
+
+def folder_signature(folder_path: str) -> Dict[str, Tuple[int, int]]:
+    """{filename: (mtime_ns, size)} của các file PDF - rẻ hơn nhiều so với hash"""
+    signature = {}
+    try:
+        with os.scandir(folder_path) as entries:
+            for entry in entries:
+                if entry.name.lower().endswith(".pdf") and entry.is_file():
+                    stat = entry.stat()
+                    signature[entry.name] = (stat.st_mtime_ns, stat.st_size)
+    except FileNotFoundError:
+        pass
+    return signature
+
+
+def ingest_policies(
+    embed_texts: Callable[[List[str]], np.ndarray],
+    model_name: str,
+    folder_path: str = POLICY_FOLDER,
+    index_dir: str = POLICY_INDEX_DIR,
+) -> PolicyIndex:
+    """
+    Quét thư mục PDF chính sách, build index mới theo manifest rồi swap vào.
+
+    Args:
+        embed_texts: Hàm embed một list text → ma trận (n, dim) đã normalize
+        model_name: Tên embedding model (đổi model thì index lại toàn bộ)
+    """
+    global _policy_index, _indexed_source
+    with _rebuild_lock:
+        signature = folder_signature(folder_path)
+        index = _build_policy_index(embed_texts, model_name, folder_path, index_dir, _policy_index.version + 1)
+        _policy_index = index
+        _indexed_source = (folder_path, index_dir, signature)
+    _status.update(
+        files=len({c["source"] for c in index.chunks}),
+        chunks=len(index.chunks),
+        version=index.version,
+    )
+    return index
+
+
+def _build_policy_index(embed_texts, model_name, folder_path, index_dir, version) -> PolicyIndex:
+    if not os.path.exists(folder_path):
+        os.makedirs(folder_path)
+    os.makedirs(index_dir, exist_ok=True)
+
+    manifest = _load_manifest(index_dir, model_name)
+    old_files = manifest["files"]
+    old_chunks = manifest["chunks"]
+
+    # 1. Hash từng file để biết file nào mới/đã sửa
+    current = {}
+    for filename in sorted(os.listdir(folder_path)):
+        if filename.lower().endswith(".pdf"):
+            path = os.path.join(folder_path, filename)
+            try:
+                current[filename] = file_sha256(path)
+            except Exception as e:
+                logger.warning("[PDF] Lỗi đọc file %s: %s", filename, e)
+
+    changed = [f for f, h in current.items() if old_files.get(f, {}).get("hash") != h]
+    extracted = _extract_many([os.path.join(folder_path, f) for f in changed])
+
+    # 2. Ghép manifest mới: file không đổi giữ nguyên chunk ids, file đổi thì chunk lại
+    files, chunks = {}, {}
+    for filename, file_hash in current.items():
+        if filename not in changed:
+            files[filename] = old_files[filename]
+            for chunk_id in files[filename]["chunk_ids"]:
+                chunks[chunk_id] = old_chunks[chunk_id]
+            continue
+        content = extracted.get(os.path.join(folder_path, filename))
+        if not content or not content.strip():
+            continue
+        chunk_ids = []
+        for i, chunk in enumerate(split_into_chunks(content)):
+            chunk_id = f"{filename}:{file_hash[:12]}:{i}"
+            chunks[chunk_id] = {"source": filename, "section": chunk["section"], "content": chunk["content"]}
+            chunk_ids.append(chunk_id)
+        files[filename] = {"hash": file_hash, "chunk_ids": chunk_ids}
+        logger.info("[PDF] Đã nạp file: %s (%s đoạn)", filename, len(chunk_ids))
+
+    # 3. Embedding: dùng lại file .npy nếu có, chỉ embed file mới/đã sửa
+    # Nếu embed lỗi (model chưa load được) vẫn giữ chunks để keyword fallback hoạt động,
+    # file .npy không được ghi nên lần sau chỉ embed lại, không cần parse lại PDF
+    database, matrices = [], []
+    for filename, entry in files.items():
+        texts = [_embedding_text(chunks[cid]) for cid in entry["chunk_ids"]]
+        for cid in entry["chunk_ids"]:
+            database.append({"id": cid, **chunks[cid]})
+        if matrices is None:
+            continue
+        emb_path = _embeddings_path(index_dir, entry["hash"])
+        embeddings = None
+        if os.path.exists(emb_path):
+            try:
+                embeddings = np.load(emb_path)
+                if embeddings.shape[0] != len(texts):
+                    embeddings = None
+            except Exception:
+                embeddings = None
+        if embeddings is None:
+            logger.info("[PDF] Đang tạo vector cho %s đoạn của %s...", len(texts), filename)
+            try:
+                embeddings = np.asarray(embed_texts(texts), dtype=np.float32)
+                np.save(emb_path, embeddings)
+            except Exception as e:
+                logger.warning("[PDF] Không tạo được vector (%s), chỉ dùng keyword search cho chính sách", e)
+                matrices = None
+                continue
+        matrices.append(embeddings)
+
+    # 4. Dọn vector của file đã bị xóa/sửa
+    live_hashes = {entry["hash"] for entry in files.values()}
+    for entry in old_files.values():
+        if entry["hash"] not in live_hashes:
+            try:
+                os.remove(_embeddings_path(index_dir, entry["hash"]))
+            except OSError:
+                pass
+
+    manifest["files"], manifest["chunks"] = files, chunks
+    _save_manifest(index_dir, manifest)
+
+    embeddings = np.vstack(matrices) if matrices else None
+
+    # 5. Bỏ chunk gần trùng giữa các file (boilerplate lặp lại ở nhiều PDF)
+    kept = dedupe_near_duplicates([c["content"] for c in database])
+    if len(kept) < len(database):
+        logger.info("[PDF] Removed %s near-duplicate chunks", len(database) - len(kept))
+        database = [database[i] for i in kept]
+        if embeddings is not None:
+            embeddings = embeddings[kept]
+    if embeddings is not None:
+        embeddings.flags.writeable = False
+    reused = len(files) - len([f for f in changed if f in files])
+    logger.info("[PDF] Policy index v%s ready: %s files (%s reused), %s chunks", version, len(files), reused, len(database))
+    return PolicyIndex(tuple(database), embeddings, version, time.time(), build_keyword_index(database))
+
+
+def build_keyword_index(chunks) -> Dict[str, Tuple[int, ...]]:
+    """Inverted index: token (đã bỏ dấu) → tuple vị trí chunk, dựng 1 lần khi build index"""
+    postings: Dict[str, List[int]] = {}
+    for i, chunk in enumerate(chunks):
+        for token in set(folded_tokens(chunk["content"], min_len=3)):
+            postings.setdefault(token, []).append(i)
+    return {token: tuple(ids) for token, ids in postings.items()}
+
+
+def vector_search(index: PolicyIndex, query_emb: np.ndarray, top_k: int, min_score: float) -> List[Tuple[int, float]]:
+    """Top-k chunk theo cosine similarity (vector đã normalize nên dot = cosine)"""
+    if index.embeddings is None or not len(index.chunks):
+        return []
+    scores = index.embeddings @ np.asarray(query_emb, dtype=index.embeddings.dtype)
+    if top_k < len(scores):
+        candidates = np.argpartition(-scores, top_k)[:top_k]
+    else:
+        candidates = np.arange(len(scores))
+    candidates = candidates[np.argsort(-scores[candidates])]
+    return [(int(i), float(scores[i])) for i in candidates if scores[i] > min_score]
+
+
+def keyword_search(index: PolicyIndex, query: str, top_k: int) -> List[int]:
+    """Chunk chứa nhiều token của query nhất (không phân biệt dấu), ưu tiên chunk đứng trước"""
+    hits: Dict[int, int] = {}
+    for token in set(folded_tokens(query, min_len=3)):
+        for i in index.keyword_index.get(token, ()):
+            hits[i] = hits.get(i, 0) + 1
+    return sorted(hits, key=lambda i: (-hits[i], i))[:top_k]
+
+
+def _run_ingestion(embed_texts, model_name, folder_path, index_dir):
+    if _status["status"] != "ready":
+        _status.update(status="loading", error=None)
+    try:
+        ingest_policies(embed_texts, model_name, folder_path, index_dir)
+        _status.update(status="ready", error=None)
+    except Exception as e:
+        # Lỗi khi hot reload: giữ nguyên index cũ đang phục vụ
+        _status.update(status="error" if not _policy_index.chunks else "ready", error=str(e))
+        logger.warning("[PDF] Policy ingestion failed: %s", e)
+
+
+def _ingest_and_watch(embed_texts, model_name, folder_path, index_dir, interval, embeddings_ready):
+    signature = folder_signature(folder_path)
+    if _policy_index.chunks and _indexed_source == (folder_path, index_dir, signature):
+        # Index đã được nạp sẵn từ đúng thư mục này (vd: ở master process trước khi fork worker)
+        # → dùng luôn, không load lại ma trận embedding thành 1 bản riêng của worker
+        _status.update(status="ready", error=None)
+    else:
+        _run_ingestion(embed_texts, model_name, folder_path, index_dir)
+    if interval <= 0:
+        return
+    while not _stop_event.wait(interval):
+        current = folder_signature(folder_path)
+        if current != signature:
+            logger.info("[PDF] Phát hiện thay đổi trong thư mục chính sách, đang rebuild index...")
+            signature = current
+            _run_ingestion(embed_texts, model_name, folder_path, index_dir)
+        elif _policy_index.chunks and _policy_index.embeddings is None and embeddings_ready():
+            # Lần build trước chỉ có keyword (model chưa load được) → embed lại khi model đã sẵn sàng
+            logger.info("[PDF] Embedding model đã sẵn sàng, đang rebuild index chính sách kèm vector...")
+            _run_ingestion(embed_texts, model_name, folder_path, index_dir)
+
+
+def load_policies(
+    embed_texts: Callable[[List[str]], np.ndarray],
+    model_name: str,
+    folder_path: str = POLICY_FOLDER,
+    index_dir: str = POLICY_INDEX_DIR,
+) -> Dict:
+    """Nạp index đồng bộ 1 lần, không bật watcher (vd: master nạp trước khi fork worker). Trả về status."""
+    _run_ingestion(embed_texts, model_name, folder_path, index_dir)
+    return get_policy_status()
+
+
+def start_background_ingestion(
+    embed_texts: Callable[[List[str]], np.ndarray],
+    model_name: str,
+    folder_path: str = POLICY_FOLDER,
+    index_dir: str = POLICY_INDEX_DIR,
+    embeddings_ready: Callable[[], bool] = lambda: False,
+) -> threading.Thread:
+    """
+    Chạy ingest_policies trong background thread (chỉ 1 thread cùng lúc),
+    sau đó poll thư mục mỗi POLICY_WATCH_INTERVAL giây để hot reload.
+    embeddings_ready() → True khi embed_texts dùng được (model đã load): index đang chỉ có keyword
+    sẽ được build lại kèm vector ở lần poll kế tiếp.
+    """
+    global _ingest_thread
+    if _ingest_thread is not None and _ingest_thread.is_alive():
+        return _ingest_thread
+    _stop_event.clear()
+    _ingest_thread = threading.Thread(
+        target=_ingest_and_watch,
+        args=(embed_texts, model_name, folder_path, index_dir, POLICY_WATCH_INTERVAL, embeddings_ready),
+        name="policy-ingestion",
+        daemon=True,
+    )
+    _ingest_thread.start()
+    return _ingest_thread
+
+
+def stop_background_ingestion():
+    """Dừng watcher (gọi khi app shutdown)"""
+    _stop_event.set()
+
+
+def get_policy_index() -> PolicyIndex:
+    """Snapshot index hiện tại - giữ tham chiếu này trong suốt 1 lần search"""
+    return _policy_index
+
+
+def get_policy_status() -> Dict:
+    return dict(_status)
@@ -0,0 +1,187 @@
+"""
+Prefork - Chạy nhiều worker uvicorn dùng chung model và embedding đã nạp sẵn ở master process
+
+`uvicorn --workers N` khởi động worker bằng spawn: mỗi worker tự import torch, load SentenceTransformer,
+cross-encoder và nạp lại embedding chính sách/sản phẩm → RAM nhân theo số worker.
+Ở chế độ prefork (AI_SERVICE_WORKERS > 1), master:
+1. Chạy các bước preload: load embedding model + cross-encoder, nạp index chính sách, đồng bộ catalog
+   và tính embedding sản phẩm (bước lỗi thì worker tự làm lại trong warm-up như khi chạy 1 process)
+2. Bind socket, dừng thread ghi log (thread không sống qua fork), gc.freeze() để GC của worker không
+   ghi vào header các object nạp sẵn (mỗi lần ghi = copy cả trang nhớ)
+3. fork() AI_SERVICE_WORKERS worker, mỗi worker chạy uvicorn trên socket chung (kernel chia kết nối)
+
+Trọng số model (tensor) và ma trận embedding chỉ được đọc nên các trang nhớ này dùng chung copy-on-write
+giữa mọi worker; phần riêng của mỗi worker chỉ còn event loop, cache theo request, activation khi encode.
+Warm-up trong lifespan của worker vẫn chạy nhưng thấy dữ liệu đã có sẵn nên xong ngay.
+Master giám sát worker: worker chết thì fork worker mới (vẫn dùng chung dữ liệu), SIGTERM/SIGINT → dừng tất cả.
+Chỉ hỗ trợ hệ điều hành có fork() (Linux/macOS).
+"""
+
+import gc
+import os
+import signal
+import socket
+import time
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+from app_logging import get_logger, setup_logging, stop_logging
+
+logger = get_logger(__name__)
+
+AI_SERVICE_WORKERS = int(os.getenv("AI_SERVICE_WORKERS", "1"))
+PREFORK_PRELOAD = os.getenv("PREFORK_PRELOAD", "1") == "1"  # 0: fork nhưng mỗi worker tự nạp (để so sánh)
+PREFORK_RESTART_DELAY = 1.0  # giây, tránh fork liên tục nếu worker lỗi ngay khi khởi động
+
+PreloadStep = Tuple[str, Callable[[], None]]
+
+_worker_index: Optional[int] = None  # None = master hoặc chạy 1 process
+_workers: Optional[int] = None  # số worker serve() thực sự fork (None = chưa chạy prefork)
+_preloaded: Dict[str, str] = {}  # {bước: "done" | "failed: ..."}
+
+
+def process_memory(pid: str = "self") -> Dict[str, float]:
+    """
+    RSS/PSS/private (MB) của 1 process từ /proc/<pid>/smaps_rollup (Linux).
+    RSS tính cả trang dùng chung nên cộng RSS các worker sẽ bị trùng; PSS chia đều trang dùng chung
+    cho các process cùng map, private là phần riêng của process (thêm 1 worker tốn thêm chừng đó RAM).
+    """
+    fields = {}
+    try:
+        with open(f"/proc/{pid}/smaps_rollup", "r") as f:
+            for line in f:
+                parts = line.split()
+                if len(parts) == 3 and parts[2] == "kB":
+                    fields[parts[0].rstrip(":")] = int(parts[1])
+    except OSError:
+        return {}
+    return {
+        "rss_mb": round(fields.get("Rss", 0) / 1024, 1),
+        "pss_mb": round(fields.get("Pss", 0) / 1024, 1),
+        "private_mb": round((fields.get("Private_Clean", 0) + fields.get("Private_Dirty", 0)) / 1024, 1),
+    }
+
+
+def preload(steps: Sequence[PreloadStep]) -> Dict[str, str]:
+    """Chạy các bước preload ở master (tuần tự, bước lỗi không chặn các bước sau)"""
+    for name, run in steps:
+        started = time.perf_counter()
+        try:
+            run()
+            _preloaded[name] = "done"
+            logger.info("[PREFORK] Preloaded %s in %.1fs", name, time.perf_counter() - started)
+        except Exception as e:
+            _preloaded[name] = f"failed: {e}"
+            logger.warning("[PREFORK] Preload %s failed (workers will retry in warm-up): %s", name, e)
+    return dict(_preloaded)
+
+
+def _bind(host: str, port: int) -> socket.socket:
+    sock = socket.socket(socket.AF_INET6 if ":" in host else socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(2048)
+    sock.set_inheritable(True)
+    return sock
+
+
+def _run_worker(app, sock: socket.socket, index: int, log_level: str) -> int:
+    """Chạy trong process con sau fork: uvicorn trên socket chung của master"""
+    import uvicorn
+
+    global _worker_index
+    _worker_index = index
+    gc.enable()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        signal.signal(sig, signal.SIG_DFL)  # uvicorn tự cài handler để shutdown êm
+    setup_logging()
+    server = uvicorn.Server(uvicorn.Config(app, log_level=log_level))
+    server.run(sockets=[sock])
+    stop_logging()
+    return 0
+
+
+def serve(app, host: str, port: int, workers: int = AI_SERVICE_WORKERS,
+          preload_steps: Sequence[PreloadStep] = (), log_level: str = "info"):
+    """Master process: preload → bind → fork workers → giám sát tới khi nhận SIGTERM/SIGINT"""
+    global _workers
+    _workers = workers
+    # Tắt GC trong lúc nạp để không để lại "lỗ" trên các trang nhớ sẽ được chia sẻ
+    gc.disable()
+    if PREFORK_PRELOAD:
+        preload(preload_steps)
+    sock = _bind(host, port)
+    children: Dict[int, int] = {}  # {pid: worker index}
+    stopping = False
+
+    def spawn(index: int):
+        stop_logging()
+        gc.collect()
+        gc.freeze()
+        pid = os.fork()
+        if pid == 0:
+            code = 1
+            try:
+                code = _run_worker(app, sock, index, log_level)
+            finally:
+                os._exit(code)  # không chạy atexit/finally của master trong process con
+        children[pid] = index
+        setup_logging()
+
+    for i in range(workers):
+        spawn(i)
+    gc.enable()
+    logger.warning("[PREFORK] Master %s serving on %s:%s with %s workers (preload=%s)",
+                   os.getpid(), host, port, workers, PREFORK_PRELOAD)
+
+    def shutdown(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for pid in list(children):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGTERM, shutdown)
+    signal.signal(signal.SIGINT, shutdown)
+
+    while children:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        index = children.pop(pid, None)
+        if index is None or stopping:
+            continue
+        logger.warning("[PREFORK] Worker %s (pid %s) exited with status %s, restarting", index, pid, status)
+        time.sleep(PREFORK_RESTART_DELAY)
+        if not stopping:
+            spawn(index)
+    sock.close()
+    logger.warning("[PREFORK] Master %s stopped", os.getpid())
+    stop_logging()
+
+
+def get_worker_count() -> int:
+    """Số worker cùng phục vụ (chia quota dùng chung giữa các worker): theo serve() nếu đang prefork"""
+    return _workers if _workers is not None else max(1, AI_SERVICE_WORKERS)
+
+
+def get_prefork_status() -> Dict:
+    return {
+        "mode": "prefork" if _worker_index is not None else "single",
+        "workers": get_worker_count(),
+        "worker": _worker_index,
+        "pid": os.getpid(),
+        "preloaded": dict(_preloaded),
+        "memory": process_memory(),
+    }
+
+
+def list_worker_pids(master_pid: int) -> List[int]:
+    """pid các worker của master (đọc /proc/<pid>/task/<pid>/children, Linux)"""
+    try:
+        with open(f"/proc/{master_pid}/task/{master_pid}/children", "r") as f:
+            return [int(pid) for pid in f.read().split()]
+    except OSError:
+        return []
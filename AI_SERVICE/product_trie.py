@@ -0,0 +1,75 @@
+"""
+Product Trie - Trie theo token (đã bỏ dấu) xây từ tên sản phẩm trong catalog
+
+Câu hỏi nhắc đúng tên model ("galaxy s24 ultra", "iphone 15 pro max") được tra thẳng ra product id
+trong vài micro giây, bỏ qua gọi backend + vector search.
+- Mỗi tên được chèn từ token đầu và từ token thứ 2 (bỏ brand: "Samsung Galaxy S24" ↔ "galaxy s24")
+- Khớp hoàn toàn 1 tên → exact; khớp đầu tên ("iphone 15 pro" ⊂ "iPhone 15 Pro 256GB") → prefix
+- Cụm khớp phải có token chứa số (số model) để "pro max" hay "samsung" không bị coi là tên model
+"""
+
+from typing import Dict, List, NamedTuple, Optional, Set
+
+from text_utils import folded_tokens
+
+MIN_MATCH_TOKENS = 2
+
+
+class _Node:
+    __slots__ = ("children", "ids", "subtree_ids")
+
+    def __init__(self):
+        self.children: Dict[str, "_Node"] = {}
+        self.ids: Set[str] = set()          # sản phẩm có tên kết thúc tại node này
+        self.subtree_ids: Set[str] = set()  # mọi sản phẩm có tên đi qua node này
+
+
+class TrieMatch(NamedTuple):
+    product_ids: List[str]
+    matched: str
+    exact: bool
+
+
+class ProductTrie:
+    def __init__(self):
+        self._root = _Node()
+        self.size = 0
+
+    def add(self, name: str, product_id: str):
+        tokens = folded_tokens(name)
+        for start in range(min(2, len(tokens))):
+            node = self._root
+            for tok in tokens[start:]:
+                node = node.children.setdefault(tok, _Node())
+                node.subtree_ids.add(product_id)
+            node.ids.add(product_id)
+        self.size += 1
+
+    def match(self, text: str, max_prefix_ids: int = 10) -> Optional[TrieMatch]:
+        """
+        Cụm token dài nhất trong text khớp với (đầu) tên sản phẩm.
+        Prefix khớp quá nhiều sản phẩm (> max_prefix_ids) bị bỏ qua vì không còn là 1 model cụ thể.
+        """
+        tokens = folded_tokens(text)
+        best: Optional[TrieMatch] = None
+        best_len = 0
+        for start in range(len(tokens)):
+            node = self._root
+            has_digit = False
+            for end in range(start, len(tokens)):
+                node = node.children.get(tokens[end])
+                if node is None:
+                    break
+                has_digit = has_digit or any(ch.isdigit() for ch in tokens[end])
+                length = end - start + 1
+                if length < MIN_MATCH_TOKENS or not has_digit or length <= best_len:
+                    continue
+                if node.ids:
+                    ids, exact = node.ids, True
+                elif len(node.subtree_ids) <= max_prefix_ids:
+                    ids, exact = node.subtree_ids, False
+                else:
+                    continue
+                best = TrieMatch(sorted(ids), " ".join(tokens[start:end + 1]), exact)
+                best_len = length
+        return best
@@ -2,8 +2,6 @@
 import os
 import httpx
 from typing import List, Dict, Optional
-import google.generativeai as genai
-import PIL.Image
 import io
 import base64
 """
@@ -25,7 +23,7 @@ CHIẾN LƯỢC RAG:
    b) Vector Similarity Search: Cosine similarity giữa query và products
       - Top-K retrieval (lấy top 10-20 sản phẩm liên quan nhất)
    
-   c) Optional LLM Reranking: Có thể dùng thêm để fine-tune ranking
+   c) Reranking: Cross-encoder đa ngôn ngữ chạy local chấm lại top-k ứng viên
    
    d) Multi-source Retrieval: Products + Reviews + FAQs
 
@@ -52,31 +50,33 @@ if sys.platform == 'win32':
         sys.stderr = io.TextIOWrapper(sys.stderr.buffer, encoding='utf-8', errors='replace')
 
 import os
+import logging
 import httpx
 from typing import List, Dict, Optional, Tuple
-import google.generativeai as genai
 import numpy as np
-from sentence_transformers import SentenceTransformer
 import re
-import PyPDF2 # Thư viện mới để đọc PDF
+import time
+import asyncio
+from collections import OrderedDict
+import policy_store
+from llm_client import get_generative_model
+from admission import Overloaded, get_llm_admission
+from singleflight import SingleFlight
+from reranker import RERANKER_ENABLED, rerank
+from embedding_batcher import EMBED_BATCH_MAX, EmbeddingBatcher
+import catalog
+from fuzzy_index import correct_query
+from metrics import record_cache, record_fallback, span
+from text_utils import estimate_tokens, fold_text
+from app_logging import get_logger
 GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
 GEMINI_MODEL = os.getenv("GEMINI_MODEL", "gemini-flash-latest")
 BACKEND_URL = os.getenv("BACKEND_URL", "http://localhost:8000")
 
-genai.configure(api_key=GEMINI_API_KEY)
+logger = get_logger(__name__)
 
 
 
-# Helper function for safe printing Vietnamese text
-def safe_print(*args, **kwargs):
-    """Print with UTF-8 encoding, handles Vietnamese characters safely"""
-    try:
-        print(*args, **kwargs)
-    except UnicodeEncodeError:
-        # Fallback: encode to ASCII with replacement
-        safe_args = [str(arg).encode('ascii', 'replace').decode('ascii') if isinstance(arg, str) else arg for arg in args]
-        print(*safe_args, **kwargs)
-
 # Vector Search Setup
 # Dùng model hỗ trợ tiếng Việt tốt
 # Fallback: paraphrase-multilingual-MiniLM-L12-v2 (hỗ trợ 50+ ngôn ngữ bao gồm tiếng Việt)
@@ -84,8 +84,6 @@ EMBEDDING_MODEL_NAME = "paraphrase-multilingual-MiniLM-L12-v2"
 _embedding_model = None
 _product_embeddings_cache = {}  # {product_id: embedding_vector}
 _product_metadata_cache = {}  # {product_id: product_dict}
-_policy_database = []         # Lưu các đoạn văn bản từ PDF
-_policy_embeddings_cache = [] # Lưu vector tương ứng của các đoạn đó
 _model_loading_started = False
 _model_loading_error = None
 
@@ -94,23 +92,25 @@ def get_embedding_model():
     global _embedding_model, _model_loading_started, _model_loading_error
     if _embedding_model is None and not _model_loading_started:
         _model_loading_started = True
-        print("[RAG] Loading embedding model (this may take 1-2 minutes on first run)...")
-        print("[RAG] If download fails, system will fallback to keyword search")
+        logger.info("[RAG] Loading embedding model (this may take 1-2 minutes on first run)...")
+        logger.info("[RAG] If download fails, system will fallback to keyword search")
         try:
             # Set environment variable để tăng timeout cho HuggingFace
             import os
             os.environ['HF_HUB_DOWNLOAD_TIMEOUT'] = '300'  # 5 phút
-            
+            # Import ở đây (không ở đầu module): sentence_transformers kéo theo torch/transformers, mất vài giây
+            from sentence_transformers import SentenceTransformer
+
             _embedding_model = SentenceTransformer(
                 EMBEDDING_MODEL_NAME,
                 device='cpu'  # Dùng CPU để tránh lỗi GPU
             )
-            print(f"[RAG] ✅ Loaded embedding model: {EMBEDDING_MODEL_NAME}")
+            logger.info("[RAG] Loaded embedding model: %s", EMBEDDING_MODEL_NAME)
             _model_loading_error = None
         except Exception as e:
             _model_loading_error = str(e)
-            print(f"[RAG] ❌ Failed to load embedding model: {e}")
-            print(f"[RAG] System will use keyword search as fallback")
+            logger.warning("[RAG] Failed to load embedding model: %s", e)
+            logger.info("[RAG] System will use keyword search as fallback")
             # Không raise error, để hệ thống fallback về keyword search
             _model_loading_started = False  # Cho phép retry sau
     elif _embedding_model is None and _model_loading_started and _model_loading_error is None:
@@ -147,8 +147,42 @@ def generate_embedding(text: str) -> np.ndarray:
     embedding = model.encode(text, normalize_embeddings=True)
     return embedding
 
-def generate_product_embedding(product: Dict) -> np.ndarray:
-    """Tạo embedding cho một sản phẩm từ các thông tin: name, category, description"""
+def generate_embeddings(texts: List[str], batch_size: int = 32) -> np.ndarray:
+    """Tạo embedding cho nhiều đoạn text trong 1 lần encode (nhanh hơn gọi từng đoạn)"""
+    model = get_embedding_model()
+    if model is None:
+        raise RuntimeError("Embedding model chưa sẵn sàng")
+    return model.encode(list(texts), normalize_embeddings=True, batch_size=batch_size)
+
+def warm_up_embedding_model():
+    """Load embedding model và chạy 1 lần encode mẫu (lần forward đầu tiên chậm hơn hẳn các lần sau)"""
+    generate_embeddings(["điện thoại samsung dưới 10 triệu", "warranty policy"])
+
+# Embedding câu hỏi của các request đồng thời được gom thành 1 lần encode
+_query_batcher = EmbeddingBatcher(lambda texts: generate_embeddings(texts, batch_size=EMBED_BATCH_MAX))
+
+async def generate_query_embedding(text: str) -> np.ndarray:
+    """Embedding câu hỏi qua micro-batching (load model nếu chưa load)"""
+    with span("embedding"):
+        if _embedding_model is None:
+            await asyncio.to_thread(get_embedding_model)
+        return await _query_batcher.embed(text)
+
+async def generate_query_embedding_if_ready(text: str) -> Optional[np.ndarray]:
+    """Embedding câu hỏi nếu model đã load xong, None nếu chưa (không chờ model load)"""
+    if _embedding_model is None:
+        return None
+    try:
+        return await _query_batcher.embed(text)
+    except Exception as e:
+        logger.warning("[RAG] Error generating embedding: %s", e)
+        return None
+
+def get_embedding_batcher_status() -> Dict:
+    return _query_batcher.stats()
+
+def product_text(product: Dict) -> str:
+    """Text đại diện cho sản phẩm (name, category, description) dùng cho embedding và rerank"""
     text_parts = []
     
     # Tên sản phẩm (quan trọng nhất)
@@ -170,8 +204,11 @@ def generate_product_embedding(product: Dict) -> np.ndarray:
     # Brand (nếu có trong name)
     # Các tính năng đặc trưng có thể extract từ description
     
-    combined_text = " ".join(text_parts)
-    return generate_embedding(combined_text)
+    return " ".join(text_parts)
+
+def generate_product_embedding(product: Dict) -> np.ndarray:
+    """Tạo embedding cho một sản phẩm từ các thông tin: name, category, description"""
+    return generate_embedding(product_text(product))
 
 def cosine_similarity(vec1: np.ndarray, vec2: np.ndarray) -> float:
     """Tính cosine similarity giữa 2 vectors"""
@@ -193,8 +230,8 @@ async def vector_search_products(
     
     try:
         # 1. Tạo embedding cho query
-        query_embedding = generate_embedding(query)
-        print(f"🔢 [Vector Search] Generated query embedding (dim={len(query_embedding)})")
+        query_embedding = await generate_query_embedding(query)
+        logger.debug("[Vector Search] Generated query embedding (dim=%s)", len(query_embedding))
         
         # 2. Tạo/cache embeddings cho products
         product_scores = []
@@ -221,15 +258,16 @@ async def vector_search_products(
         # Log similarity scores để debug
         if top_results:
             top_similarity = top_results[0][1]
-            print(f"🎯 [Vector Search] Found {len(top_results)} products")
-            print(f"   Top similarity scores: {[f'{score:.3f}' for _, score in top_results[:5]]}")
+            logger.debug("[Vector Search] Found %s products", len(top_results))
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug("[Vector Search] Top similarity scores: %s", [f'{score:.3f}' for _, score in top_results[:5]])
         else:
-            print(f"🎯 [Vector Search] No products found")
+            logger.debug("[Vector Search] No products found")
         
         return top_results
     
     except Exception as e:
-        print(f"[RAG] Vector search failed: {e}")
+        logger.warning("[RAG] Vector search failed: %s", e)
         # Fallback: trả về products gốc
         return [(p, 0.0) for p in products[:top_k]]
 
@@ -256,7 +294,9 @@ def should_search_products(message: str) -> bool:
         "mô tả", "tóm tắt", "review", "đáng mua", "chi tiết", "thông số",
     ]
     
-    return any(keyword in lower_message for keyword in keywords)
+    # So khớp sau khi bỏ dấu cả 2 phía: câu gõ không dấu ("tim dien thoai gia re") vẫn nhận ra
+    folded = fold_text(lower_message)
+    return any(fold_text(keyword) in folded for keyword in keywords)
 
 def extract_search_term(message: str) -> str:
     """
@@ -264,7 +304,7 @@ def extract_search_term(message: str) -> str:
     Ưu tiên: Brand > Tính năng đặc trưng > Từ khóa chung
     """
     lower_message = message.lower().strip()
-    brand_keywords = ["iphone", "samsung", "xiaomi", "oppo", "vivo", "realme", "oneplus", "nokia", "huawei", "galaxy", "pixel", "google"]
+    brand_keywords = catalog.known_brands()
     
     # Ưu tiên 1: Tìm brand
     for brand in brand_keywords:
@@ -301,6 +341,18 @@ def extract_search_term(message: str) -> str:
     
     return ""
 
+def correct_query_typos(message: str, backend_url: str, lang: str = "vi") -> str:
+    """
+    Sửa lỗi gõ tên brand/model ("samsumg", "iphon") theo từ vựng của catalog.
+    Chỉ dùng cho tìm kiếm/so khớp, không thay tin nhắn gửi Gemini. Câu tiếng Anh giữ nguyên.
+    """
+    if lang == "en":
+        return message
+    corrected = correct_query(message, catalog.get_fuzzy_index(backend_url))
+    if corrected != message:
+        logger.debug('[RAG] Query corrected: "%s" → "%s"', message, corrected)
+    return corrected
+
 def extract_price_intent(message: str) -> Tuple[str, int]:
     """
     Trích xuất điều kiện giá và giá mục tiêu (VNĐ) từ câu hỏi.
@@ -357,7 +409,66 @@ def extract_price_intent(message: str) -> Tuple[str, int]:
 
     return condition, value
 
-def prefilter_products_by_price(products: List[Dict], price_condition: str, price_value: int) -> List[Dict]:
+# --- Câu hỏi nối tiếp tham chiếu tới sản phẩm vừa hiển thị ---
+# So khớp trên text đã bỏ dấu: "cái thứ hai" / "cai thu hai" / "the second one"
+_ORDINAL_PATTERNS = [
+    (re.compile(r"\b(?:thu|so)\s*(?:1|nhat)\b|\bdau tien\b|\bfirst\b"), 0),
+    (re.compile(r"\b(?:thu|so)\s*(?:2|hai)\b|\bsecond\b"), 1),
+    (re.compile(r"\b(?:thu|so)\s*(?:3|ba)\b|\bthird\b"), 2),
+    (re.compile(r"\b(?:thu|so)\s*(?:4|tu)\b|\bfourth\b"), 3),
+    (re.compile(r"\b(?:thu|so)\s*(?:5|nam)\b|\bfifth\b"), 4),
+    (re.compile(r"\b(?:cai|may|con|mau|chiec|san pham)\s+cuoi\b|\blast one\b"), -1),
+]
+_DEMONSTRATIVE_RE = re.compile(r"\b(?:cai|may|con|mau|chiec|san pham|dien thoai)\s+(?:nay|do|kia|ay)\b|\b(?:this|that) (?:one|phone)\b")
+_PRONOUN_RE = re.compile(r"(?:^|\s)nó(?:\s|$|[?,.!])")
+
+def detect_product_reference(message: str) -> Optional[int]:
+    """
+    Nhận diện câu hỏi nối tiếp nhắc tới sản phẩm đã hiển thị.
+    Trả về vị trí sản phẩm (0-based, -1 = cuối cùng) hoặc None nếu là câu hỏi mới
+    (có brand hoặc mức giá mới → cần tìm kiếm lại).
+    """
+    lower_message = (message or "").lower()
+    folded = fold_text(lower_message)
+    if any(brand in folded for brand in catalog.known_brands()) or extract_price_intent(message)[1]:
+        return None
+    for pattern, position in _ORDINAL_PATTERNS:
+        if pattern.search(folded):
+            return position
+    if _DEMONSTRATIVE_RE.search(folded) or _PRONOUN_RE.search(lower_message):
+        return 0
+    return None
+
+_VARIANT_WORDS = {"pro", "max", "plus", "ultra", "mini", "lite", "fe", "se", "note", "fold", "flip"}
+
+def extract_query_intent(message: str) -> Tuple:
+    """
+    Intent dạng hashable để so khớp 2 câu hỏi: (brand, điều kiện giá, giá, các con số, biến thể).
+    Hai câu diễn đạt khác nhau ("tầm 15 triệu" / "khoảng 15tr") cho cùng intent.
+    """
+    folded = fold_text(message)
+    tokens = set(re.findall(r"[a-z]+|\d+", folded))
+    brands = tuple(sorted(brand for brand in catalog.known_brands() if brand in folded))
+    condition, value = extract_price_intent(message)
+    numbers = tuple(sorted(tok for tok in tokens if tok.isdigit()))
+    variants = tuple(sorted(tokens & _VARIANT_WORDS))
+    return brands, condition, value, numbers, variants
+
+def resolve_followup_products(message: str, last_products: List[Dict]) -> Optional[List[Dict]]:
+    """Sản phẩm mà câu hỏi nối tiếp nhắc tới (lấy từ session), None nếu không phải follow-up"""
+    if not last_products:
+        return None
+    position = detect_product_reference(message)
+    if position is None or position >= len(last_products):
+        return None
+    return [last_products[position]]
+
+def prefilter_products_by_price(
+    products: List[Dict],
+    price_condition: str,
+    price_value: int,
+    price_index: Optional[catalog.PriceIndex] = None
+) -> List[Dict]:
     """
     Lọc sản phẩm theo tầm giá trước khi vector search để tránh lệch giá.
     Quy ước:
@@ -365,15 +476,12 @@ def prefilter_products_by_price(products: List[Dict], price_condition: str, pric
     - duoi: [70%..100%] * target
     - tren/tu: [100%..130%] * target
     Nếu lọc ra rỗng -> trả list gốc (không làm mất dữ liệu).
+    price_index: index giá đã tính sẵn của catalog (nếu không có sẽ tạo từ products)
     """
     if not products or not price_value:
         return products
-
-    def get_price(p: Dict) -> int:
-        try:
-            return int(p.get("salePrice") or p.get("price") or p.get("minPrice") or 0)
-        except Exception:
-            return 0
+    if price_index is None:
+        price_index = catalog.PriceIndex(products)
 
     if price_condition == "duoi":
         min_p = int(price_value * 0.7)
@@ -385,12 +493,12 @@ def prefilter_products_by_price(products: List[Dict], price_condition: str, pric
         min_p = int(price_value * 0.7)
         max_p = int(price_value * 1.3)
 
-    filtered = [p for p in products if (min_p <= get_price(p) <= max_p)]
+    filtered = price_index.between(min_p, max_p)
     if filtered:
-        safe_print(f"🎯 [RAG] Price prefilter kept {len(filtered)}/{len(products)} products in [{min_p:,}..{max_p:,}]")
+        logger.debug("[RAG] Price prefilter kept %s/%s products in [%s..%s]", len(filtered), len(products), min_p, max_p)
         return filtered
 
-    safe_print(f"🎯 [RAG] Price prefilter removed all products for [{min_p:,}..{max_p:,}], keeping original list")
+    logger.debug("[RAG] Price prefilter removed all products for [%s..%s], keeping original list", min_p, max_p)
     return products
 
 async def extract_search_term_with_llm(message: str) -> str:
@@ -401,13 +509,7 @@ async def extract_search_term_with_llm(message: str) -> str:
     Trade-off: Tốn 1 API call nhưng tăng độ chính xác đáng kể.
     """
     try:
-        model_name = GEMINI_MODEL
-        if not model_name.startswith("models/"):
-            model_name = f"models/{model_name}"
-        try:
-            model = genai.GenerativeModel(model_name=model_name)
-        except TypeError:
-            model = genai.GenerativeModel(GEMINI_MODEL)
+        model = get_generative_model(GEMINI_MODEL)
         
         prompt = f"""Bạn là hệ thống trích xuất từ khóa tìm kiếm. Từ câu hỏi của khách hàng, hãy trích xuất 1-3 từ khóa quan trọng nhất để tìm sản phẩm điện thoại.
 
@@ -427,14 +529,15 @@ Ví dụ:
 
 Từ khóa:"""
         
-        response = model.generate_content(prompt)
+        # Lời gọi blocking → chạy trong thread qua admission; quá tải (Overloaded) thì dùng rule-based
+        response = await get_llm_admission().run(lambda: model.generate_content(prompt))
         search_term = response.text.strip().lower()
         
         # Làm sạch kết quả (bỏ dấu câu, giữ lại từ khóa)
         search_term = " ".join([w for w in search_term.split() if len(w) > 1])
         return search_term[:50]  # Giới hạn độ dài
     except Exception as e:
-        print(f"[RAG] LLM search term extraction failed: {e}, falling back to rule-based")
+        logger.warning("[RAG] LLM search term extraction failed: %s, falling back to rule-based", e)
         return extract_search_term(message)
 
 def extract_keywords(query: str) -> List[str]:
@@ -442,6 +545,148 @@ def extract_keywords(query: str) -> List[str]:
     return [w for w in query.lower().split() if len(w) > 2 and w not in stop_words][:5]
 
 
+# --- Circuit breaker + last-known-good snapshot cho backend ---
+# Khi backend chậm/chết, breaker mở sau vài lần lỗi liên tiếp và các request sau
+# trả về snapshot gần nhất ngay lập tức thay vì chờ timeout 10s mỗi lần.
+# Sau BACKEND_BREAKER_RESET giây, breaker cho 1 request "thăm dò" đi qua (half-open),
+# các request khác vẫn nhận snapshot cũ (stale-while-revalidate).
+BACKEND_TIMEOUT = float(os.getenv("BACKEND_TIMEOUT", "10"))
+BACKEND_BREAKER_FAILURES = int(os.getenv("BACKEND_BREAKER_FAILURES", "3"))
+BACKEND_BREAKER_RESET = float(os.getenv("BACKEND_BREAKER_RESET", "30"))
+BACKEND_SNAPSHOT_MAX = 256  # Số snapshot tối đa giữ trong memory
+
+class BackendCircuitBreaker:
+    """Circuit breaker cho một backend URL: closed → open → half_open → closed"""
+
+    def __init__(self, failure_threshold: int = BACKEND_BREAKER_FAILURES, reset_timeout: float = BACKEND_BREAKER_RESET):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = "closed"
+        self.failures = 0
+        self.opened_at = 0.0
+        self._probe_in_flight = False
+
+    def allow_request(self) -> bool:
+        """True nếu được phép gọi backend thật"""
+        if self.state == "closed":
+            return True
+        if self.state == "open" and time.monotonic() - self.opened_at >= self.reset_timeout:
+            self.state = "half_open"
+        if self.state == "half_open" and not self._probe_in_flight:
+            self._probe_in_flight = True
+            return True
+        return False
+
+    def record_success(self):
+        self.state = "closed"
+        self.failures = 0
+        self._probe_in_flight = False
+
+    def record_failure(self):
+        self._probe_in_flight = False
+        self.failures += 1
+        if self.state == "half_open" or self.failures >= self.failure_threshold:
+            if self.state != "open":
+                logger.warning("[RAG] Circuit breaker OPEN (failures=%s)", self.failures)
+            self.state = "open"
+            self.opened_at = time.monotonic()
+
+_backend_breakers: Dict[str, BackendCircuitBreaker] = {}  # {backend_url: breaker}
+_backend_snapshots: "OrderedDict[Tuple, Tuple[float, object]]" = OrderedDict()  # {(url, path, params): (ts, data)}
+_backend_flight = SingleFlight("backend")  # gộp các GET trùng (url, path, params) đang chạy
+
+def get_backend_breaker(backend_url: str) -> BackendCircuitBreaker:
+    breaker = _backend_breakers.get(backend_url)
+    if breaker is None:
+        breaker = BackendCircuitBreaker()
+        _backend_breakers[backend_url] = breaker
+    return breaker
+
+def get_backend_breaker_status() -> Dict:
+    """Trạng thái breaker theo từng backend URL (dùng cho /health)"""
+    return {
+        url: {"state": b.state, "failures": b.failures}
+        for url, b in _backend_breakers.items()
+    }
+
+def get_backend_flight_status() -> Dict:
+    return _backend_flight.stats()
+
+def _snapshot_key(backend_url: str, path: str, params: Dict) -> Tuple:
+    return (backend_url, path, tuple(sorted(params.items())))
+
+def _save_snapshot(key: Tuple, data):
+    _backend_snapshots[key] = (time.time(), data)
+    _backend_snapshots.move_to_end(key)
+    while len(_backend_snapshots) > BACKEND_SNAPSHOT_MAX:
+        _backend_snapshots.popitem(last=False)
+
+def _load_snapshot(key: Tuple):
+    entry = _backend_snapshots.get(key)
+    if entry is None:
+        return None
+    saved_at, data = entry
+    logger.info("[RAG] Serving stale snapshot for %s (age=%.0fs)", key[1], time.time() - saved_at)
+    return data
+
+async def _fetch_backend_json(backend_url: str, path: str, params: Dict):
+    """
+    GET backend qua circuit breaker.
+    Trả về JSON mới nếu gọi thành công, snapshot gần nhất nếu breaker mở/gọi lỗi,
+    hoặc None nếu không có gì để trả. Các request trùng đang chạy đồng thời dùng chung 1 lần gọi.
+    """
+    key = _snapshot_key(backend_url, path, params)
+    return await _backend_flight.do(key, lambda: _fetch_backend_json_once(key, backend_url, path, params))
+
+async def _fetch_backend_json_once(key: Tuple, backend_url: str, path: str, params: Dict):
+    breaker = get_backend_breaker(backend_url)
+    if not breaker.allow_request():
+        record_fallback("backend_breaker_open")
+        return _load_snapshot(key)
+
+    try:
+        async with httpx.AsyncClient(timeout=BACKEND_TIMEOUT) as client:
+            response = await client.get(f"{backend_url}{path}", params=params)
+    except Exception as e:
+        logger.warning("[RAG] Backend request failed (%s): %s", path, e)
+        breaker.record_failure()
+        record_fallback("backend_snapshot")
+        return _load_snapshot(key)
+
+    if response.status_code >= 500:
+        logger.warning("[RAG] Backend error: %s", response.status_code)
+        breaker.record_failure()
+        record_fallback("backend_snapshot")
+        return _load_snapshot(key)
+
+    # 4xx không phải lỗi của backend → không tính vào breaker
+    breaker.record_success()
+    if response.status_code != 200:
+        logger.warning("[RAG] Backend error: %s", response.status_code)
+        return None
+
+    data = response.json()
+    _save_snapshot(key, data)
+    return data
+
+def _filter_products_by_term(products: List[Dict], search_term: str) -> List[Dict]:
+    """Lọc snapshot toàn catalog theo từ khóa (dùng khi backend không phản hồi)"""
+    term = search_term.lower()
+    return [
+        p for p in products
+        if term in (p.get("name") or "").lower() or term in str(p.get("category") or "").lower()
+    ]
+
+def _extract_products(data) -> List[Dict]:
+    # Hỗ trợ cả hai format: {data: {products: [...]}} và {products: [...]}
+    products = (
+        data.get("data", {}).get("products")
+        if isinstance(data, dict) else None
+    )
+    if not products and isinstance(data, dict):
+        products = data.get("products")
+    return products or []
+
 async def get_products_from_backend(backend_url: str, search_term: str = "", limit: int = 50) -> List[Dict]:
     """
     Lấy products từ backend.
@@ -450,72 +695,87 @@ async def get_products_from_backend(backend_url: str, search_term: str = "", lim
         search_term: Từ khóa tìm kiếm (optional, có thể dùng cho keyword fallback)
         limit: Giới hạn số lượng products (để vector search không quá chậm)
     """
-    print(f"[RAG] get_products_from_backend called with search_term='{search_term}', limit={limit}")
+    logger.debug("[RAG] get_products_from_backend called with search_term='%s', limit=%s", search_term, limit)
     try:
-        async with httpx.AsyncClient(timeout=10.0) as client:
-            # Nếu có search_term, dùng keyword search (fallback)
-            # Nếu không, lấy tất cả products để vector search
-            params = {}
-            if search_term:
-                params["search"] = search_term
-            if limit:
-                params["limit"] = limit
-            
-            response = await client.get(
-                f"{backend_url}/api/v1/internal/products/search",
-                params=params if params else {}
-            )
-            if response.status_code == 200:
-                data = response.json()
-                print(f"[RAG] Backend response status: {response.status_code}")
-                # Hỗ trợ cả hai format: {data: {products: [...]}} và {products: [...]}
-                products = (
-                    data.get("data", {}).get("products")
-                    if isinstance(data, dict) else None
-                )
-                if not products and isinstance(data, dict):
-                    products = data.get("products")
-
-                return products or []
-
-                print(f"[RAG] Retrieved {len(products or [])} products from backend")
-                if products and len(products) > 0:
-                    print(f"[RAG] First product: {products[0].get('name', 'Unknown')}")
-                return products or []
-            print(f"[RAG] Backend error: {response.status_code}")
-            return []
+        # Nếu có search_term, dùng keyword search (fallback)
+        # Nếu không, lấy tất cả products để vector search
+        params = {}
+        if search_term:
+            params["search"] = search_term
+        if limit:
+            params["limit"] = limit
+
+        path = "/api/v1/internal/products/search"
+        with span("backend_products"):
+            data = await _fetch_backend_json(backend_url, path, params)
+        if data is None and search_term:
+            # Không có snapshot cho đúng từ khóa: lọc từ snapshot toàn catalog (nếu có)
+            catalog_snapshot = _load_snapshot(_snapshot_key(backend_url, path, {"limit": limit} if limit else {}))
+            if catalog_snapshot is not None:
+                return _filter_products_by_term(_extract_products(catalog_snapshot), search_term)
+        products = _extract_products(data)
+        # Sản phẩm đi vào catalog → tính sẵn card (chỉ sản phẩm mới/đã thay đổi)
+        catalog.sync_products(products)
+        return products
     except Exception as e:
-        print(f"[RAG] Error fetching products: {e}")
+        logger.warning("[RAG] Error fetching products: %s", e)
         return []
 
+async def sync_catalog(backend_url: str, limit: int = catalog.CATALOG_SYNC_LIMIT) -> Optional[catalog.Catalog]:
+    """Catalog sản phẩm cho vector search: dùng bản đã đồng bộ nếu còn mới, hết hạn thì lấy lại từ backend"""
+    cached = catalog.get_catalog(backend_url)
+    record_cache("catalog", cached is not None)
+    if cached is not None:
+        return cached
+    products = await get_products_from_backend(backend_url, limit=limit)
+    if not products:
+        return None
+    return catalog.set_catalog(backend_url, products)
+
+def cache_product_embeddings(products: List[Dict]) -> int:
+    """Tính embedding cho các sản phẩm chưa có trong cache bằng 1 lần encode theo batch. Trả về số sản phẩm mới."""
+    missing = [p for p in products if str(p.get("productId", id(p))) not in _product_embeddings_cache]
+    if not missing:
+        return 0
+    embeddings = generate_embeddings([product_text(p) for p in missing])
+    for product, embedding in zip(missing, embeddings):
+        product_id = str(product.get("productId", id(product)))
+        _product_embeddings_cache[product_id] = embedding
+        _product_metadata_cache[product_id] = product
+    return len(missing)
+
+async def warm_up_catalog(backend_url: str = BACKEND_URL):
+    """Đồng bộ catalog (card, index giá, trie, fuzzy) và tính sẵn embedding sản phẩm cho vector search"""
+    snapshot = await sync_catalog(backend_url)
+    if snapshot is None:
+        raise RuntimeError(f"No products from {backend_url}")
+    await asyncio.to_thread(cache_product_embeddings, list(snapshot.products))
+
 async def get_reviews_from_backend(backend_url: str, keywords: List[str]) -> List[Dict]:
     if not keywords:
         return []
 
-
-    
     try:
         search_query = " ".join(keywords)
-        async with httpx.AsyncClient(timeout=10.0) as client:
-            response = await client.get(
-                f"{backend_url}/api/v1/internal/reviews/search",
-                params={"search": search_query}
+        with span("backend_reviews"):
+            data = await _fetch_backend_json(
+                backend_url,
+                "/api/v1/internal/reviews/search",
+                {"search": search_query}
             )
-            if response.status_code == 200:
-                data = response.json()
-
-
-                # Hỗ trợ cả hai format: {data: {reviews: [...]}} và {reviews: [...]}
-                reviews = (
-                    data.get("data", {}).get("reviews")
-                    if isinstance(data, dict) else None
-                )
-                if not reviews and isinstance(data, dict):
-                    reviews = data.get("reviews")
-                return reviews[:5]
+        if data is None:
             return []
+
+        # Hỗ trợ cả hai format: {data: {reviews: [...]}} và {reviews: [...]}
+        reviews = (
+            data.get("data", {}).get("reviews")
+            if isinstance(data, dict) else None
+        )
+        if not reviews and isinstance(data, dict):
+            reviews = data.get("reviews")
+        return (reviews or [])[:5]
     except Exception as e:
-        print(f"[RAG] Error fetching reviews: {e}")
+        logger.warning("[RAG] Error fetching reviews: %s", e)
         return []
 
 def get_faqs(query: str) -> List[Dict]:
@@ -530,106 +790,66 @@ def get_faqs(query: str) -> List[Dict]:
     return [faq for faq in faq_database if query_lower in faq["question"].lower() or query_lower in faq["answer"].lower()][:3]
 
 async def semantic_search(query: str, products: List[Dict]) -> List[Dict]:
+    """
+    Xếp hạng lại sản phẩm theo mức độ liên quan với câu hỏi bằng cross-encoder local
+    (trước đây gửi cả danh sách lên Gemini → thêm 1 round-trip LLM mỗi request).
+    """
     try:
-        model_name = GEMINI_MODEL
-        if not model_name.startswith("models/"):
-            model_name = f"models/{model_name}"
-        try:
-            model = genai.GenerativeModel(model_name=model_name)
-        except TypeError:
-            model = genai.GenerativeModel(GEMINI_MODEL)
-        
-        product_list = "\n".join([
-            f"{idx + 1}. {p['name']} - {p.get('category', '')} - {p.get('description', 'Không có mô tả')}"
-            for idx, p in enumerate(products)
-        ])
-        
-        prompt = f"""Bạn là một hệ thống tìm kiếm thông minh. Hãy phân tích câu hỏi của người dùng và xếp hạng các sản phẩm sau theo mức độ liên quan.
-
-Câu hỏi: "{query}"
-
-Danh sách sản phẩm:
-{product_list}
-
-Hãy trả về danh sách số thứ tự (1, 2, 3...) của các sản phẩm được xếp hạng từ cao xuống thấp theo mức độ liên quan, cách nhau bởi dấu phẩy. Chỉ trả về số, không giải thích.
-
-Ví dụ: 3, 1, 5, 2, 4"""
-        
-        response = model.generate_content(prompt)
-        text = response.text.strip()
-        
-        ranked_indices = [
-            int(s.strip()) - 1 
-            for s in text.split(",") 
-            if s.strip().isdigit() and 0 <= int(s.strip()) - 1 < len(products)
-        ]
-        
-        ranked_products = []
-        used_indices = set()
-        
-        for idx in ranked_indices:
-            if idx not in used_indices:
-                ranked_products.append(products[idx])
-                used_indices.add(idx)
-
-        for idx, product in enumerate(products):
-            if idx not in used_indices:
-                ranked_products.append(product)
-        
-        return ranked_products
+        with span("rerank"):
+            return await asyncio.to_thread(rerank, query, products, product_text)
     except Exception as e:
-        print(f"[RAG] Semantic search failed: {e}")
+        logger.warning("[RAG] Semantic search failed: %s", e)
         return products
 
 # --- BẮT ĐẦU PHẦN TÍCH HỢP PDF ---
-def load_policies_from_pdfs(folder_path="./data/policies"):
-    """Quét thư mục và trích xuất text từ file PDF chính sách"""
-    global _policy_database, _policy_embeddings_cache
-    if not os.path.exists(folder_path):
-        os.makedirs(folder_path)
-        return
-    for filename in os.listdir(folder_path):
-        if filename.lower().endswith(".pdf"):
-            try:
-                with open(os.path.join(folder_path, filename), "rb") as f:
-                    pdf = PyPDF2.PdfReader(f)
-                    content = ""
-                    for page in pdf.pages:
-                        content += page.extract_text() + "\n"
-                    if content.strip():
-                        # Chia nhỏ văn bản để tìm kiếm chính xác hơn
-                        chunks = [content[i:i+800] for i in range(0, len(content), 600)]
-                        for chunk in chunks:
-                            _policy_database.append({"source": filename, "content": chunk.strip()})
-                print(f"[PDF] ✅ Đã nạp file: {filename}")
-            except Exception as e:
-                print(f"[PDF] ❌ Lỗi đọc file {filename}: {e}")
-    if _policy_database:
-        print(f"[PDF] ⚙️ Đang tạo vector cho {len(_policy_database)} đoạn chính sách...")
-        _policy_embeddings_cache = [generate_embedding(item["content"]) for item in _policy_database]
-
-def search_policies_vector(query: str, top_k: int = 2):
+def load_policies_from_pdfs(folder_path=policy_store.POLICY_FOLDER):
+    """Quét thư mục PDF chính sách và cập nhật index (chỉ file mới/đã sửa), chạy đồng bộ"""
+    status = policy_store.load_policies(generate_embeddings, EMBEDDING_MODEL_NAME, folder_path)
+    if status["status"] == "error":
+        raise RuntimeError(status["error"])
+
+def start_policy_ingestion(folder_path=policy_store.POLICY_FOLDER):
+    """Nạp PDF chính sách trong background thread, không chặn startup"""
+    return policy_store.start_background_ingestion(
+        generate_embeddings, EMBEDDING_MODEL_NAME, folder_path, embeddings_ready=lambda: _embedding_model is not None
+    )
+
+def stop_policy_ingestion():
+    policy_store.stop_background_ingestion()
+
+def get_policy_status() -> Dict:
+    return policy_store.get_policy_status()
+
+async def warm_up_policies(folder_path=policy_store.POLICY_FOLDER, poll_interval: float = 0.2):
+    """Bắt đầu nạp index chính sách (kèm watcher hot reload) và chờ lần nạp đầu tiên xong"""
+    start_policy_ingestion(folder_path)
+    while policy_store.get_policy_status()["status"] in ("not_started", "loading"):
+        await asyncio.sleep(poll_interval)
+    status = policy_store.get_policy_status()
+    if status["status"] == "error":
+        raise RuntimeError(status["error"])
+
+async def search_policies_vector(query: str, top_k: int = 2):
     """Tìm kiếm ngữ nghĩa trong dữ liệu PDF chính sách"""
-    if not _policy_embeddings_cache: return []
-    query_emb = generate_embedding(query)
-    scores = []
-    for i, p_emb in enumerate(_policy_embeddings_cache):
-        sim = cosine_similarity(query_emb, p_emb)
-        scores.append((i, sim))
-    
-    scores.sort(key=lambda x: x[1], reverse=True)
-    results = [_policy_database[i] for i, sim in scores[:top_k] if sim > 0.2]
+    # Lấy 1 snapshot duy nhất: hot reload có swap index giữa chừng cũng không ảnh hưởng
+    index = policy_store.get_policy_index()
+    if not index.chunks: return []
+    results = []
+    if index.embeddings is not None:
+        try:
+            query_emb = await generate_query_embedding(query)
+            results = [
+                {**index.chunks[i], "score": sim}
+                for i, sim in policy_store.vector_search(index, query_emb, top_k, 0.2)
+            ]
+        except Exception as e:
+            logger.warning("[PDF] Vector search failed: %s", e)
     
     # --- 2. Keyword Fallback (Nếu Vector Search thất bại) ---
     if not results:
-        safe_print(f"⚠️ [PDF] Vector search thấp, thử tìm bằng từ khóa cho: {query}")
-        keywords = [k for k in query.lower().split() if len(k) > 2]
-        for item in _policy_database:
-            content_lower = item["content"].lower()
-            # Nếu đoạn văn bản chứa bất kỳ từ khóa quan trọng nào (vào nước, bảo hành...)
-            if any(k in content_lower for k in keywords):
-                results.append(item)
-                if len(results) >= top_k: break
+        logger.info("[PDF] Vector search thấp, thử tìm bằng từ khóa cho: %s", query)
+        record_fallback("policy_keyword_search")
+        results = [index.chunks[i] for i in policy_store.keyword_search(index, query, top_k)]
                 
     return results
 
@@ -637,7 +857,7 @@ async def retrieve_context(
     user_message: str,
     backend_url: str,
     use_vector_search: bool = True,
-    use_llm_reranking: bool = False
+    use_reranking: bool = RERANKER_ENABLED
 ) -> Dict:
     """
     MAIN ISSUE: Vector search may not work, falling back to keyword search
@@ -650,15 +870,15 @@ async def retrieve_context(
         user_message: Câu hỏi của user
         backend_url: URL của backend API
         use_vector_search: Nếu True, dùng Vector Search (semantic). Nếu False, dùng Keyword Search (fallback)
-        use_llm_reranking: Nếu True, dùng thêm LLM để rerank kết quả vector search (optional)
+        use_reranking: Nếu True, xếp hạng lại kết quả vector search bằng cross-encoder local
     
     Strategy (Vector Search):
         1. Vector Search: Lấy products từ backend → tạo embeddings → similarity search
-        2. Optional LLM Reranking: Fine-tune ranking nếu cần
+        2. Reranking: Cross-encoder chấm lại top-k ứng viên (trong ngân sách thời gian)
         3. Multi-source: Kết hợp products + reviews + FAQs
     """
     try:
-        print(f"🔍 [RAG] Starting retrieval for: {user_message}")
+        logger.debug("[RAG] Starting retrieval for: %s", user_message)
         
         vector_results = []
         final_products = []
@@ -670,31 +890,47 @@ async def retrieve_context(
 
         # 2. Sử dụng đúng hàm check chính sách (bạn đã định nghĩa nhưng chưa dùng)
         if should_search_policies(user_message):
-         relevant_policies = search_policies_vector(user_message)
-        print(f"[PDF] Found {len(relevant_policies)} policy chunks")
+         with span("policy_search"):
+             relevant_policies = await search_policies_vector(user_message)
+        logger.debug("[PDF] Found %s policy chunks", len(relevant_policies))
+
+        # --- BƯỚC 1.5: Câu hỏi nêu đúng tên model có trong catalog → lấy thẳng sản phẩm (trie) ---
+        search_products = should_search_products(user_message)
+        catalog_snapshot = await sync_catalog(backend_url) if search_products else catalog.get_catalog(backend_url)
+        model_match = None
+        if catalog_snapshot is not None:
+            model_match, final_products = catalog_snapshot.match_model(user_message)
+            record_cache("model_trie", bool(final_products))
+            if final_products:
+                search_term_used = model_match.matched
+                logger.debug("[RAG] Model match '%s' (%s): %s products, skipping search", model_match.matched, 'exact' if model_match.exact else 'prefix', len(final_products))
 
         # --- BƯỚC 2: Tìm kiếm Sản phẩm từ Database ---
-        if should_search_products(user_message):
+        if search_products and not final_products:
             if use_vector_search:
                 # ===== VECTOR SEARCH (Semantic Search) =====
-                print("🔢 [RAG] Using Vector Search (Semantic Search)")
+                logger.debug("[RAG] Using Vector Search (Semantic Search)")
                 
                 try:
                     # 1. Lấy products từ backend (không cần search_term)
-                    all_products = await get_products_from_backend(backend_url, limit=50)
-                    print(f"📦 [RAG] Fetched {len(all_products)} products from backend")
+                    catalog_snapshot = await sync_catalog(backend_url)
+                    all_products = list(catalog_snapshot.products) if catalog_snapshot else []
+                    logger.debug("[RAG] Fetched %s products from backend", len(all_products))
                     
                     if all_products:
                         # 1.5. Pre-filter theo giá trước khi vector search để tránh lệch giá
-                        all_products = prefilter_products_by_price(all_products, price_condition, price_value)
+                        all_products = prefilter_products_by_price(
+                            all_products, price_condition, price_value, catalog_snapshot.price_index
+                        )
 
                         # 2. Vector similarity search
                         try:
-                            vector_results = await vector_search_products(
-                                user_message, 
-                                all_products, 
-                                top_k=10
-                            )
+                            with span("vector_search"):
+                                vector_results = await vector_search_products(
+                                    user_message,
+                                    all_products,
+                                    top_k=10
+                                )
                             
                             # Extract products từ results (bỏ similarity scores)
                             # Chỉ lấy sản phẩm có similarity > threshold (0.3) để đảm bảo liên quan
@@ -706,47 +942,47 @@ async def retrieve_context(
                             
                             if not final_products and vector_results:
                                 # Nếu không có sản phẩm nào đạt threshold, lấy top 3 có similarity cao nhất
-                                print(f"⚠️ [RAG] No products above threshold {SIMILARITY_THRESHOLD}, using top 3")
+                                logger.info("[RAG] No products above threshold %s, using top 3", SIMILARITY_THRESHOLD)
                                 final_products = [product for product, score in vector_results[:3]]
                             
-                            print(f"📊 [RAG] Filtered to {len(final_products)} products above threshold")
+                            logger.debug("[RAG] Filtered to %s products above threshold", len(final_products))
                             
-                            # Optional: LLM reranking để fine-tune
-                            if use_llm_reranking and final_products:
-                                print("🧠 [RAG] Applying LLM reranking...")
+                            # Rerank bằng cross-encoder local để fine-tune
+                            if use_reranking and final_products:
                                 final_products = await semantic_search(user_message, final_products)
-                                print(f"🧠 [RAG] LLM reranking completed")
                             
-                            print(f"✅ [RAG] Vector search found {len(final_products)} relevant products")
+                            logger.debug("[RAG] Vector search found %s relevant products", len(final_products))
                         except Exception as vec_error:
                             # Vector search failed (model chưa load, hoặc lỗi khác)
-                            print(f"⚠️ [RAG] Vector search failed: {vec_error}, falling back to keyword search")
+                            logger.warning("[RAG] Vector search failed: %s, falling back to keyword search", vec_error)
                             use_vector_search = False  # Trigger fallback
                             raise  # Re-raise để trigger fallback block
                     else:
-                        print("⚠️ [RAG] No products from backend, skipping vector search")
+                        logger.info("[RAG] No products from backend, skipping vector search")
                         use_vector_search = False  # Fallback to keyword
                 except Exception as e:
                     # Vector search failed, fallback to keyword search
-                    print(f"⚠️ [RAG] Vector search error: {e}, falling back to keyword search")
+                    logger.warning("[RAG] Vector search error: %s, falling back to keyword search", e)
                     use_vector_search = False
             
             # Nếu vector search thành công nhưng không ra sản phẩm, fallback keyword search
             if use_vector_search and not final_products:
-                print("🔄 [RAG] No products from vector search, fallback to keyword search")
+                logger.info("[RAG] No products from vector search, fallback to keyword search")
+                record_fallback("product_keyword_search")
                 search_term_used = extract_search_term(user_message)
                 keyword_results = await get_products_from_backend(backend_url, search_term_used)
                 keyword_results = prefilter_products_by_price(keyword_results, price_condition, price_value)
-                print(f"📦 [RAG] Keyword fallback found: {len(keyword_results)} products")
+                logger.info("[RAG] Keyword fallback found: %s products", len(keyword_results))
                 final_products = keyword_results
 
             if not use_vector_search:
                 # ===== KEYWORD SEARCH (Fallback) =====
-                print("🔑 [RAG] Using Keyword Search (fallback)")
+                logger.info("[RAG] Using Keyword Search (fallback)")
+                record_fallback("vector_search_unavailable")
                 search_term_used = extract_search_term(user_message)
                 keyword_results = await get_products_from_backend(backend_url, search_term_used)
                 keyword_results = prefilter_products_by_price(keyword_results, price_condition, price_value)
-                print(f"📦 [RAG] Keyword search found: {len(keyword_results)} products")
+                logger.debug("[RAG] Keyword search found: %s products", len(keyword_results))
                 final_products = keyword_results
         
         # Reviews và FAQs vẫn dùng keyword-based (có thể upgrade sau)
@@ -761,16 +997,15 @@ async def retrieve_context(
             "faqs": faqs,
             "policies": relevant_policies,  # Thêm kết quả PDF vào context
             "query": user_message,
-            "search_term": search_term_used
+            "search_term": search_term_used,
+            "model_match": bool(model_match and final_products)
         }
         
-        print(f"✅ [RAG] Retrieved: {len(context['products'])} products, {len(context['reviews'])} reviews, {len(context['faqs'])} FAQs")
+        logger.debug("[RAG] Retrieved: %s products, %s reviews, %s FAQs", len(context['products']), len(context['reviews']), len(context['faqs']))
         
         return context
     except Exception as e:
-        print(f"[RAG] Error in retrieval: {e}")
-        import traceback
-        traceback.print_exc()
+        logger.exception("[RAG] Error in retrieval: %s", e)
         return {
             "products": [],
             "reviews": [],
@@ -779,56 +1014,160 @@ async def retrieve_context(
             "search_term": ""
         }
 
-def format_rag_context(context: Dict) -> str:
-    formatted_context = ""
-    
-     # Thêm phần Chính sách từ PDF vào format ngữ cảnh
-    if context.get("policies"):
-        formatted_context += "\n\n[QUY ĐỊNH CỬA HÀNG TỪ PDF]:\n"
-        for p in context["policies"]:
-            formatted_context += f"- {p['content']}\n"
-        formatted_context += "⚠️ LƯU Ý: Trả lời khách đúng theo quy định này.\n"
-
-    if context.get("products"):
-        formatted_context += "\n\n[THÔNG TIN SẢN PHẨM TỪ DATABASE - DỮ LIỆU THỰC TẾ]:\n"
-        formatted_context += "Đây là danh sách sản phẩm được tìm thấy (đã được xếp hạng theo mức độ liên quan):\n\n"
-        
-        for idx, product in enumerate(context["products"][:5], 1):
-            formatted_context += f"{idx}. {product['name']}\n"
-            formatted_context += f"   - Danh mục: {product.get('category', 'N/A')}\n"
-            price = product.get('price', 0)
-            formatted_context += f"   - Giá: {price:,} VNĐ ({price/1000000:.1f} triệu đồng)\n"
-            stock = product.get('stockQuantity', 0)
-            formatted_context += f"   - Tồn kho: {'Còn ' + str(stock) + ' sản phẩm' if stock > 0 else 'Hết hàng'}\n"
-            desc = product.get('description', '')
-            if desc:
-                desc_short = desc[:150] + "..." if len(desc) > 150 else desc
-                formatted_context += f"   - Mô tả: {desc_short}\n"
-            formatted_context += f"   - Product ID: {product.get('productId', 'N/A')}\n\n"
-        
-        formatted_context += "⚠️ QUAN TRỌNG: Bạn PHẢI sử dụng CHÍNH XÁC thông tin trên để trả lời. "
-        formatted_context += "Đây là dữ liệu THỰC TẾ từ database. "
-        formatted_context += "Nếu khách hỏi về giá, hãy LỌC và LIỆT KÊ các sản phẩm phù hợp.\n"
-    
-    if context.get("reviews"):
-        formatted_context += "\n\n[ĐÁNH GIÁ TỪ KHÁCH HÀNG]:\n"
-        for idx, review in enumerate(context["reviews"][:3], 1):
-            product_name = review.get('product', {}).get('name', 'N/A')
-            rating = review.get('rating', 0)
-            comment = review.get('comment', '')
-            formatted_context += f"{idx}. {product_name}: {rating}/5 sao\n"
-            formatted_context += f'   "{comment}"\n\n'
-    
-    if context.get("faqs"):
-        formatted_context += "\n\n[THÔNG TIN HỖ TRỢ]:\n"
-        for faq in context["faqs"]:
-            formatted_context += f"Q: {faq['question']}\n"
-            formatted_context += f"A: {faq['answer']}\n\n"
-    
+# --- Token budget cho context gửi Gemini ---
+# Prompt càng dài thì Gemini càng chậm và càng tốn quota → context được lắp theo ngân sách token:
+# mỗi mục (policy / sản phẩm / review / FAQ) có điểm liên quan, mục điểm cao được đưa vào trước,
+# mục không vừa thì thử bản rút gọn, cuối cùng mới bị bỏ.
+RAG_CONTEXT_MAX_TOKENS = int(os.getenv("RAG_CONTEXT_MAX_TOKENS", "1500"))
+_SECTION_WEIGHTS = {"policies": 1.0, "products": 1.0, "reviews": 0.5, "faqs": 0.4}
+_MIN_TRUNCATED_TOKENS = 40  # Phần còn lại nhỏ hơn mức này thì bỏ hẳn thay vì cắt cụt
+
+_SECTION_HEADERS = {
+    "policies": "\n\n[QUY ĐỊNH CỬA HÀNG TỪ PDF]:\n",
+    "products": (
+        "\n\n[THÔNG TIN SẢN PHẨM TỪ DATABASE - DỮ LIỆU THỰC TẾ]:\n"
+        "Đây là danh sách sản phẩm được tìm thấy (đã được xếp hạng theo mức độ liên quan):\n\n"
+    ),
+    "reviews": "\n\n[ĐÁNH GIÁ TỪ KHÁCH HÀNG]:\n",
+    "faqs": "\n\n[THÔNG TIN HỖ TRỢ]:\n",
+}
+_SECTION_FOOTERS = {
+    "policies": "⚠️ LƯU Ý: Trả lời khách đúng theo quy định này.\n",
+    "products": (
+        "⚠️ QUAN TRỌNG: Bạn PHẢI sử dụng CHÍNH XÁC thông tin trên để trả lời. "
+        "Đây là dữ liệu THỰC TẾ từ database. "
+        "Nếu khách hỏi về giá, hãy LỌC và LIỆT KÊ các sản phẩm phù hợp.\n"
+    ),
+    "reviews": "",
+    "faqs": "",
+}
+
+def _format_policy(p: Dict, compact: bool = False) -> str:
+    content = p["content"]
+    if p.get("section") and not compact:
+        return f"- ({p['section']}) {content}\n"
+    return f"- {content}\n"
+
+def _format_product(product: Dict, idx: int, compact: bool = False) -> str:
+    price = product.get('price', 0)
+    stock = product.get('stockQuantity', 0)
+    lines = [
+        f"{idx}. {product['name']}\n",
+        f"   - Danh mục: {product.get('category', 'N/A')}\n",
+        f"   - Giá: {price:,} VNĐ ({price/1000000:.1f} triệu đồng)\n",
+        f"   - Tồn kho: {'Còn ' + str(stock) + ' sản phẩm' if stock > 0 else 'Hết hàng'}\n",
+    ]
+    desc = product.get('description', '')
+    if desc and not compact:
+        desc_short = desc[:150] + "..." if len(desc) > 150 else desc
+        lines.append(f"   - Mô tả: {desc_short}\n")
+    lines.append(f"   - Product ID: {product.get('productId', 'N/A')}\n\n")
+    return "".join(lines)
+
+def _format_review(review: Dict, idx: int, compact: bool = False) -> str:
+    product_name = review.get('product', {}).get('name', 'N/A')
+    rating = review.get('rating', 0)
+    comment = review.get('comment', '')
+    if compact and len(comment) > 120:
+        comment = comment[:120] + "..."
+    return f'{idx}. {product_name}: {rating}/5 sao\n   "{comment}"\n\n'
+
+def _format_faq(faq: Dict) -> str:
+    return f"Q: {faq['question']}\nA: {faq['answer']}\n\n"
+
+def _truncate_to_tokens(text: str, max_tokens: int) -> str:
+    max_chars = max_tokens * 4 - 4
+    if len(text) <= max_chars:
+        return text
+    return text[:max_chars].rsplit(" ", 1)[0] + "...\n"
+
+def _context_candidates(context: Dict) -> List[Dict]:
+    """Các mục có thể đưa vào context, kèm điểm liên quan (0..1) * trọng số section"""
+    candidates = []
+
+    def add(section: str, pos: int, relevance: float, render):
+        candidates.append({
+            "section": section,
+            "pos": pos,
+            "score": _SECTION_WEIGHTS[section] * relevance,
+            "render": render,
+        })
+
+    for pos, p in enumerate(context.get("policies") or []):
+        relevance = float(p.get("score", 0.5 / (1 + pos)))
+        add("policies", pos, relevance, lambda compact, p=p: _format_policy(p, compact))
+    for pos, product in enumerate((context.get("products") or [])[:5]):
+        add("products", pos, 1.0 / (1 + 0.5 * pos), lambda compact, product=product, pos=pos: _format_product(product, pos + 1, compact))
+    for pos, review in enumerate((context.get("reviews") or [])[:3]):
+        add("reviews", pos, 1.0 / (1 + pos), lambda compact, review=review, pos=pos: _format_review(review, pos + 1, compact))
+    for pos, faq in enumerate(context.get("faqs") or []):
+        add("faqs", pos, 1.0 / (1 + pos), lambda compact, faq=faq: _format_faq(faq))
+    return candidates
+
+def build_rag_context(context: Dict, max_tokens: int = RAG_CONTEXT_MAX_TOKENS) -> Tuple[str, Dict]:
+    """
+    Lắp context cho Gemini trong giới hạn max_tokens (ước lượng).
+
+    Returns:
+        (formatted_context, stats) với stats = {"tokens", "budget", "sections": {section: {"kept", "total"}}}
+    """
+    candidates = _context_candidates(context)
+    overhead = {
+        section: estimate_tokens(_SECTION_HEADERS[section]) + estimate_tokens(_SECTION_FOOTERS[section])
+        for section in _SECTION_HEADERS
+    }
+
+    used = 0
+    opened = set()
+    selected = []
+    for item in sorted(candidates, key=lambda c: -c["score"]):
+        section = item["section"]
+        section_cost = 0 if section in opened else overhead[section]
+        remaining = max_tokens - used - section_cost
+        text = item["render"](False)
+        if estimate_tokens(text) > remaining:
+            text = item["render"](True)
+        if estimate_tokens(text) > remaining:
+            if remaining < _MIN_TRUNCATED_TOKENS:
+                continue
+            text = _truncate_to_tokens(text, remaining)
+        used += section_cost + estimate_tokens(text)
+        opened.add(section)
+        selected.append((item, text))
+
+    # Giữ thứ tự gốc trong mỗi section (thứ hạng retrieval), đánh số lại sau khi lọc
+    parts = []
+    for section in ("policies", "products", "reviews", "faqs"):
+        items = sorted((x for x in selected if x[0]["section"] == section), key=lambda x: x[0]["pos"])
+        if not items:
+            continue
+        parts.append(_SECTION_HEADERS[section])
+        for idx, (item, text) in enumerate(items, 1):
+            if section in ("products", "reviews"):
+                text = re.sub(r"^\d+\.", f"{idx}.", text, count=1)
+            parts.append(text)
+        parts.append(_SECTION_FOOTERS[section])
+
+    stats = {
+        "tokens": used,
+        "budget": max_tokens,
+        "sections": {
+            section: {
+                "kept": sum(1 for item, _ in selected if item["section"] == section),
+                "total": sum(1 for item in candidates if item["section"] == section),
+            }
+            for section in _SECTION_HEADERS
+        },
+    }
+    return "".join(parts), stats
+
+def format_rag_context(context: Dict, max_tokens: int = RAG_CONTEXT_MAX_TOKENS) -> str:
+    formatted_context, stats = build_rag_context(context, max_tokens)
+    context["context_stats"] = stats
+    kept = ", ".join(f"{k} {v['kept']}/{v['total']}" for k, v in stats["sections"].items() if v["total"])
+    logger.debug("[RAG] Context tokens: ~%s/%s (%s)", stats['tokens'], stats['budget'], kept or 'empty')
     return formatted_context
 
-# Gọi nạp PDF ngay khi khởi động app
-load_policies_from_pdfs()
 
 
 # rag_service.py
@@ -840,7 +1179,7 @@ async def identify_phone_from_image(image_bytes: bytes) -> str:
     Sử dụng Gemini Vision để nhận diện tên điện thoại từ hình ảnh.
     Có cơ chế tự động thử model khác nếu model mặc định lỗi.
     """
-    print("[VISION] Analyzing image...")
+    logger.debug("[VISION] Analyzing image...")
     
     # Danh sách các model vision để thử lần lượt (ưu tiên Flash vì nhanh/rẻ)
     candidate_models = [
@@ -851,9 +1190,10 @@ async def identify_phone_from_image(image_bytes: bytes) -> str:
 
     image = None
     try:
+        import PIL.Image
         image = PIL.Image.open(io.BytesIO(image_bytes))
     except Exception as e:
-        print(f"[VISION] Lỗi đọc ảnh: {e}")
+        logger.warning("[VISION] Lỗi đọc ảnh: %s", e)
         return ""
 
     prompt = """
@@ -865,19 +1205,21 @@ async def identify_phone_from_image(image_bytes: bytes) -> str:
 
     for model_name in candidate_models:
         try:
-            print(f"[VISION] Trying model: {model_name}...")
-            model = genai.GenerativeModel(model_name)
-            response = model.generate_content([prompt, image])
+            logger.debug("[VISION] Trying model: %s...", model_name)
+            model = get_generative_model(model_name)
+            response = await get_llm_admission().run(lambda: model.generate_content([prompt, image]))
             
             if response and response.text:
                 result = response.text.strip()
-                print(f"[VISION] Success with {model_name}: {result}")
+                logger.debug("[VISION] Success with %s: %s", model_name, result)
                 return result
                 
+        except Overloaded:
+            raise
         except Exception as e:
             # Nếu lỗi "Not Found" hoặc lỗi khác, thử model tiếp theo
-            print(f"[VISION] Failed with {model_name}: {str(e)}")
+            logger.warning("[VISION] Failed with %s: %s", model_name, str(e))
             continue
 
-    print("[VISION] All models failed to analyze the image.")
+    logger.warning("[VISION] All models failed to analyze the image.")
     return ""
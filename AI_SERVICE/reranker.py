@@ -0,0 +1,118 @@
+"""
+Reranker - Xếp hạng lại sản phẩm bằng cross-encoder đa ngôn ngữ chạy local (CPU)
+
+Thay cho việc gửi cả danh sách sản phẩm lên Gemini để xếp hạng (1 round-trip LLM mỗi request):
+cross-encoder chấm điểm từng cặp (câu hỏi, mô tả sản phẩm) theo batch cho top-k ứng viên của vector search.
+
+- Model được load ở background lần đầu cần dùng; trong lúc chưa load xong, thứ tự vector search được giữ nguyên
+- Ngân sách thời gian RERANK_BUDGET_MS: hết ngân sách giữa chừng thì các ứng viên chưa chấm
+  giữ thứ tự vector search và xếp sau các ứng viên đã chấm
+"""
+
+import os
+import threading
+import time
+from typing import Callable, Dict, List, Optional
+
+import numpy as np
+
+from app_logging import get_logger
+
+logger = get_logger(__name__)
+
+RERANKER_ENABLED = os.getenv("RERANKER_ENABLED", "1") == "1"
+RERANKER_MODEL = os.getenv("RERANKER_MODEL", "cross-encoder/mmarco-mMiniLMv2-L12-H384-v1")
+RERANK_TOP_K = int(os.getenv("RERANK_TOP_K", "10"))
+RERANK_BATCH_SIZE = int(os.getenv("RERANK_BATCH_SIZE", "8"))
+RERANK_BUDGET_MS = float(os.getenv("RERANK_BUDGET_MS", "150"))
+RERANK_MAX_LENGTH = 256  # token tối đa của mỗi cặp (query, sản phẩm)
+
+_model = None
+_load_started = False
+_load_error: Optional[str] = None
+_lock = threading.Lock()
+
+
+def _load_model():
+    global _model, _load_error, _load_started
+    try:
+        from sentence_transformers import CrossEncoder
+        logger.info("[RERANK] Loading cross-encoder %s...", RERANKER_MODEL)
+        _model = CrossEncoder(RERANKER_MODEL, max_length=RERANK_MAX_LENGTH, device="cpu")
+        _load_error = None
+        logger.info("[RERANK] Loaded cross-encoder: %s", RERANKER_MODEL)
+    except Exception as e:
+        _load_error = str(e)
+        _load_started = False  # Cho phép thử lại lần sau
+        logger.warning("[RERANK] Failed to load cross-encoder: %s, keeping vector order", e)
+
+
+def get_reranker(wait: bool = False):
+    """Cross-encoder nếu đã sẵn sàng; lần đầu gọi sẽ bắt đầu load (wait=True thì load đồng bộ)"""
+    global _load_started
+    if _model is not None or not RERANKER_ENABLED:
+        return _model
+    with _lock:
+        if _model is None and not _load_started:
+            _load_started = True
+            if wait:
+                _load_model()
+            else:
+                threading.Thread(target=_load_model, name="reranker-loader", daemon=True).start()
+    return _model
+
+
+def warm_up():
+    """Load cross-encoder (chờ tới khi xong) và chạy 1 lần predict mẫu - dùng cho warm-up lúc startup"""
+    if not RERANKER_ENABLED:
+        return
+    model = get_reranker(wait=True)
+    while model is None and _load_started and _load_error is None:
+        time.sleep(0.2)  # Thread khác đang load
+        model = _model
+    if model is None:
+        raise RuntimeError(_load_error or "cross-encoder not loaded")
+    model.predict([("điện thoại chụp đêm đẹp", "Camera chụp đêm xuất sắc")], show_progress_bar=False)
+
+
+def get_reranker_status() -> Dict:
+    if not RERANKER_ENABLED:
+        return {"status": "disabled"}
+    if _model is not None:
+        return {"status": "loaded", "model": RERANKER_MODEL, "top_k": RERANK_TOP_K, "budget_ms": RERANK_BUDGET_MS}
+    if _load_error:
+        return {"status": "error", "error": _load_error}
+    return {"status": "loading" if _load_started else "not_started", "model": RERANKER_MODEL}
+
+
+def rerank(
+    query: str,
+    candidates: List[Dict],
+    text_fn: Callable[[Dict], str],
+    top_k: int = RERANK_TOP_K,
+    budget_ms: float = RERANK_BUDGET_MS,
+) -> List[Dict]:
+    """
+    Xếp hạng lại top_k ứng viên đầu (đã sắp theo vector search) bằng cross-encoder.
+    Các ứng viên ngoài top_k giữ nguyên vị trí phía sau.
+    """
+    model = get_reranker()
+    head, tail = candidates[:top_k], candidates[top_k:]
+    if model is None or len(head) < 2:
+        return candidates
+
+    started = time.perf_counter()
+    scores: List[float] = []
+    for start in range(0, len(head), RERANK_BATCH_SIZE):
+        batch = head[start:start + RERANK_BATCH_SIZE]
+        pairs = [(query, text_fn(p)) for p in batch]
+        scores.extend(float(s) for s in np.atleast_1d(model.predict(pairs, batch_size=len(pairs), show_progress_bar=False)))
+        if (time.perf_counter() - started) * 1000 > budget_ms and start + RERANK_BATCH_SIZE < len(head):
+            logger.info("[RERANK] Budget %.0fms exceeded after %s/%s candidates", budget_ms, len(scores), len(head))
+            break
+
+    scored = len(scores)
+    order = sorted(range(scored), key=lambda i: scores[i], reverse=True)
+    elapsed = (time.perf_counter() - started) * 1000
+    logger.info("[RERANK] Reranked %s candidates in %.0fms", scored, elapsed)
+    return [head[i] for i in order] + head[scored:] + tail
@@ -0,0 +1,122 @@
+"""
+Semantic Answer Cache - Cache câu trả lời theo độ tương đồng embedding của câu hỏi
+
+Cache theo text chính xác bỏ sót các câu hỏi diễn đạt khác nhau nhưng cùng ý
+("iphone tầm 15 triệu" / "iphone khoảng 15tr"). Cache này lưu (embedding câu hỏi, id sản phẩm,
+câu trả lời) và trả lại câu trả lời khi:
+- cosine similarity với câu hỏi đã cache >= SEMANTIC_CACHE_THRESHOLD, và
+- intent đã parse (ngôn ngữ, brand, điều kiện giá, con số) trùng khớp hoàn toàn
+  → "iphone dưới 10 triệu" không bao giờ dùng câu trả lời của "iphone dưới 20 triệu".
+
+Chỉ dùng cho câu hỏi đầu tiên của hội thoại (câu trả lời không phụ thuộc history).
+"""
+
+import os
+import time
+from collections import OrderedDict
+from typing import Dict, Hashable, List, Optional
+
+import numpy as np
+
+from app_logging import get_logger
+
+logger = get_logger(__name__)
+
+SEMANTIC_CACHE_ENABLED = os.getenv("SEMANTIC_CACHE_ENABLED", "1") == "1"
+SEMANTIC_CACHE_THRESHOLD = float(os.getenv("SEMANTIC_CACHE_THRESHOLD", "0.92"))
+SEMANTIC_CACHE_SIZE = int(os.getenv("SEMANTIC_CACHE_SIZE", "1000"))
+SEMANTIC_CACHE_TTL = float(os.getenv("SEMANTIC_CACHE_TTL", "600"))  # giây, giá/tồn kho có thể thay đổi
+
+
+class SemanticAnswerCache:
+    """
+    LRU giới hạn max_entries. Entry được chia bucket theo intent → mỗi lookup chỉ so cosine
+    với các câu hỏi cùng intent (1 phép nhân ma trận nhỏ).
+    """
+
+    def __init__(self, max_entries: int = SEMANTIC_CACHE_SIZE, threshold: float = SEMANTIC_CACHE_THRESHOLD,
+                 ttl: float = SEMANTIC_CACHE_TTL):
+        self.max_entries = max_entries
+        self.threshold = threshold
+        self.ttl = ttl
+        self._entries: "OrderedDict[int, Dict]" = OrderedDict()
+        self._buckets: Dict[Hashable, List[int]] = {}
+        self._next_id = 0
+        self.hits = 0
+        self.misses = 0
+
+    def _remove(self, entry_id: int):
+        entry = self._entries.pop(entry_id)
+        bucket = self._buckets[entry["intent"]]
+        bucket.remove(entry_id)
+        if not bucket:
+            del self._buckets[entry["intent"]]
+
+    def lookup(self, embedding: np.ndarray, intent: Hashable) -> Optional[Dict]:
+        """Entry có câu hỏi gần nhất cùng intent nếu đạt ngưỡng, ngược lại None"""
+        now = time.time()
+        for entry_id in list(self._buckets.get(intent, ())):
+            if now - self._entries[entry_id]["created_at"] > self.ttl:
+                self._remove(entry_id)
+
+        ids = self._buckets.get(intent)
+        if not ids:
+            self.misses += 1
+            return None
+
+        matrix = np.stack([self._entries[i]["embedding"] for i in ids])
+        sims = matrix @ embedding
+        best = int(np.argmax(sims))
+        if float(sims[best]) < self.threshold:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        entry_id = ids[best]
+        self._entries.move_to_end(entry_id)
+        entry = self._entries[entry_id]
+        logger.debug('[CACHE] Semantic hit (sim=%.3f) for "%s"', float(sims[best]), entry['query'])
+        return entry
+
+    def store(self, embedding: np.ndarray, intent: Hashable, query: str, product_ids: List[str],
+              data: Dict, products: Optional[List[Dict]] = None):
+        """
+        Lưu câu trả lời. data là payload response (response/products/type),
+        products là dữ liệu sản phẩm gốc (để session trả lời câu hỏi nối tiếp).
+        """
+        entry_id = self._next_id
+        self._next_id += 1
+        self._entries[entry_id] = {
+            "embedding": np.asarray(embedding, dtype=np.float32),
+            "intent": intent,
+            "query": query,
+            "product_ids": product_ids,
+            "data": data,
+            "products": products or [],
+            "created_at": time.time(),
+        }
+        self._buckets.setdefault(intent, []).append(entry_id)
+        while len(self._entries) > self.max_entries:
+            self._remove(next(iter(self._entries)))
+
+    def clear(self):
+        self._entries.clear()
+        self._buckets.clear()
+
+    def stats(self) -> Dict:
+        total = self.hits + self.misses
+        return {
+            "enabled": SEMANTIC_CACHE_ENABLED,
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 4) if total else 0.0,
+            "threshold": self.threshold,
+        }
+
+
+_cache = SemanticAnswerCache()
+
+
+def get_semantic_cache() -> SemanticAnswerCache:
+    return _cache
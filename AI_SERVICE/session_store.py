@@ -0,0 +1,88 @@
+"""
+Session Store - Lưu trạng thái hội thoại phía server theo sessionId
+
+Mỗi session giữ:
+- history: lịch sử đã nén (định dạng Gemini {"role", "parts"}) → client không cần gửi lại toàn bộ
+- products: danh sách sản phẩm vừa hiển thị → câu hỏi nối tiếp ("cái thứ hai giá bao nhiêu")
+  được trả lời từ dữ liệu này, không cần gọi backend hay tạo embedding mới
+
+Mặc định dùng InMemorySessionStore (LRU + TTL). Có thể thay bằng backend khác (Redis...)
+bằng cách kế thừa SessionStore và gọi set_session_store().
+"""
+
+import os
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from typing import Dict, Optional
+
+SESSION_TTL = float(os.getenv("SESSION_TTL", "1800"))  # giây không hoạt động trước khi hết hạn
+SESSION_MAX = int(os.getenv("SESSION_MAX", "10000"))
+
+
+def new_session() -> Dict:
+    return {"history": [], "products": [], "updated_at": time.time()}
+
+
+class SessionStore(ABC):
+    """Interface cho session store"""
+
+    @abstractmethod
+    def get(self, session_id: str) -> Optional[Dict]:
+        ...
+
+    @abstractmethod
+    def save(self, session_id: str, session: Dict):
+        ...
+
+    @abstractmethod
+    def delete(self, session_id: str):
+        ...
+
+    def stats(self) -> Dict:
+        return {}
+
+
+class InMemorySessionStore(SessionStore):
+    """Session trong memory của process: LRU giới hạn max_sessions, hết hạn sau ttl giây"""
+
+    def __init__(self, max_sessions: int = SESSION_MAX, ttl: float = SESSION_TTL):
+        self.max_sessions = max_sessions
+        self.ttl = ttl
+        self._sessions: "OrderedDict[str, Dict]" = OrderedDict()
+
+    def get(self, session_id: str) -> Optional[Dict]:
+        session = self._sessions.get(session_id)
+        if session is None:
+            return None
+        if time.time() - session["updated_at"] > self.ttl:
+            del self._sessions[session_id]
+            return None
+        self._sessions.move_to_end(session_id)
+        return session
+
+    def save(self, session_id: str, session: Dict):
+        session["updated_at"] = time.time()
+        self._sessions[session_id] = session
+        self._sessions.move_to_end(session_id)
+        while len(self._sessions) > self.max_sessions:
+            self._sessions.popitem(last=False)
+
+    def delete(self, session_id: str):
+        self._sessions.pop(session_id, None)
+
+    def stats(self) -> Dict:
+        return {"backend": "memory", "sessions": len(self._sessions), "ttl": self.ttl}
+
+
+_store: SessionStore = InMemorySessionStore()
+
+
+def get_session_store() -> SessionStore:
+    return _store
+
+
+def set_session_store(store: SessionStore):
+    """Thay session store (vd: Redis) - gọi lúc khởi động app"""
+    global _store
+    _store = store
@@ -0,0 +1,51 @@
+"""
+Single-flight - Gộp các request giống nhau đang chạy đồng thời
+
+Khi nhiều user cùng bấm một câu hỏi gợi ý (khuyến mãi...), chỉ request đầu tiên thực sự chạy
+retrieval / gọi backend / gọi Gemini; các request trùng key đến trong lúc đó chờ và dùng chung kết quả.
+Kết quả không được cache: khi lần chạy kết thúc, request tiếp theo với cùng key sẽ chạy lại.
+"""
+
+import asyncio
+from typing import Awaitable, Callable, Dict, Hashable, TypeVar
+
+from app_logging import get_logger
+
+logger = get_logger(__name__)
+
+T = TypeVar("T")
+
+
+class SingleFlight:
+    def __init__(self, name: str):
+        self.name = name
+        self._inflight: Dict[Hashable, asyncio.Future] = {}
+        self.executed = 0  # số lần thực sự chạy
+        self.shared = 0    # số request dùng chung kết quả của lần chạy khác
+
+    def _done(self, key: Hashable, task: asyncio.Future):
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+        # Đánh dấu exception đã được đọc (tránh cảnh báo khi mọi request chờ đều bị hủy)
+        if not task.cancelled():
+            task.exception()
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable[T]]) -> T:
+        """
+        Chạy fn() nếu chưa có lần chạy nào với key này, ngược lại chờ lần chạy đang diễn ra.
+        Lần chạy được shield: request khởi tạo bị hủy (client ngắt kết nối) không làm hủy
+        kết quả của các request khác đang chờ.
+        """
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(fn())
+            self._inflight[key] = task
+            task.add_done_callback(lambda t, k=key: self._done(k, t))
+            self.executed += 1
+        else:
+            self.shared += 1
+            logger.debug("[SINGLEFLIGHT] %s: joined in-flight call", self.name)
+        return await asyncio.shield(task)
+
+    def stats(self) -> Dict:
+        return {"in_flight": len(self._inflight), "executed": self.executed, "shared": self.shared}
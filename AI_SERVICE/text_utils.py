@@ -0,0 +1,32 @@
+"""
+Text helpers dùng chung: bỏ dấu tiếng Việt và tách token để so khớp không phân biệt dấu
+("bảo hành" == "bao hanh", "điện thoại" == "dien thoai")
+"""
+
+import math
+import re
+import unicodedata
+from typing import List
+
+_TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+
+
+def fold_text(text: str) -> str:
+    """Chữ thường + bỏ dấu tiếng Việt (đ → d)"""
+    if not text:
+        return ""
+    text = text.lower().replace("đ", "d")
+    decomposed = unicodedata.normalize("NFD", text)
+    return "".join(ch for ch in decomposed if not unicodedata.combining(ch))
+
+
+def folded_tokens(text: str, min_len: int = 1) -> List[str]:
+    """Tách text đã bỏ dấu thành các token chữ/số"""
+    return [tok for tok in _TOKEN_RE.findall(fold_text(text)) if len(tok) >= min_len]
+
+
+def estimate_tokens(text: str) -> int:
+    """Ước lượng số token gửi lên Gemini (~4 ký tự / token), không cần tokenizer thật"""
+    if not text:
+        return 0
+    return max(1, math.ceil(len(text) / 4))
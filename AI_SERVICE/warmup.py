@@ -0,0 +1,118 @@
+"""
+Warm-up - Làm nóng worker trước khi nhận traffic (readiness gate cho load balancer)
+
+Lifespan của app chạy Warmup ở background task: load model, chạy 1 lần forward mẫu, nạp index...
+/ready chỉ trả 200 khi mọi bước bắt buộc đã xong → không request thật nào phải chịu
+thời gian tải model / lần encode đầu tiên.
+
+- Các bước trong cùng 1 chuỗi chạy tuần tự (vd: embedding model → index chính sách dùng model đó),
+  các chuỗi khác nhau chạy song song
+- Bước bắt buộc lỗi → worker chưa ready, thử lại sau WARMUP_RETRY_INTERVAL giây
+- Bước tùy chọn vẫn được chờ chạy xong, nhưng nếu lỗi (vd: backend chưa chạy nên không đồng bộ được
+  catalog) thì worker vẫn ready, /ready báo "degraded"
+"""
+
+import asyncio
+import os
+import time
+from typing import Awaitable, Callable, Dict, List, NamedTuple, Sequence
+
+from app_logging import get_logger
+
+logger = get_logger(__name__)
+
+WARMUP_ENABLED = os.getenv("WARMUP_ENABLED", "1") == "1"
+WARMUP_RETRY_INTERVAL = float(os.getenv("WARMUP_RETRY_INTERVAL", "30"))  # giây
+
+
+class WarmupStep(NamedTuple):
+    name: str
+    run: Callable[[], Awaitable[None]]
+    required: bool = True
+
+
+class Warmup:
+    def __init__(self, chains: Sequence[Sequence[WarmupStep]]):
+        self.chains = [list(chain) for chain in chains]
+        self._steps: Dict[str, Dict] = {
+            step.name: {"status": "pending", "required": step.required} for chain in self.chains for step in chain
+        }
+        self.started_at = None
+        self.finished_at = None
+
+    async def _run_step(self, step: WarmupStep) -> bool:
+        state = self._steps[step.name]
+        state.update(status="running", error=None)
+        started = time.perf_counter()
+        try:
+            await step.run()
+            state["status"] = "done"
+            return True
+        except Exception as e:
+            state.update(status="failed", error=str(e))
+            log = logger.warning if step.required else logger.info
+            log("[WARMUP] Step %s failed: %s", step.name, e)
+            return False
+        finally:
+            state["seconds"] = round(time.perf_counter() - started, 2)
+
+    async def _run_chain(self, chain: List[WarmupStep]):
+        for i, step in enumerate(chain):
+            if not await self._run_step(step) and step.required:
+                # Các bước sau phụ thuộc bước bắt buộc này → chờ lần thử lại
+                for later in chain[i + 1:]:
+                    self._steps[later.name]["status"] = "pending"
+                return
+
+    async def run(self):
+        """Chạy toàn bộ warm-up, sau đó thử lại định kỳ các chuỗi còn bước bắt buộc chưa xong"""
+        self.started_at = time.time()
+        await asyncio.gather(*(self._run_chain(chain) for chain in self.chains))
+        self.finished_at = time.time()
+        logger.info("[WARMUP] Finished in %.1fs: %s", self.finished_at - self.started_at, self.status()["status"])
+
+        while not self.is_ready():
+            await asyncio.sleep(WARMUP_RETRY_INTERVAL)
+            pending = [
+                [s for s in chain if self._steps[s.name]["status"] != "done"]
+                for chain in self.chains
+                if any(s.required and self._steps[s.name]["status"] != "done" for s in chain)
+            ]
+            await asyncio.gather(*(self._run_chain(chain) for chain in pending))
+
+    async def wait_settled(self, name: str, poll_interval: float = 0.1):
+        """Chờ bước name chạy xong lần đầu (thành công hay lỗi đều được)"""
+        while self._steps[name]["status"] not in ("done", "failed"):
+            await asyncio.sleep(poll_interval)
+
+    def is_ready(self) -> bool:
+        """Bước bắt buộc đã xong, bước tùy chọn đã chạy xong (thành công hay lỗi đều được)"""
+        return all(
+            s["status"] == "done" if s["required"] else s["status"] in ("done", "failed")
+            for s in self._steps.values()
+        )
+
+    def status(self) -> Dict:
+        if self.is_ready():
+            status = "ready"
+        elif any(s["required"] and s["status"] == "failed" for s in self._steps.values()):
+            status = "failed"
+        else:
+            status = "warming_up"
+        return {
+            "status": status,
+            "degraded": [name for name, s in self._steps.items() if not s["required"] and s["status"] == "failed"],
+            "steps": {name: dict(s) for name, s in self._steps.items()},
+        }
+
+
+_warmup = Warmup([])
+
+
+def set_warmup(warmup: Warmup):
+    global _warmup
+    _warmup = warmup
+
+
+def get_warmup() -> Warmup:
+    return _warmup